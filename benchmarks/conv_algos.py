@@ -0,0 +1,111 @@
+"""
+Times every c_cnn.Convolve algo on the conv layer shapes of the shipped models
+and reports which one wins per shape, along with each algo's max abs error
+against "direct" for y, dx and dW. Exits with status 1 when an error is over
+the dtype's tolerance, so the engines cannot drift apart unnoticed.
+
+    python -m benchmarks.conv_algos [--batch 32] [--repeat 5] [--dtype d] [--out conv_algos.json]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from c_cnn.Convolve import Convolve
+from cnn.CNN import CNN
+from cnn.Tensor import Tensor
+
+MODELS = ["models/2conv.mwb", "models/3conv.mwb"]
+
+# max abs error against "direct" allowed per dtype (inputs and weights are O(1))
+TOLERANCE = {"d": 1e-8, "f": 1e-3}
+
+
+def conv_shapes(filenames, input_shape=(1, 32, 32)):
+    """(cin, cout, kh, kw, H, W) of every Convolve, found by pushing a zero input through each model."""
+    shapes = []
+    for filename in filenames:
+        model = CNN.from_mwb(filename)
+        x = Tensor.zeros(input_shape, model.dtype)
+        for layer in CNN._unfused(model.layers):
+            if isinstance(layer, Convolve):
+                shape = (layer.cin, layer.cout, layer.kh, layer.kw, *x.shape[1:])
+                if shape not in shapes:
+                    shapes.append(shape)
+            x = layer.forward(x, train=False)
+    return shapes
+
+
+def time_algo(algo, shape, batch, repeat, dtype="d"):
+    """(timings, (y, dx, dW) of one forward / backward pass); the same weights and inputs for every algo"""
+    cin, cout, kh, kw, H, W = shape
+    layer = Convolve(cin, cout, kh, kw, algo=algo)
+    for name in ("W", "b", "dW", "db"):
+        setattr(layer, name, getattr(layer, name).astype(dtype))
+
+    rng = random.Random(0)
+    x = Tensor([rng.uniform(0.0, 1.0) for _ in range(batch * cin * H * W)], (batch, cin, H, W)).astype(dtype)
+
+    best_fwd = best_bwd = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        y = layer.forward(x)
+        best_fwd = min(best_fwd, time.perf_counter() - t)
+
+        t = time.perf_counter()
+        layer.backward(y)
+        best_bwd = min(best_bwd, time.perf_counter() - t)
+
+    y = layer.forward(x)
+    dy = Tensor([rng.uniform(-1.0, 1.0) for _ in range(y.volume())], y.shape).astype(dtype)
+    layer.zero_grad()
+    dx = layer.backward(dy)
+    outputs = (list(y.data), list(dx.data), list(layer.dW.data))
+
+    macs = batch * cout * (H - kh + 1) * (W - kw + 1) * cin * kh * kw
+    return {"forward_s": best_fwd, "backward_s": best_bwd, "forward_ns_per_mac": best_fwd * 1e9 / macs}, outputs
+
+
+def max_error(a, b):
+    return max((abs(u - v) for u, v in zip(a, b)), default=0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--dtype", choices=("d", "f"), default="d", help="float64 or float32")
+    parser.add_argument("--out", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    drifted = False
+    for shape in conv_shapes(MODELS):
+        runs = {algo: time_algo(algo, shape, args.batch, args.repeat, args.dtype) for algo in Convolve.ALGOS}
+        timings = {algo: t for algo, (t, _) in runs.items()}
+        reference = runs["direct"][1]
+        for algo, (t, outputs) in runs.items():
+            t["max_error"] = dict(zip(("y", "dx", "dW"), map(max_error, outputs, reference)))
+            drifted |= max(t["max_error"].values()) > TOLERANCE[args.dtype]
+
+        winner = min(timings, key=lambda a: timings[a]["forward_s"])
+        results.append({"shape": dict(zip(("cin", "cout", "kh", "kw", "H", "W"), shape)), "dtype": args.dtype,
+                        "batch": args.batch, "timings": timings, "forward_winner": winner})
+
+        cells = "  ".join(f"{algo}: {t['forward_s'] * 1e3:7.2f}ms (err {max(t['max_error'].values()):.1e})"
+                          for algo, t in timings.items())
+        print(f"{shape[0]:>3}->{shape[1]:<3} {shape[2]}x{shape[3]} on {shape[4]}x{shape[5]}  {cells}  -> {winner}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    if drifted:
+        sys.exit(f"an algo is off from direct by more than {TOLERANCE[args.dtype]:g}, see max_error")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Load test of cnn.Server on localhost: starts the server in-process on a free port, runs
+--clients concurrent keep-alive HTTP clients that each POST --requests random images, and
+prints client-side throughput next to the server's latency percentiles and batch sizes.
+
+    python -m benchmarks.serving [--model models/2conv.mwb] [--clients 64] [--requests 20]
+                                 [--max-batch 32] [--max-wait-ms 2] [--unix /tmp/cnn.sock]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from cnn.Registry import registry
+from cnn.Server import Server
+
+PIXELS = 32 * 32
+
+
+async def _post(reader, writer, body):
+    writer.write(b"POST /predict HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/octet-stream\r\n"
+                 b"Content-Length: %d\r\n\r\n" % len(body) + body)
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        h = await reader.readline()
+        if h in (b"\r\n", b""):
+            break
+        name, _, value = h.decode().partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    payload = json.loads(await reader.readexactly(length))
+    if status != 200:
+        raise RuntimeError(f"HTTP {status}: {payload}")
+    return payload
+
+
+async def _client(connect, requests, rng):
+    reader, writer = await connect()
+    try:
+        for _ in range(requests):
+            await _post(reader, writer, bytes(rng.randrange(256) for _ in range(PIXELS)))
+    finally:
+        writer.close()
+
+
+async def run(model_path, clients, requests, max_batch, max_wait_ms, unix=None, random_seed=0):
+    server = Server(registry.get(model_path), max_batch, max_wait_ms)
+    if unix:
+        await server.start_unix(unix)
+
+        def connect():
+            return asyncio.open_unix_connection(unix)
+    else:
+        port = (await server.start("127.0.0.1", 0)).sockets[0].getsockname()[1]
+
+        def connect():
+            return asyncio.open_connection("127.0.0.1", port)
+
+    try:
+        t = time.perf_counter()
+        await asyncio.gather(*(_client(connect, requests, random.Random(random_seed + c)) for c in range(clients)))
+        elapsed = time.perf_counter() - t
+        return {"clients": clients, "requests": clients * requests, "elapsed_s": elapsed,
+                "requests_per_s": clients * requests / elapsed, "server": server.stats()}
+    finally:
+        await server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="models/2conv.mwb")
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=20, help="per client")
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=2.0)
+    parser.add_argument("--unix", help="serve on this Unix socket path instead of TCP")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.model, args.clients, args.requests, args.max_batch, args.max_wait_ms, args.unix))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
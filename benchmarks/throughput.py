@@ -0,0 +1,256 @@
+"""
+Per-layer and end-to-end throughput of the C-backed layers and the shipped models on
+synthetic inputs, swept over input shapes and batch sizes. Reports samples/sec, ns per
+multiply-accumulate and peak traced memory per case, as JSON that can be diffed across
+commits with --compare.
+
+    python -m benchmarks.throughput [--batch 1,16,64] [--repeat 5] [--dtype d] [--out bench.json]
+    python -m benchmarks.throughput --out new.json --compare old.json [--tolerance 0.1]
+    python -m benchmarks.throughput --arena  # models write their outputs into a cnn.Arena
+
+Batch 1 runs the unbatched (C, H, W) path that train_epoch(batch_size=1) uses, larger
+batches the (N, C, H, W) path. Times are the best of --repeat runs. Peak memory is what
+tracemalloc sees during one extra forward + backward, i.e. Python and PyMem allocations
+including the kernels' outputs and scratch buffers.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from c_cnn.Activation import ReLU, Sigmoid
+from c_cnn.Convolve import Convolve
+from c_cnn.c_extension import cnn
+from c_cnn.Dense import Dense
+from c_cnn.Loss import CrossEntropyLoss
+from c_cnn.Pooling import Pooling
+from cnn.Arena import Arena
+from cnn.CNN import CNN
+from cnn.Tensor import Tensor
+
+MODELS = ["models/2conv.mw", "models/3conv.mw"]
+INPUT_SHAPE = (1, 32, 32)
+CLASSES = 36
+
+# (layer factory, per-sample input shape): the layer shapes of the shipped models
+LAYERS = [
+    (lambda: Convolve(1, 16, 5, 5), (1, 32, 32)),
+    (lambda: Convolve(16, 32, 5, 5), (16, 14, 14)),
+    (lambda: Convolve(32, 64, 5, 5), (32, 5, 5)),
+    (lambda: Pooling(2, 2, stride=2, mode="max"), (16, 28, 28)),
+    (lambda: Pooling(2, 2, stride=2, mode="avg"), (16, 28, 28)),
+    (lambda: ReLU(), (16, 28, 28)),
+    (lambda: Sigmoid(), (16, 28, 28)),
+    (lambda: Dense(300, 36), (300,)),
+    (lambda: Dense(64, 36), (64,)),
+]
+
+
+def _volume(shape):
+    n = 1
+    for s in shape:
+        n *= s
+    return n
+
+
+def _macs(layer, shape):
+    """multiply-accumulates per sample of a Convolve / Dense on an input of shape, else 0"""
+    if isinstance(layer, Convolve):
+        _, H, W = shape
+        return layer.cout * (H - layer.kh + 1) * (W - layer.kw + 1) * layer.cin * layer.kh * layer.kw
+    if isinstance(layer, Dense):
+        return layer.din * layer.dout
+    return 0
+
+
+def _input(shape, batch, dtype, rng):
+    full = shape if batch == 1 else (batch, *shape)
+    return Tensor([rng.uniform(0.0, 1.0) for _ in range(_volume(full))], full).astype(dtype)
+
+
+def _best(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def _peak_bytes(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _record(kind, name, shape, batch, forward_s, backward_s, macs, peak):
+    total = forward_s + backward_s
+    return {
+        "kind": kind,
+        "name": name,
+        "input_shape": list(shape),
+        "batch": batch,
+        "forward_s": forward_s,
+        "backward_s": backward_s,
+        "samples_per_s": batch / total if total > 0 else None,
+        "forward_ns_per_mac": forward_s * 1e9 / (batch * macs) if macs else None,
+        "peak_bytes": peak,
+    }
+
+
+def bench_layer(make, shape, batch, dtype, repeat, rng):
+    layer = make()
+    if hasattr(layer, "W"):
+        layer.W, layer.b = layer.W.astype(dtype), layer.b.astype(dtype)
+        layer.dW, layer.db = layer.dW.astype(dtype), layer.db.astype(dtype)
+    x = _input(shape, batch, dtype, rng)
+
+    y = layer.forward(x)
+    dy = _input(y.shape[batch > 1:], batch, dtype, rng)
+
+    def fwd_bwd():
+        layer.forward(x)
+        layer.backward(dy)
+
+    forward_s = _best(lambda: layer.forward(x), repeat)
+    backward_s = _best(lambda: layer.backward(dy), repeat)
+    return _record("layer", str(layer), shape, batch, forward_s, backward_s, _macs(layer, shape), _peak_bytes(fwd_bwd))
+
+
+def bench_loss(batch, repeat, dtype, rng):
+    loss = CrossEntropyLoss()
+    pred = _input((CLASSES,), batch, dtype, rng)
+    y = rng.randrange(CLASSES) if batch == 1 else [rng.randrange(CLASSES) for _ in range(batch)]
+
+    def fwd_bwd():
+        loss.forward(pred, y)
+        loss.backward()
+
+    forward_s = _best(lambda: loss.forward(pred, y), repeat)
+    backward_s = _best(loss.backward, repeat)
+    return _record("layer", str(loss), (CLASSES,), batch, forward_s, backward_s, 0, _peak_bytes(fwd_bwd))
+
+
+def bench_model(filename, batch, dtype, repeat, rng, arena=False):
+    """forward: inference pass, backward: the rest of a training step (loss, backward, step)"""
+    model = CNN.from_mw(filename, dtype=dtype)
+    if arena:
+        model.arena = Arena()
+
+    macs = 0
+    x = Tensor.zeros(INPUT_SHAPE, dtype)
+    for layer in CNN._unfused(model.layers):
+        macs += _macs(layer, x.shape)
+        x = layer.forward(x, train=False)
+
+    x = _input(INPUT_SHAPE, batch, dtype, rng)
+    y = rng.randrange(CLASSES) if batch == 1 else [rng.randrange(CLASSES) for _ in range(batch)]
+
+    forward_s = _best(lambda: model.forward(x, train=False), repeat)
+    train_s = _best(lambda: model._train_batch(x, y), repeat)
+    return _record("model", filename, INPUT_SHAPE, batch, forward_s, max(0.0, train_s - forward_s), macs,
+                   _peak_bytes(lambda: model._train_batch(x, y)))
+
+
+def _commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(batches, repeat, dtype, random_seed=0, arena=False):
+    rng = random.Random(random_seed)
+    results = []
+
+    for batch in batches:
+        for make, shape in LAYERS:
+            results.append(bench_layer(make, shape, batch, dtype, repeat, rng))
+        results.append(bench_loss(batch, repeat, dtype, rng))
+        for filename in MODELS:
+            results.append(bench_model(filename, batch, dtype, repeat, rng, arena))
+
+    meta = {
+        "commit": _commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "threads": cnn.get_num_threads(),
+        "dtype": dtype,
+        "repeat": repeat,
+        "arena": arena,
+    }
+    return {"meta": meta, "results": results}
+
+
+def _key(r):
+    return r["kind"], r["name"], tuple(r["input_shape"]), r["batch"]
+
+
+def compare(old, new, tolerance):
+    """print new/old samples/sec per case, returns the cases slower than 1 - tolerance"""
+    before = {_key(r): r for r in old["results"]}
+    regressions = []
+    for r in new["results"]:
+        o = before.get(_key(r))
+        if o is None or not o["samples_per_s"] or not r["samples_per_s"]:
+            continue
+
+        ratio = r["samples_per_s"] / o["samples_per_s"]
+        flag = ""
+        if ratio < 1.0 - tolerance:
+            flag = "  REGRESSION"
+            regressions.append(r)
+        print(f"{r['name']:<40} batch {r['batch']:>3}  {o['samples_per_s']:>10.1f} -> {r['samples_per_s']:>10.1f}"
+              f" samples/s  x{ratio:.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch", default="1,16,64", help="comma separated batch sizes")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--dtype", default="d", choices=("d", "f"))
+    parser.add_argument("--threads", type=int, default=1, help="cnn.set_num_threads")
+    parser.add_argument("--arena", action="store_true", help="give the models a cnn.Arena")
+    parser.add_argument("--out", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="earlier JSON output to compare samples/sec against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="slowdown reported as a regression")
+    args = parser.parse_args()
+
+    cnn.set_num_threads(args.threads)
+    report = run([int(b) for b in args.batch.split(",")], args.repeat, args.dtype, arena=args.arena)
+
+    for r in report["results"]:
+        ns = f"{r['forward_ns_per_mac']:6.2f} ns/MAC" if r["forward_ns_per_mac"] else " " * 13
+        print(f"{r['name']:<40} batch {r['batch']:>3}  fwd {r['forward_s'] * 1e3:8.3f}ms  "
+              f"bwd {r['backward_s'] * 1e3:8.3f}ms  {r['samples_per_s']:>10.1f} samples/s  {ns}  "
+              f"peak {r['peak_bytes'] / 1024:8.1f} KiB")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        print()
+        if compare(old, report, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,65 @@
+from cnn.Arena import Arena
+from cnn.Tensor import Tensor
+from c_cnn.c_extension import cnn
+
+
+class ReLU:
+    def __init__(self):
+        self.x = None
+
+        self.arena = None  # cnn.Arena the outputs are written into, None: new arrays per call
+
+    def zero_grad(self):
+        pass
+
+    def forward(self, x, train=True):
+        out = Arena.out(self.arena, self, "y", x.shape, x.dtype)
+        y_data = cnn.relu_forward(x.data, x.offset, x.volume(), *Arena.args(out))
+        y = out if out is not None else Tensor(y_data, x.shape)
+
+        if train:
+            self.x = x
+        return y
+
+    def backward(self, dy):
+        x = self.x
+        out = Arena.out(self.arena, self, "dx", x.shape, x.dtype)
+        dx_data = cnn.relu_backward(x.data, x.offset, dy.data, dy.offset, x.volume(), *Arena.args(out))
+        return out if out is not None else Tensor(dx_data, x.shape)
+
+    def step(self):
+        pass
+
+    def __str__(self):
+        return "ReLU()"
+
+
+class Sigmoid:
+    def __init__(self):
+        self.y = None
+
+        self.arena = None  # cnn.Arena the outputs are written into, None: new arrays per call
+
+    def zero_grad(self):
+        pass
+
+    def forward(self, x, train=True):
+        out = Arena.out(self.arena, self, "y", x.shape, x.dtype)
+        y_data = cnn.sigmoid_forward(x.data, x.offset, x.volume(), *Arena.args(out))
+        y = out if out is not None else Tensor(y_data, x.shape)
+
+        if train:
+            self.y = y
+        return y
+
+    def backward(self, dy):
+        y = self.y
+        out = Arena.out(self.arena, self, "dx", y.shape, y.dtype)
+        dx_data = cnn.sigmoid_backward(y.data, y.offset, dy.data, dy.offset, y.volume(), *Arena.args(out))
+        return out if out is not None else Tensor(dx_data, y.shape)
+
+    def step(self):
+        pass
+
+    def __str__(self):
+        return "Sigmoid()"
\ No newline at end of file
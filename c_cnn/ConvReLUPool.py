@@ -0,0 +1,130 @@
+from cnn.Arena import Arena
+from cnn.Tensor import Tensor
+from c_cnn.c_extension import cnn
+
+
+class ConvReLUPool:
+    """
+    Convolve -> ReLU -> Pooling(mode='max') as one layer, forward and backward in a single C call.
+
+    Wraps the layers it replaces: parameters, step() and the saved model format stay those of
+    `conv`, and `layers` gives the original three back. Built by CNN.fuse().
+    """
+
+    def __init__(self, conv, relu, pool):
+        if pool.mode != "max":
+            raise ValueError("ConvReLUPool only fuses max pooling")
+
+        self.conv = conv
+        self.relu = relu
+        self.pool = pool
+
+        # cache
+        self.x = None  # (Cin, H, W) or (N, Cin, H, W)
+        self.y = None  # pooled output, its sign is the ReLU mask under each argmax
+        self.argmax = None
+
+        self.arena = None  # cnn.Arena the outputs are written into, None: new arrays per call
+
+    @property
+    def layers(self):
+        return self.conv, self.relu, self.pool
+
+    # parameters live on the conv layer
+    @property
+    def W(self):
+        return self.conv.W
+
+    @W.setter
+    def W(self, W):
+        self.conv.W = W
+
+    @property
+    def b(self):
+        return self.conv.b
+
+    @b.setter
+    def b(self, b):
+        self.conv.b = b
+
+    @property
+    def lr(self):
+        return self.conv.lr
+
+    @property
+    def dW(self):
+        return self.conv.dW
+
+    @property
+    def db(self):
+        return self.conv.db
+
+    def zero_grad(self):
+        self.conv.zero_grad()
+
+    def forward(self, x, train=True):
+        """
+        x: Tensor (Cin, H, W) or (N, Cin, H, W)
+        returns: Tensor (Cout, Hp, Wp) or (N, Cout, Hp, Wp)
+        """
+        if len(x.shape) not in (3, 4):
+            raise ValueError("ConvReLUPool.forward expects x shape (Cin, H, W) or (N, Cin, H, W)")
+
+        conv, pool = self.conv, self.pool
+        Cin, H, W = x.shape[-3:]
+        if Cin != conv.cin:
+            raise ValueError(f"Cin mismatch: got {Cin}, expected {conv.cin}")
+
+        Hp = (H - conv.kh + 1 - pool.ph) // pool.stride + 1
+        Wp = (W - conv.kw + 1 - pool.pw) // pool.stride + 1
+        if Hp <= 0 or Wp <= 0:
+            raise ValueError("Invalid output shape")
+
+        xb = x if len(x.shape) == 4 else x.reshape((1, Cin, H, W))
+        out_shape = (*x.shape[:-3], conv.cout, Hp, Wp)
+
+        if self.arena is None:
+            y = Tensor.zeros(out_shape, conv.W.dtype)
+            am = Tensor.zeros(out_shape, conv.W.dtype) if train else None
+        else:
+            y = self.arena.tensor((self, "y"), out_shape, conv.W.dtype)
+            am = self.arena.tensor((self, "argmax"), out_shape, conv.W.dtype) if train else None
+        cnn.conv_relu_pool_forward(*xb.args(), *conv.W.args(), *conv.b.args(), conv.cout, conv.kh, conv.kw,
+                                   conv.algo, True, "max", pool.ph, pool.pw, pool.stride, y.data, y.offset,
+                                   *((am.data, am.offset) if train else ()))
+
+        if train:
+            self.x = x
+            self.y = y
+            self.argmax = am
+
+        return y
+
+    def backward(self, dy):
+        """
+        dy: Tensor (Cout, Hp, Wp) or (N, Cout, Hp, Wp)
+        returns dx: Tensor (Cin, H, W) or (N, Cin, H, W)
+        """
+        if self.x is None:
+            raise RuntimeError("Must call forward(train=True) before backward")
+
+        x, y, am = self.x, self.y, self.argmax
+        if dy.shape != y.shape:
+            raise ValueError(f"dy shape {dy.shape} does not match the forward output {y.shape}")
+
+        if len(x.shape) == 3:
+            x, dy, y, am = (t.reshape((1, *t.shape)) for t in (x, dy, y, am))
+
+        conv, pool = self.conv, self.pool
+        out = Arena.out(self.arena, self, "dx", self.x.shape, conv.W.dtype)
+        dx_data = cnn.conv_relu_pool_backward(*x.args(), *dy.args(), *y.args(), *am.args(), *conv.W.args(),
+                                              *conv.dW.args(), *conv.db.args(), conv.cout, conv.kh, conv.kw,
+                                              conv.algo, True, pool.ph, pool.pw, pool.stride, *Arena.args(out))
+
+        return out if out is not None else Tensor(dx_data, self.x.shape)
+
+    def step(self):
+        self.conv.step()
+
+    def __str__(self):
+        return " -> ".join(map(str, self.layers))
\ No newline at end of file
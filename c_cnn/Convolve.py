@@ -1,10 +1,16 @@
 import math
 from random import gauss, seed
+from cnn.Arena import Arena
 from cnn.Tensor import Tensor
 from c_cnn.c_extension import cnn
 
 class Convolve:
-    def __init__(self, cin, cout, kh, kw, lr=0.01, random_seed=1):
+    # "direct": strided six-deep loop, "im2col": im2col lowering + blocked GEMM,
+    # "winograd"/"fft": transform-domain forward pass (their backward runs through im2col);
+    # float32 "winograd" is accurate to ~1e-5 up to 5x5 kernels and runs larger ones as im2col
+    ALGOS = ("direct", "im2col", "winograd", "fft")
+
+    def __init__(self, cin, cout, kh, kw, lr=0.01, random_seed=1, algo="direct", W=None, b=None):
         self.cin = cin
         self.cout = cout
         self.kh = kh
@@ -12,21 +18,28 @@ class Convolve:
         self.lr = lr
         self.random_seed = random_seed
 
+        if algo not in Convolve.ALGOS:
+            raise ValueError(f"algo must be one of {Convolve.ALGOS}")
+        self.algo = algo
+
         seed(self.random_seed)
 
         scale = math.sqrt(2.0 / (cin * kh * kw))
 
-        # Params
-        self.W = Tensor([gauss(0.0, scale) for _ in range(cout * cin * kh * kw)], (cout, cin, kh, kw))
-        self.b = Tensor.zeros((cout,))
+        # Params: given when loading a saved model, random init otherwise
+        self.W = W if W is not None else Tensor([gauss(0.0, scale) for _ in range(cout * cin * kh * kw)],
+                                                (cout, cin, kh, kw))
+        self.b = b if b is not None else Tensor.zeros((cout,), self.W.dtype)
 
-        # Grads
-        self.dW = Tensor.zeros((cout, cin, kh, kw))
-        self.db = Tensor.zeros((cout,))
+        # Grads, same dtype as the params
+        self.dW = Tensor.zeros((cout, cin, kh, kw), self.W.dtype)
+        self.db = Tensor.zeros((cout,), self.W.dtype)
 
         # Cache
         self.x = None  # original input
 
+        self.arena = None  # cnn.Arena the outputs are written into, None: new arrays per call
+
     def zero_grad(self):
         # self.dW = Tensor.zeros((self.cout, self.cin, self.kh, self.kw))
         # self.db = Tensor.zeros((self.cout,))
@@ -35,13 +48,13 @@ class Convolve:
 
     def forward(self, x, train=True):
         """
-        x: Tensor (Cin, H, W)
-        returns: Tensor (Cout, Hout, Wout)
+        x: Tensor (Cin, H, W) or (N, Cin, H, W)
+        returns: Tensor (Cout, Hout, Wout) or (N, Cout, Hout, Wout)
         """
-        if len(x.shape) != 3:
-            raise ValueError("Convolve.forward expects x shape (Cin, H, W)")
+        if len(x.shape) not in (3, 4):
+            raise ValueError("Convolve.forward expects x shape (Cin, H, W) or (N, Cin, H, W)")
 
-        Cin, H, W = x.shape
+        Cin, H, W = x.shape[-3:]
         if Cin != self.cin:
             raise ValueError(f"Cin mismatch: got {Cin}, expected {self.cin}")
 
@@ -52,59 +65,62 @@ class Convolve:
         if Hout <= 0 or Wout <= 0:
             raise ValueError("Invalid output shape")
 
-        y_data = cnn.convolve_forward(*x.args(), *self.W.args(), *self.b.args(), self.cout, self.kh, self.kw)
+        out_shape = (*x.shape[:-3], self.cout, Hout, Wout)
+        out = Arena.out(self.arena, self, "y", out_shape, x.dtype)
+
+        if self.algo != "direct" or len(x.shape) == 4:
+            # the GEMM engines only have batched entry points, run a single sample as N=1
+            xb = x if len(x.shape) == 4 else x.reshape((1, Cin, H, W))
+            y_data = cnn.convolve_forward_batch(*xb.args(), *self.W.args(), *self.b.args(), self.cout, self.kh,
+                                                self.kw, self.algo, *Arena.args(out))
+        else:
+            y_data = cnn.convolve_forward(*x.args(), *self.W.args(), *self.b.args(), self.cout, self.kh, self.kw,
+                                          *Arena.args(out))
 
         if train:
             self.x = x
 
-        y = Tensor(y_data, (self.cout, Hout, Wout))
+        y = out if out is not None else Tensor(y_data, out_shape)
 
         return y
 
     def backward(self, dy):
         """
-        dy: Tensor (Cout, Hout, Wout)
-        returns dx: Tensor (Cin, H, W)
+        dy: Tensor (Cout, Hout, Wout) or (N, Cout, Hout, Wout)
+        returns dx: Tensor (Cin, H, W) or (N, Cin, H, W)
         """
         if self.x is None:
             raise RuntimeError("Must call forward(train=True) before backward")
 
         x = self.x
-        Cin, H, W = x.shape
-        Cout, Hout, Wout = dy.shape
+        if len(dy.shape) != len(x.shape):
+            raise ValueError("Convolve.backward expects dy with the same rank as the cached x")
+
+        Cout, Hout, Wout = dy.shape[-3:]
 
         if Cout != self.cout:
             raise ValueError(f"Cout mismatch: got {Cout}, expected {self.cout}")
 
-        dx_data = cnn.convolve_backward(*x.args(), *dy.args(), *self.W.args(), *self.dW.args(), *self.db.args(),
-                                        self.cout, self.kh, self.kw)
-        dx = Tensor(dx_data, x.shape)
+        out = Arena.out(self.arena, self, "dx", x.shape, x.dtype)
+
+        if self.algo != "direct" or len(x.shape) == 4:
+            xb = x if len(x.shape) == 4 else x.reshape((1, *x.shape))
+            dyb = dy if len(dy.shape) == 4 else dy.reshape((1, *dy.shape))
+            dx_data = cnn.convolve_backward_batch(*xb.args(), *dyb.args(), *self.W.args(), *self.dW.args(),
+                                                  *self.db.args(), self.cout, self.kh, self.kw, self.algo,
+                                                  *Arena.args(out))
+        else:
+            dx_data = cnn.convolve_backward(*x.args(), *dy.args(), *self.W.args(), *self.dW.args(),
+                                            *self.db.args(), self.cout, self.kh, self.kw, *Arena.args(out))
+        dx = out if out is not None else Tensor(dx_data, x.shape)
 
         return dx
 
     def step(self):
         """SGD update (online)."""
-        for oc in range(self.cout):
-            # bias update
-            bidx = self.b.offset + oc * self.b.strides[0]
-            dbidx = self.db.offset + oc * self.db.strides[0]
-            self.b.data[bidx] -= self.lr * self.db.data[dbidx]
-
-            # weight update
-            W_oc_base = self.W.offset + oc * self.W.strides[0]
-            dW_oc_base = self.dW.offset + oc * self.dW.strides[0]
-
-            for ic in range(self.cin):
-                W_ocic = W_oc_base + ic * self.W.strides[1]
-                dW_ocic = dW_oc_base + ic * self.dW.strides[1]
-
-                for ky in range(self.kh):
-                    W_ocky = W_ocic + ky * self.W.strides[2]
-                    dW_ocky = dW_ocic + ky * self.dW.strides[2]
-
-                    for kx in range(self.kw):
-                        idx = kx * self.W.strides[3]
-                        self.W.data[W_ocky + idx] -= self.lr * self.dW.data[dW_ocky + idx]
+        cnn.sgd_update(self.b.data, self.b.offset, self.db.data, self.db.offset, self.b.volume(), self.lr)
+        cnn.sgd_update(self.W.data, self.W.offset, self.dW.data, self.dW.offset, self.W.volume(), self.lr)
 
     def __str__(self):
-        return f"Convolve({self.cin}, {self.cout}, {self.kh}, {self.kw}, {self.lr}, {self.random_seed})"
\ No newline at end of file
+        algo = f", algo='{self.algo}'" if self.algo != "direct" else ""
+        return f"Convolve({self.cin}, {self.cout}, {self.kh}, {self.kw}, {self.lr}, {self.random_seed}{algo})"
\ No newline at end of file
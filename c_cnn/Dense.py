@@ -1,19 +1,20 @@
 import math
 from random import gauss, seed
+from cnn.Arena import Arena
 from cnn.Tensor import Tensor
 from c_cnn.c_extension import cnn
 
 
 class Dense:
     """
-    Online-only Dense layer (no batch dimension).
+    Dense layer, online or mini-batch.
 
     Shapes:
-      x:  (Din,)
-      z/y:(Dout,)
+      x:  (Din,)  or (N, Din)
+      z/y:(Dout,) or (N, Dout)
     """
 
-    def __init__(self, din, dout, softmax=False, lr=0.01, random_seed=1):
+    def __init__(self, din, dout, softmax=False, lr=0.01, random_seed=1, W=None, b=None):
         self.din = din
         self.dout = dout
         self.softmax = softmax
@@ -24,19 +25,21 @@ class Dense:
 
         scale = math.sqrt(1.0 / din)
 
-        # Parameters
-        self.W = Tensor([gauss(0.0, scale) for _ in range(din * dout)], (din, dout))
-        self.b = Tensor.zeros((dout,))
+        # Parameters: given when loading a saved model, random init otherwise
+        self.W = W if W is not None else Tensor([gauss(0.0, scale) for _ in range(din * dout)], (din, dout))
+        self.b = b if b is not None else Tensor.zeros((dout,), self.W.dtype)
 
-        # Gradients
-        self.dW = Tensor.zeros((din, dout))
-        self.db = Tensor.zeros((dout,))
+        # Gradients, same dtype as the parameters
+        self.dW = Tensor.zeros((din, dout), self.W.dtype)
+        self.db = Tensor.zeros((dout,), self.W.dtype)
 
         # caches
         self.x = None
         self.z = None
         self.y = None  # only meaningful if softmax=True
 
+        self.arena = None  # cnn.Arena the outputs are written into, None: new arrays per call
+
     def zero_grad(self):
         # self.dW = Tensor.zeros((self.din, self.dout))
         # self.db = Tensor.zeros((self.dout,))
@@ -44,52 +47,41 @@ class Dense:
         self.db.zero()
 
     @staticmethod
-    def softmax(z):
+    def softmax(z, out=None):
         """
-        z: Tensor (D,)
-        returns: Tensor (D,)
+        z: Tensor (D,) or (N, D), softmax taken over the last axis
+        out: Tensor of the same shape to write into, None: a new one
+        returns: Tensor of the same shape
         """
-        if len(z.shape) != 1:
-            raise ValueError("Dense.softmax expects z shape (D,)")
-
-        D = z.shape[0]
-        y = Tensor.zeros((D,))
-
-        zdata, ydata = z.data, y.data
-        zoff, yoff = z.offset, y.offset
-        sz0 = z.strides[0]
-        sy0 = y.strides[0]
-
-        # numerical stability: subtract max
-        m = -float("inf")
-        for j in range(D):
-            v = zdata[zoff + j * sz0]
-            if v > m:
-                m = v
-
-        s = 0.0
-        for j in range(D):
-            s += math.exp(zdata[zoff + j * sz0] - m)
+        if len(z.shape) not in (1, 2):
+            raise ValueError("Dense.softmax expects z shape (D,) or (N, D)")
 
-        for j in range(D):
-            ydata[yoff + j * sy0] = math.exp(zdata[zoff + j * sz0] - m) / s
-
-        return y
+        zb = z if len(z.shape) == 2 else z.reshape((1, z.shape[0]))
+        y_data = cnn.softmax_forward(*zb.args(), *Arena.args(out))
+        return out if out is not None else Tensor(y_data, z.shape)
 
     def forward(self, x, train=True):
         """
-        x: Tensor (Din,)
-        returns: Tensor (Dout,)
+        x: Tensor (Din,) or (N, Din)
+        returns: Tensor (Dout,) or (N, Dout)
         """
-        if len(x.shape) != 1:
-            raise ValueError("Dense.forward expects x shape (Din,)")
-        if x.shape[0] != self.din:
+        if len(x.shape) not in (1, 2):
+            raise ValueError("Dense.forward expects x shape (Din,) or (N, Din)")
+        if x.shape[-1] != self.din:
             raise ValueError("Dense.forward input size mismatch")
 
-        z_data = cnn.dense_forward(*x.args(), *self.W.args(), *self.b.args(), self.din, self.dout)
-        z = Tensor(z_data, (self.dout,))
+        out_shape = (*x.shape[:-1], self.dout)
+        out = Arena.out(self.arena, self, "z", out_shape, x.dtype)
 
-        y = Dense.softmax(z) if self.softmax else z
+        if len(x.shape) == 2:
+            z_data = cnn.dense_forward_batch(*x.args(), *self.W.args(), *self.b.args(), self.din, self.dout,
+                                             *Arena.args(out))
+        else:
+            z_data = cnn.dense_forward(*x.args(), *self.W.args(), *self.b.args(), self.din, self.dout,
+                                       *Arena.args(out))
+        z = out if out is not None else Tensor(z_data, out_shape)
+
+        y = Dense.softmax(z, Arena.out(self.arena, self, "y", out_shape, x.dtype)) if self.softmax else z
 
         if train:
             self.x = x
@@ -101,31 +93,32 @@ class Dense:
     def backward(self, dy):
         """
         dy:
-          - if softmax=False: dL/dz (shape (Dout,))
+          - if softmax=False: dL/dz (shape (Dout,) or (N, Dout))
           - if softmax=True:  dL/dy (assumed to already include softmax derivative, e.g. softmax-onehot)
         returns:
-          dx: dL/dx (shape (Din,))
+          dx: dL/dx (shape (Din,) or (N, Din))
         """
         if self.x is None:
             raise RuntimeError("Must call forward(train=True) before backward")
-        if len(dy.shape) != 1 or dy.shape[0] != self.dout:
-            raise ValueError("Dense.backward expects dy shape (Dout,)")
+        if dy.shape != (*self.x.shape[:-1], self.dout):
+            raise ValueError("Dense.backward expects dy shape (Dout,) or (N, Dout) matching the cached x")
+
+        out = Arena.out(self.arena, self, "dx", self.x.shape, dy.dtype)
 
-        dx_data = cnn.dense_backward(*self.x.args(), *dy.args(), *self.W.args(), *self.dW.args(), *self.db.args(),
-                                     self.din, self.dout)
-        dx = Tensor(dx_data, (self.din,))
+        if len(dy.shape) == 2:
+            dx_data = cnn.dense_backward_batch(*self.x.args(), *dy.args(), *self.W.args(), *self.dW.args(),
+                                               *self.db.args(), self.din, self.dout, *Arena.args(out))
+        else:
+            dx_data = cnn.dense_backward(*self.x.args(), *dy.args(), *self.W.args(), *self.dW.args(),
+                                         *self.db.args(), self.din, self.dout, *Arena.args(out))
+        dx = out if out is not None else Tensor(dx_data, self.x.shape)
 
         return dx
 
     def step(self):
-        # b -= lr * db
-        for j in range(self.dout):
-            self.b[(j,)] = self.b.item((j,)) - self.lr * self.db.item((j,))
-
-        # W -= lr * dW
-        for j in range(self.dout):
-            for k in range(self.din):
-                self.W[(k, j)] = self.W.item((k, j)) - self.lr * self.dW.item((k, j))
+        # b -= lr * db, W -= lr * dW
+        cnn.sgd_update(self.b.data, self.b.offset, self.db.data, self.db.offset, self.b.volume(), self.lr)
+        cnn.sgd_update(self.W.data, self.W.offset, self.dW.data, self.dW.offset, self.W.volume(), self.lr)
 
     def __str__(self):
         return f"Dense({self.din}, {self.dout}, {self.softmax}, {self.lr}, {self.random_seed})"
\ No newline at end of file
@@ -0,0 +1,39 @@
+from cnn.Arena import Arena
+from cnn.Tensor import Tensor
+from c_cnn.c_extension import cnn
+
+
+class CrossEntropyLoss:
+    """
+    Softmax + cross entropy on raw logits.
+
+    pred (K,) with an int label, or pred (N, K) with N labels. For a batch the
+    loss (and so the gradient) is the mean over the N rows. forward computes the
+    gradient in the same C pass, backward just hands it out.
+    """
+
+    def __init__(self, eps=1e-12):
+        self.eps = eps
+
+        self.grad = None
+
+        self.arena = None  # cnn.Arena the gradient is written into, None: a new array per call
+
+    def forward(self, pred, y_true):
+        batched = len(pred.shape) == 2
+        labels = [int(y) for y in y_true] if batched else [int(y_true)]
+
+        p = pred if batched else pred.reshape((1, pred.shape[0]))
+        out = Arena.out(self.arena, self, "grad", pred.shape, pred.dtype)
+        loss, g = cnn.softmax_cross_entropy(*p.args(), labels, self.eps, *Arena.args(out))
+
+        self.grad = out if out is not None else Tensor(g, pred.shape)
+        return loss
+
+    def backward(self):
+        if self.grad is None:
+            raise RuntimeError("Must call forward before backward")
+        return self.grad
+
+    def __str__(self):
+        return "CrossEntropyLoss()"
\ No newline at end of file
@@ -1,3 +1,4 @@
+from cnn.Arena import Arena
 from cnn.Tensor import Tensor
 from c_cnn.c_extension import cnn
 
@@ -12,18 +13,20 @@ class Pooling:
         self.mode = mode
 
         # cache
-        self.x = None  # (C, H, W)
-        self.argmax = None  # (C, Hout, Wout) for max-pool
+        self.x = None  # (C, H, W) or (N, C, H, W)
+        self.argmax = None  # (C, Hout, Wout) or (N, C, Hout, Wout) for max-pool
+
+        self.arena = None  # cnn.Arena the outputs are written into, None: new arrays per call
 
     def zero_grad(self):
         pass
 
     def forward(self, x, train=True):
-        """x: Tensor (C, H, W) -> y: Tensor (C, Hout, Wout)"""
-        if len(x.shape) != 3:
-            raise ValueError("Pooling.forward expects x shape (C, H, W)")
+        """x: Tensor (C, H, W) or (N, C, H, W) -> y: Tensor (C, Hout, Wout) or (N, C, Hout, Wout)"""
+        if len(x.shape) not in (3, 4):
+            raise ValueError("Pooling.forward expects x shape (C, H, W) or (N, C, H, W)")
 
-        C, H, W = x.shape
+        C, H, W = x.shape[-3:]
         ph, pw, s = self.ph, self.pw, self.stride
 
         Hout = (H - ph) // s + 1
@@ -31,43 +34,64 @@ class Pooling:
         if Hout <= 0 or Wout <= 0:
             raise ValueError("Invalid output shape for pooling")
 
+        batched = len(x.shape) == 4
+        out_shape = (*x.shape[:-3], C, Hout, Wout)
+        out = Arena.out(self.arena, self, "y", out_shape, x.dtype)
+
         if self.mode == "max":
-            y_arr, argmax_arr = cnn.pool_forward_max(*x.args(), ph, pw, s)
-            self.argmax = Tensor(argmax_arr, (C, Hout, Wout))
+            # argmax only feeds backward, so inference doesn't build it
+            am = Arena.out(self.arena, self, "argmax", out_shape, x.dtype) if train else None
+            out_args = (*Arena.args(out), *Arena.args(am))
+            if batched:
+                y_arr, argmax_arr = cnn.pool_forward_max_batch(*x.args(), ph, pw, s, train, *out_args)
+            else:
+                y_arr, argmax_arr = cnn.pool_forward_max(*x.args(), ph, pw, s, train, *out_args)
+            if train:
+                self.argmax = am if am is not None else Tensor(argmax_arr, out_shape)
+        elif batched:
+            y_arr = cnn.pool_forward_avg_batch(*x.args(), ph, pw, s, *Arena.args(out))
         else:
-            y_arr = cnn.pool_forward_avg(*x.args(), ph, pw, s)
+            y_arr = cnn.pool_forward_avg(*x.args(), ph, pw, s, *Arena.args(out))
 
         if train:
             self.x = x
 
-        y = Tensor(y_arr, (C, Hout, Wout))
+        y = out if out is not None else Tensor(y_arr, out_shape)
 
         return y
 
     def backward(self, dy):
-        """dy: Tensor (C, Hout, Wout) -> dx: Tensor (C, H, W)"""
+        """dy: Tensor (C, Hout, Wout) or (N, C, Hout, Wout) -> dx: Tensor (C, H, W) or (N, C, H, W)"""
         if self.x is None:
             raise RuntimeError("Must call forward(train=True) before backward")
 
         x = self.x
-        C, H, W = x.shape
-        if len(dy.shape) != 3:
-            raise ValueError("Pooling.backward expects dy shape (C, Hout, Wout)")
-        C2, Hout, Wout = dy.shape
+        C, H, W = x.shape[-3:]
+        if len(dy.shape) != len(x.shape):
+            raise ValueError("Pooling.backward expects dy shape (C, Hout, Wout) or (N, C, Hout, Wout)")
+        C2, Hout, Wout = dy.shape[-3:]
         if C2 != C:
             raise ValueError(f"Channel mismatch: dy has C={C2}, expected {C}")
 
         ph, pw, s = self.ph, self.pw, self.stride
+        batched = len(x.shape) == 4
+        out = Arena.out(self.arena, self, "dx", x.shape, dy.dtype)
 
         if self.mode == "max":
             if self.argmax is None:
                 raise RuntimeError("Missing argmax cache (did you call forward(train=True)?)")
 
-            dx_arr = cnn.pool_backward_max(*dy.args(), *self.argmax.args(), H, W, ph, pw, s)
+            if batched:
+                dx_arr = cnn.pool_backward_max_batch(*dy.args(), *self.argmax.args(), H, W, ph, pw, s,
+                                                     *Arena.args(out))
+            else:
+                dx_arr = cnn.pool_backward_max(*dy.args(), *self.argmax.args(), H, W, ph, pw, s, *Arena.args(out))
+        elif batched:
+            dx_arr = cnn.pool_backward_avg_batch(*dy.args(), H, W, ph, pw, s, *Arena.args(out))
         else:
-            dx_arr = cnn.pool_backward_avg(*dy.args(), H, W, ph, pw, s)
+            dx_arr = cnn.pool_backward_avg(*dy.args(), H, W, ph, pw, s, *Arena.args(out))
 
-        dx = Tensor(dx_arr, (C, H, W))
+        dx = out if out is not None else Tensor(dx_arr, x.shape)
 
         return dx
 
@@ -0,0 +1,84 @@
+// Shared by cnn.c, the per-dtype kernel units cnn_f64.c / cnn_f32.c and cnn_int8.c
+#ifndef CNN_H
+#define CNN_H
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <string.h>   // memset
+#include <math.h>     // fft twiddles
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+// Threads each kernel may use, set from Python with set_num_threads().
+// Defaults to 1 so DataParallel worker processes don't oversubscribe the cores.
+// Kernels only split work into disjoint output ranges (channels, rows, samples),
+// so for a given thread count the results are the same as single-threaded.
+extern int cnn_threads;
+
+#if defined(_MSC_VER)
+#define CNN_PRAGMA(x) __pragma(x)
+#else
+#define CNN_PRAGMA(x) _Pragma(#x)
+#endif
+
+#define CNN_OMP_FOR_IF(cond) CNN_PRAGMA(omp parallel for num_threads(cnn_threads) if(cnn_threads > 1 && (cond)))
+#define CNN_OMP_FOR CNN_OMP_FOR_IF(1)
+
+#ifdef _OPENMP
+#define CNN_THREAD_ID() omp_get_thread_num()
+#else
+#define CNN_THREAD_ID() 0
+#endif
+
+// Kernel scratch memory, see cnn.c: grow-only, one set of slots per calling thread (freed
+// when it exits), so steady-state calls allocate nothing. A kernel holds CNN_SCRATCH_OUTER
+// while the conv engine it calls borrows CNN_SCRATCH_ENGINE. Safe without the GIL; NULL
+// when out of memory.
+enum { CNN_SCRATCH_OUTER, CNN_SCRATCH_ENGINE, CNN_SCRATCH_SLOTS };
+void *cnn_scratch(int slot, size_t nbytes);
+
+// Python entry points compiled once per dtype from cnn_kernels.h as name##_f64 / name##_f32
+#define CNN_KERNELS(X) \
+    X(convolve_forward) \
+    X(convolve_backward) \
+    X(convolve_forward_batch) \
+    X(convolve_backward_batch) \
+    X(dense_forward) \
+    X(dense_backward) \
+    X(dense_forward_batch) \
+    X(dense_backward_batch) \
+    X(pool_forward_max) \
+    X(pool_forward_avg) \
+    X(pool_backward_max) \
+    X(pool_backward_avg) \
+    X(pool_forward_max_batch) \
+    X(pool_forward_avg_batch) \
+    X(pool_backward_max_batch) \
+    X(pool_backward_avg_batch) \
+    X(conv_relu_pool_forward) \
+    X(conv_relu_pool_backward) \
+    X(relu_forward) \
+    X(relu_backward) \
+    X(sigmoid_forward) \
+    X(sigmoid_backward) \
+    X(softmax_forward) \
+    X(topk) \
+    X(softmax_cross_entropy) \
+    X(axpby) \
+    X(u8_to_real) \
+    X(augment) \
+    X(sgd_update) \
+    X(adam_update)
+
+#define CNN_DECLARE_KERNEL(name) \
+    PyObject* name##_f64(PyObject *self, PyObject *args); \
+    PyObject* name##_f32(PyObject *self, PyObject *args);
+CNN_KERNELS(CNN_DECLARE_KERNEL)
+
+// int8 inference kernels (cnn_int8.c)
+PyObject* quantize_q8(PyObject *self, PyObject *args);
+PyObject* conv_q8_forward(PyObject *self, PyObject *args);
+PyObject* dense_q8_forward(PyObject *self, PyObject *args);
+
+#endif // CNN_H
@@ -0,0 +1,7 @@
+// float32 kernels
+#define REAL_TYPE float
+#define REAL_CODE "f"
+#define REAL_NAME "float32"
+#define KERNEL(name) name##_f32
+
+#include "cnn_kernels.h"
@@ -0,0 +1,7 @@
+// float64 kernels
+#define REAL_TYPE double
+#define REAL_CODE "d"
+#define REAL_NAME "float64"
+#define KERNEL(name) name##_f64
+
+#include "cnn_kernels.h"
@@ -0,0 +1,372 @@
+// int8 inference kernels for cnn.Quantize (forward only).
+//
+// Values are stored as real value = q * scale with no zero point. Weights are int8 with
+// one scale per output channel. Activations that can't be negative (input pixels, ReLU
+// outputs) are uint8 in [0, 255], all others int8 in [-127, 127]. A layer's int32
+// accumulator acc for output channel c maps back to a real value as
+// acc * mult[c] + bias[c] with mult[c] = x_scale * w_scale[c]. Each kernel then applies
+// ReLU / pooling and writes its output either requantized with out_scale (itemsize 1 out
+// buffer: uint8 with ReLU, int8 without) or as float64 (itemsize 8), the latter for the
+// last layer of a model.
+#include <stdint.h>
+#include "cnn.h"
+
+static int8_t q8_round(double v) {
+    if (v >= 127.0) return 127;
+    if (v <= -127.0) return -127;
+    return (int8_t)(v >= 0.0 ? v + 0.5 : v - 0.5);
+}
+
+static uint8_t u8_round(double v) {
+    if (v >= 255.0) return 255;
+    if (v <= 0.0) return 0;
+    return (uint8_t)(v + 0.5);
+}
+
+// y_q8: 0 float64, 1 int8, 2 uint8
+static void q8_store(void *y, Py_ssize_t i, int y_q8, double v, double inv_out_scale) {
+    if (y_q8 == 2) ((uint8_t*)y)[i] = u8_round(v * inv_out_scale);
+    else if (y_q8) ((int8_t*)y)[i] = q8_round(v * inv_out_scale);
+    else ((double*)y)[i] = v;
+}
+
+static int check_itemsize(Py_buffer *b, Py_ssize_t itemsize, const char *name, const char *what) {
+    if (b->itemsize != itemsize) {
+        PyErr_Format(PyExc_TypeError, "%s: expected buffer of %s (itemsize=%d)", name, what, (int)itemsize);
+        return 0;
+    }
+    return 1;
+}
+
+static int check_len(Py_buffer *b, Py_ssize_t n, const char *name) {
+    if (n * b->itemsize > b->len) {
+        PyErr_Format(PyExc_IndexError, "%s: buffer holds fewer than %zd values", name, n);
+        return 0;
+    }
+    return 1;
+}
+
+// out: uint8 / int8 (requantized with out_scale > 0, unsigned after ReLU) or float64
+static int check_q8_out(Py_buffer *b, Py_ssize_t n, double out_scale, int relu, int *y_q8) {
+    if (b->itemsize != 1 && b->itemsize != 8) {
+        PyErr_SetString(PyExc_TypeError, "out: expected buffer of int8, uint8 or float64");
+        return 0;
+    }
+    *y_q8 = b->itemsize == 1 ? (relu ? 2 : 1) : 0;
+    if (*y_q8 && !(out_scale > 0.0)) {
+        PyErr_SetString(PyExc_ValueError, "out_scale must be > 0 for an int8 out buffer");
+        return 0;
+    }
+    return check_len(b, n, "out");
+}
+
+// ---------------------------------------------------------------------------
+// Quantize
+// ---------------------------------------------------------------------------
+
+PyObject* quantize_q8(PyObject *self, PyObject *args) {
+    Py_buffer xb = {0}, qb = {0};
+    Py_ssize_t x_off, q_off, n;
+    double scale;
+    int is_unsigned = 0;
+
+    // Parse: x buf (float64 or float32), off, q buf (int8 or uint8), off, n, scale[, unsigned]
+    if (!PyArg_ParseTuple(args, "y*nw*nnd|p", &xb, &x_off, &qb, &q_off, &n, &scale, &is_unsigned)) return NULL;
+
+    PyObject *ret = NULL;
+    if (xb.itemsize != 4 && xb.itemsize != 8) {
+        PyErr_SetString(PyExc_TypeError, "x: expected buffer of float64 or float32");
+        goto done;
+    }
+    if (!check_itemsize(&qb, 1, "q", "int8 or uint8")) goto done;
+    if (!(scale > 0.0)) {
+        PyErr_SetString(PyExc_ValueError, "scale must be > 0");
+        goto done;
+    }
+    if (n < 0 || x_off < 0 || q_off < 0 || (x_off + n) * xb.itemsize > xb.len || q_off + n > qb.len) {
+        PyErr_SetString(PyExc_IndexError, "quantize range out of bounds");
+        goto done;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    double inv = 1.0 / scale;
+    int kind = is_unsigned ? 2 : 1;
+    if (xb.itemsize == 8) {
+        const double *x = (const double*)xb.buf + x_off;
+        for (Py_ssize_t i = 0; i < n; i++) q8_store(qb.buf, q_off + i, kind, x[i], inv);
+    } else {
+        const float *x = (const float*)xb.buf + x_off;
+        for (Py_ssize_t i = 0; i < n; i++) q8_store(qb.buf, q_off + i, kind, x[i], inv);
+    }
+    Py_END_ALLOW_THREADS
+
+    ret = Py_None;
+    Py_INCREF(ret);
+
+done:
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&qb);
+    return ret;
+}
+
+// ---------------------------------------------------------------------------
+// Convolve [+ ReLU] [+ Pooling]
+// ---------------------------------------------------------------------------
+
+// x: contiguous (Cin, H, W) -> col: (Hc*Wc, Cin*Kh*Kw), one row per output pixel, so every
+// output is a unit-stride dot product with a contiguous (Cin, Kh, Kw) weight row.
+#define IM2ROW_Q8(name, xtype) \
+static void name(const xtype *x, Py_ssize_t Cin, Py_ssize_t H, Py_ssize_t W, \
+                 Py_ssize_t Kh, Py_ssize_t Kw, Py_ssize_t Hc, Py_ssize_t Wc, xtype *col) { \
+    Py_ssize_t K = Cin * Kh * Kw; \
+    for (Py_ssize_t oy = 0; oy < Hc; oy++) { \
+        for (Py_ssize_t ox = 0; ox < Wc; ox++) { \
+            xtype *row = col + (oy * Wc + ox) * K; \
+            for (Py_ssize_t ic = 0; ic < Cin; ic++) \
+                for (Py_ssize_t ky = 0; ky < Kh; ky++) \
+                    memcpy(row + (ic * Kh + ky) * Kw, x + (ic * H + oy + ky) * W + ox, (size_t)Kw * sizeof(xtype)); \
+        } \
+    } \
+}
+IM2ROW_Q8(im2row_q8, int8_t)
+IM2ROW_Q8(im2row_u8, uint8_t)
+
+// acc[oc, p] = dot(w[oc, :], col[p, :]) over K, int32 accumulate
+#define CONV_Q8_GEMM(name, xtype) \
+static void name(const xtype *col, const int8_t *w, Py_ssize_t Cout, Py_ssize_t P, Py_ssize_t K, int32_t *acc) { \
+    for (Py_ssize_t oc = 0; oc < Cout; oc++) { \
+        const int8_t *wr = w + oc * K; \
+        for (Py_ssize_t p = 0; p < P; p++) { \
+            const xtype *xr = col + p * K; \
+            int32_t sum = 0; \
+            for (Py_ssize_t k = 0; k < K; k++) sum += (int32_t)xr[k] * (int32_t)wr[k]; \
+            acc[oc * P + p] = sum; \
+        } \
+    } \
+}
+CONV_Q8_GEMM(conv_q8_gemm, int8_t)
+CONV_Q8_GEMM(conv_u8_gemm, uint8_t)
+
+// pool: 0 none, 1 max, 2 avg. mult > 0, so the max of acc is the max of the real values.
+static void q8_relu_pool_plane(const int32_t *acc, Py_ssize_t Hc, Py_ssize_t Wc, double mult, double bias,
+                               int relu, int pool, Py_ssize_t ph, Py_ssize_t pw, Py_ssize_t s,
+                               Py_ssize_t Hp, Py_ssize_t Wp, void *y, Py_ssize_t y_base, int y_q8, double inv_out) {
+    for (Py_ssize_t oy = 0; oy < Hp; oy++) {
+        for (Py_ssize_t ox = 0; ox < Wp; ox++) {
+            double v;
+            if (pool == 0) {
+                v = acc[oy * Wc + ox] * mult + bias;
+            } else if (pool == 1) {
+                const int32_t *win = acc + oy * s * Wc + ox * s;
+                int32_t best = win[0];
+                for (Py_ssize_t ky = 0; ky < ph; ky++)
+                    for (Py_ssize_t kx = 0; kx < pw; kx++)
+                        if (win[ky * Wc + kx] > best) best = win[ky * Wc + kx];
+                v = best * mult + bias;
+            } else {
+                const int32_t *win = acc + oy * s * Wc + ox * s;
+                double sum = 0.0;
+                for (Py_ssize_t ky = 0; ky < ph; ky++) {
+                    for (Py_ssize_t kx = 0; kx < pw; kx++) {
+                        double u = win[ky * Wc + kx] * mult + bias;
+                        sum += (relu && u < 0.0) ? 0.0 : u;
+                    }
+                }
+                v = sum / (double)(ph * pw);
+            }
+            if (relu && v < 0.0) v = 0.0;
+            q8_store(y, y_base + oy * Wp + ox, y_q8, v, inv_out);
+        }
+    }
+}
+
+PyObject* conv_q8_forward(PyObject *self, PyObject *args) {
+    Py_buffer xb = {0}, wb = {0}, mb = {0}, bb = {0}, yb = {0};
+    Py_ssize_t N, Cin, H, W, Cout, Kh, Kw, ph, pw, s;
+    int x_unsigned, relu;
+    const char *pool_name;
+    double out_scale;
+
+    // Parse: x, N, Cin, H, W, x_unsigned, w, Cout, Kh, Kw, mult, bias, relu, pool, ph, pw, s, out, out_scale
+    if (!PyArg_ParseTuple(
+            args,
+            "y*nnnnp" // x: contiguous int8 or (x_unsigned) uint8 (N, Cin, H, W)
+            "y*nnn"   // w: contiguous int8 (Cout, Cin, Kh, Kw); Cout, Kh, Kw
+            "y*y*"    // mult, bias: float64 (Cout,)
+            "p"       // relu
+            "snnn"    // pool: "none", "max" or "avg"; ph, pw, stride (ignored for "none")
+            "w*d",    // out: contiguous (N, Cout, Hp, Wp), int8 or float64; out_scale for int8
+            &xb, &N, &Cin, &H, &W, &x_unsigned,
+            &wb, &Cout, &Kh, &Kw,
+            &mb, &bb,
+            &relu,
+            &pool_name, &ph, &pw, &s,
+            &yb, &out_scale
+        )) {
+        return NULL;
+    }
+
+    int pool, y_q8;
+    if (strcmp(pool_name, "none") == 0) pool = 0;
+    else if (strcmp(pool_name, "max") == 0) pool = 1;
+    else if (strcmp(pool_name, "avg") == 0) pool = 2;
+    else {
+        PyErr_SetString(PyExc_ValueError, "pool must be 'none', 'max' or 'avg'");
+        goto fail;
+    }
+
+    if (N < 0 || Cin <= 0 || Cout <= 0 || Kh <= 0 || Kw <= 0 || H < Kh || W < Kw) {
+        PyErr_SetString(PyExc_ValueError, "conv_q8_forward: invalid shapes");
+        goto fail;
+    }
+    Py_ssize_t Hc = H - Kh + 1, Wc = W - Kw + 1, Hp = Hc, Wp = Wc;
+    if (pool) {
+        if (ph <= 0 || pw <= 0 || s <= 0 || ph > Hc || pw > Wc) {
+            PyErr_SetString(PyExc_ValueError, "conv_q8_forward: invalid pooling window");
+            goto fail;
+        }
+        Hp = (Hc - ph) / s + 1;
+        Wp = (Wc - pw) / s + 1;
+    }
+
+    if (!check_itemsize(&xb, 1, "x", "int8 or uint8") || !check_len(&xb, N * Cin * H * W, "x")) goto fail;
+    if (!check_itemsize(&wb, 1, "w", "int8") || !check_len(&wb, Cout * Cin * Kh * Kw, "w")) goto fail;
+    if (!check_itemsize(&mb, 8, "mult", "float64") || !check_len(&mb, Cout, "mult")) goto fail;
+    if (!check_itemsize(&bb, 8, "bias", "float64") || !check_len(&bb, Cout, "bias")) goto fail;
+    if (!check_q8_out(&yb, N * Cout * Hp * Wp, out_scale, relu, &y_q8)) goto fail;
+
+    const int8_t *w = (const int8_t*)wb.buf;
+    const double *mult = (const double*)mb.buf, *bias = (const double*)bb.buf;
+    double inv_out = y_q8 ? 1.0 / out_scale : 0.0;
+    Py_ssize_t P = Hc * Wc, Q = Hp * Wp;
+    int nt = cnn_threads;
+    int ok = 1;
+
+    Py_BEGIN_ALLOW_THREADS
+    // per thread: one sample's col rows and its (Cout, Hc, Wc) accumulators
+    Py_ssize_t K = Cin * Kh * Kw;
+    Py_ssize_t scratch = P * K + Cout * P * (Py_ssize_t)sizeof(int32_t);
+    scratch = (scratch + 63) / 64 * 64;
+    char *buf = (char*)cnn_scratch(CNN_SCRATCH_ENGINE, (size_t)(nt * scratch));
+    if (!buf) {
+        ok = 0;
+    } else {
+        CNN_PRAGMA(omp parallel for num_threads(nt) if(nt > 1))
+        for (Py_ssize_t n = 0; n < N; n++) {
+            char *mine = buf + CNN_THREAD_ID() * scratch;
+            int32_t *acc = (int32_t*)mine;
+            void *col = mine + Cout * P * (Py_ssize_t)sizeof(int32_t);
+
+            if (x_unsigned) {
+                im2row_u8((const uint8_t*)xb.buf + n * Cin * H * W, Cin, H, W, Kh, Kw, Hc, Wc, (uint8_t*)col);
+                conv_u8_gemm((const uint8_t*)col, w, Cout, P, K, acc);
+            } else {
+                im2row_q8((const int8_t*)xb.buf + n * Cin * H * W, Cin, H, W, Kh, Kw, Hc, Wc, (int8_t*)col);
+                conv_q8_gemm((const int8_t*)col, w, Cout, P, K, acc);
+            }
+            for (Py_ssize_t oc = 0; oc < Cout; oc++)
+                q8_relu_pool_plane(acc + oc * P, Hc, Wc, mult[oc], bias[oc], relu, pool, ph, pw, s, Hp, Wp,
+                                   yb.buf, (n * Cout + oc) * Q, y_q8, inv_out);
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    if (!ok) {
+        PyErr_NoMemory();
+        goto fail;
+    }
+
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&wb);
+    PyBuffer_Release(&mb);
+    PyBuffer_Release(&bb);
+    PyBuffer_Release(&yb);
+    Py_RETURN_NONE;
+
+fail:
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&wb);
+    PyBuffer_Release(&mb);
+    PyBuffer_Release(&bb);
+    PyBuffer_Release(&yb);
+    return NULL;
+}
+
+// ---------------------------------------------------------------------------
+// Dense [+ ReLU]
+// ---------------------------------------------------------------------------
+
+PyObject* dense_q8_forward(PyObject *self, PyObject *args) {
+    Py_buffer xb = {0}, wb = {0}, mb = {0}, bb = {0}, yb = {0};
+    Py_ssize_t N, Din, Dout;
+    int x_unsigned, relu;
+    double out_scale;
+
+    // Parse: x, N, Din, x_unsigned, w, Dout, mult, bias, relu, out, out_scale
+    if (!PyArg_ParseTuple(
+            args,
+            "y*nnp"   // x: contiguous int8 or (x_unsigned) uint8 (N, Din)
+            "y*n"     // w: contiguous int8 (Dout, Din), i.e. the float W transposed; Dout
+            "y*y*"    // mult, bias: float64 (Dout,)
+            "p"       // relu
+            "w*d",    // out: contiguous (N, Dout), int8 or float64; out_scale for int8
+            &xb, &N, &Din, &x_unsigned,
+            &wb, &Dout,
+            &mb, &bb,
+            &relu,
+            &yb, &out_scale
+        )) {
+        return NULL;
+    }
+
+    int y_q8;
+    if (N < 0 || Din <= 0 || Dout <= 0) {
+        PyErr_SetString(PyExc_ValueError, "dense_q8_forward: invalid shapes");
+        goto fail;
+    }
+    if (!check_itemsize(&xb, 1, "x", "int8 or uint8") || !check_len(&xb, N * Din, "x")) goto fail;
+    if (!check_itemsize(&wb, 1, "w", "int8") || !check_len(&wb, Dout * Din, "w")) goto fail;
+    if (!check_itemsize(&mb, 8, "mult", "float64") || !check_len(&mb, Dout, "mult")) goto fail;
+    if (!check_itemsize(&bb, 8, "bias", "float64") || !check_len(&bb, Dout, "bias")) goto fail;
+    if (!check_q8_out(&yb, N * Dout, out_scale, relu, &y_q8)) goto fail;
+
+    const int8_t *w = (const int8_t*)wb.buf;
+    const double *mult = (const double*)mb.buf, *bias = (const double*)bb.buf;
+    double inv_out = y_q8 ? 1.0 / out_scale : 0.0;
+
+    Py_BEGIN_ALLOW_THREADS
+    CNN_OMP_FOR_IF(N * Dout * Din > 65536)
+    for (Py_ssize_t t = 0; t < N * Dout; t++) {
+        Py_ssize_t n = t / Dout, o = t % Dout;
+        const int8_t *wr = w + o * Din;
+
+        int32_t acc = 0;
+        if (x_unsigned) {
+            const uint8_t *xr = (const uint8_t*)xb.buf + n * Din;
+            for (Py_ssize_t i = 0; i < Din; i++) acc += (int32_t)xr[i] * (int32_t)wr[i];
+        } else {
+            const int8_t *xr = (const int8_t*)xb.buf + n * Din;
+            for (Py_ssize_t i = 0; i < Din; i++) acc += (int32_t)xr[i] * (int32_t)wr[i];
+        }
+
+        double v = acc * mult[o] + bias[o];
+        if (relu && v < 0.0) v = 0.0;
+        q8_store(yb.buf, t, y_q8, v, inv_out);
+    }
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&wb);
+    PyBuffer_Release(&mb);
+    PyBuffer_Release(&bb);
+    PyBuffer_Release(&yb);
+    Py_RETURN_NONE;
+
+fail:
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&wb);
+    PyBuffer_Release(&mb);
+    PyBuffer_Release(&bb);
+    PyBuffer_Release(&yb);
+    return NULL;
+}
\ No newline at end of file
@@ -0,0 +1,3127 @@
+// Kernels and their Python entry points, written once for an element type `real`.
+//
+// Included once per dtype by cnn_f64.c and cnn_f32.c, which define:
+//   REAL_TYPE     element type `real` of every tensor buffer (double or float)
+//   REAL_CODE     its array typecode ("d" or "f")
+//   REAL_NAME     its name in error messages
+//   KERNEL(name)  exported name of an entry point (name##_f64 or name##_f32)
+// cnn.c dispatches each Python call to one of the two by the buffers' itemsize.
+// Scalars passed from Python (lr, eps, ...) stay C doubles in both.
+
+#include "cnn.h"
+
+typedef REAL_TYPE real;
+
+// Strided view into a buffer of reals, as described by Tensor.args():
+// element (i0, i1, i2, i3) lives at data[off + i0*st[0] + i1*st[1] + i2*st[2] + i3*st[3]]
+typedef struct {
+    real *data;
+    Py_ssize_t off;
+    Py_ssize_t st[4];
+} view_t;
+
+static view_t make_view(Py_buffer *b, Py_ssize_t off,
+                        Py_ssize_t st0, Py_ssize_t st1, Py_ssize_t st2, Py_ssize_t st3) {
+    view_t v;
+    v.data = (real*)b->buf;
+    v.off = off;
+    v.st[0] = st0;
+    v.st[1] = st1;
+    v.st[2] = st2;
+    v.st[3] = st3;
+    return v;
+}
+
+static int ensure_real_buf(Py_buffer *b, const char *name) {
+    if (b->itemsize != (Py_ssize_t)sizeof(real)) {
+        PyErr_Format(PyExc_TypeError, "%s: expected buffer of " REAL_NAME " (itemsize=%d)", name, (int)sizeof(real));
+        return 0;
+    }
+    return 1;
+}
+
+// Writable buffer of reals for an out argument: n values starting at element off
+static int get_out_buffer(PyObject *out, Py_ssize_t off, Py_ssize_t n, Py_buffer *b, const char *name) {
+    if (PyObject_GetBuffer(out, b, PyBUF_WRITABLE) != 0) return 0;
+    if (!ensure_real_buf(b, name)) {
+        PyBuffer_Release(b);
+        return 0;
+    }
+    if (off < 0 || (off + n) * (Py_ssize_t)sizeof(real) > b->len) {
+        PyErr_Format(PyExc_IndexError, "%s: range out of bounds", name);
+        PyBuffer_Release(b);
+        return 0;
+    }
+    return 1;
+}
+
+// New array('d') / array('f') of n zeros: a cached one-element array repeated n times,
+// so one allocation and no module lookup per call
+static PyObject* make_zeroed_array(Py_ssize_t n) {
+    static PyObject *zero1 = NULL;
+
+    if (!zero1) {
+        PyObject *array_mod = PyImport_ImportModule("array");
+        if (!array_mod) return NULL;
+        PyObject *array_type = PyObject_GetAttrString(array_mod, "array");
+        Py_DECREF(array_mod);
+        if (!array_type) return NULL;
+
+        zero1 = PyObject_CallFunction(array_type, "s[d]", REAL_CODE, 0.0); // array('d', [0.0])
+        Py_DECREF(array_type);
+        if (!zero1) return NULL;
+    }
+
+    return PySequence_Repeat(zero1, n);
+}
+
+// Result buffer of n reals for an entry point: out[out_off:] when an out buffer is given
+// (out=None: a new zeroed array). *ret gets the object to return (new reference), *y its
+// first element. zero clears a given out range first, for kernels that accumulate into it.
+static int open_output(PyObject *out, Py_ssize_t out_off, Py_ssize_t n, int zero,
+                       Py_buffer *b, PyObject **ret, real **y, const char *name) {
+    if (out != Py_None) {
+        if (!get_out_buffer(out, out_off, n, b, name)) return 0;
+        *y = (real*)b->buf + out_off;
+        if (zero) memset(*y, 0, (size_t)n * sizeof(real));
+        Py_INCREF(out);
+        *ret = out;
+        return 1;
+    }
+
+    *ret = make_zeroed_array(n);
+    if (!*ret) return 0;
+    if (PyObject_GetBuffer(*ret, b, PyBUF_WRITABLE) != 0) {
+        Py_CLEAR(*ret);
+        return 0;
+    }
+    *y = (real*)b->buf;
+    return 1;
+}
+
+// ---------------------------------------------------------------------------
+// Per-sample compute helpers
+//
+// These hold the actual loops. The single-sample entry points call them once,
+// the *_batch entry points call them once per row of the leading N dimension,
+// so Python dispatch and argument parsing is paid once per batch.
+// Outputs are always written to contiguous buffers.
+//
+// Everything below the entry points runs with the GIL released, so these
+// helpers must not touch Python objects or the error indicator.
+// ---------------------------------------------------------------------------
+
+// One output channel: x: (Cin, H, W), W: (Cout, Cin, Kh, Kw), b: (Cout,) -> y: contiguous (Hout, Wout)
+static void conv_forward_plane(view_t x, view_t w, view_t b, Py_ssize_t oc,
+                               Py_ssize_t Cin, Py_ssize_t Kh, Py_ssize_t Kw,
+                               Py_ssize_t Hout, Py_ssize_t Wout, real *yplane) {
+    // x index: x_off + ic*x_st0 + iy*x_st1 + ix*x_st2
+    // W index: W_off + oc*W_st0 + ic*W_st1 + ky*W_st2 + kx*W_st3
+    // b index: b_off + oc*b_st0
+    real b_oc = b.data[b.off + oc * b.st[0]];
+    Py_ssize_t W_oc_base = w.off + oc * w.st[0];
+
+    for (Py_ssize_t oy = 0; oy < Hout; oy++) {
+        Py_ssize_t y_row_base = oy * Wout;
+
+        for (Py_ssize_t ox = 0; ox < Wout; ox++) {
+            real acc = b_oc;
+
+            for (Py_ssize_t ic = 0; ic < Cin; ic++) {
+                Py_ssize_t x_ic_base = x.off + ic * x.st[0];
+                Py_ssize_t W_ocic_base = W_oc_base + ic * w.st[1];
+
+                for (Py_ssize_t ky = 0; ky < Kh; ky++) {
+                    Py_ssize_t x_row = x_ic_base + (oy + ky) * x.st[1];
+                    Py_ssize_t W_row = W_ocic_base + ky * w.st[2];
+
+                    for (Py_ssize_t kx = 0; kx < Kw; kx++) {
+                        acc += x.data[x_row + (ox + kx) * x.st[2]] * w.data[W_row + kx * w.st[3]];
+                    }
+                }
+            }
+
+            yplane[y_row_base + ox] = acc;
+        }
+    }
+}
+
+// x: (Cin, H, W), W: (Cout, Cin, Kh, Kw), b: (Cout,) -> y: (Cout, Hout, Wout)
+static void conv_forward_sample(view_t x, view_t w, view_t b,
+                                Py_ssize_t Cin, Py_ssize_t Cout, Py_ssize_t Kh, Py_ssize_t Kw,
+                                Py_ssize_t Hout, Py_ssize_t Wout, real *ydata) {
+    CNN_OMP_FOR
+    for (Py_ssize_t oc = 0; oc < Cout; oc++) {
+        conv_forward_plane(x, w, b, oc, Cin, Kh, Kw, Hout, Wout, ydata + oc * (Hout * Wout));
+    }
+}
+
+// Accumulates into dW/db and writes dx: contiguous (Cin, H, W), which must be zeroed.
+static void conv_backward_sample(view_t x, view_t dy, view_t w, view_t dw, view_t db,
+                                 Py_ssize_t Cin, Py_ssize_t Cout, Py_ssize_t Kh, Py_ssize_t Kw,
+                                 Py_ssize_t H, Py_ssize_t Ww, Py_ssize_t Hout, Py_ssize_t Wout,
+                                 real *dxdata) {
+    // ---- db: db[oc] += sum_{oy,ox} dy[oc,oy,ox]
+    CNN_OMP_FOR
+    for (Py_ssize_t oc = 0; oc < Cout; oc++) {
+        real acc = 0.0;
+        Py_ssize_t dy_oc_base = dy.off + oc * dy.st[0];
+
+        for (Py_ssize_t oy = 0; oy < Hout; oy++) {
+            Py_ssize_t dy_row = dy_oc_base + oy * dy.st[1];
+            for (Py_ssize_t ox = 0; ox < Wout; ox++) {
+                acc += dy.data[dy_row + ox * dy.st[2]];
+            }
+        }
+        db.data[db.off + oc * db.st[0]] += acc;
+    }
+
+    // dW and dx are two passes so each can be split over the dimension it owns:
+    // dW over oc, dx over ic. Per element the summation order is unchanged.
+
+    // ---- dW[oc,ic,ky,kx] += x[ic,oy+ky,ox+kx] * dy[oc,oy,ox]
+    CNN_OMP_FOR
+    for (Py_ssize_t oc = 0; oc < Cout; oc++) {
+        Py_ssize_t dy_oc_base = dy.off + oc * dy.st[0];
+        Py_ssize_t dW_oc_base = dw.off + oc * dw.st[0];
+
+        for (Py_ssize_t oy = 0; oy < Hout; oy++) {
+            Py_ssize_t dy_row = dy_oc_base + oy * dy.st[1];
+
+            for (Py_ssize_t ox = 0; ox < Wout; ox++) {
+                real g = dy.data[dy_row + ox * dy.st[2]];
+
+                for (Py_ssize_t ic = 0; ic < Cin; ic++) {
+                    Py_ssize_t x_ic_base    = x.off + ic * x.st[0];
+                    Py_ssize_t dW_ocic_base = dW_oc_base + ic * dw.st[1];
+
+                    for (Py_ssize_t ky = 0; ky < Kh; ky++) {
+                        Py_ssize_t x_row  = x_ic_base + (oy + ky) * x.st[1];
+                        Py_ssize_t dW_row = dW_ocic_base + ky * dw.st[2];
+
+                        for (Py_ssize_t kx = 0; kx < Kw; kx++) {
+                            dw.data[dW_row + kx * dw.st[3]] += x.data[x_row + (ox + kx) * x.st[2]] * g;
+                        }
+                    }
+                }
+            }
+        }
+    }
+
+    // ---- dx[ic,oy+ky,ox+kx] += W[oc,ic,ky,kx] * dy[oc,oy,ox]
+    CNN_OMP_FOR
+    for (Py_ssize_t ic = 0; ic < Cin; ic++) {
+        Py_ssize_t dx_ic_base = ic * (H * Ww); // contiguous layout for dx
+
+        for (Py_ssize_t oc = 0; oc < Cout; oc++) {
+            Py_ssize_t dy_oc_base  = dy.off + oc * dy.st[0];
+            Py_ssize_t W_ocic_base = w.off + oc * w.st[0] + ic * w.st[1];
+
+            for (Py_ssize_t oy = 0; oy < Hout; oy++) {
+                Py_ssize_t dy_row = dy_oc_base + oy * dy.st[1];
+
+                for (Py_ssize_t ox = 0; ox < Wout; ox++) {
+                    real g = dy.data[dy_row + ox * dy.st[2]];
+
+                    for (Py_ssize_t ky = 0; ky < Kh; ky++) {
+                        Py_ssize_t dx_row = dx_ic_base + (oy + ky) * Ww;
+                        Py_ssize_t W_row  = W_ocic_base + ky * w.st[2];
+
+                        for (Py_ssize_t kx = 0; kx < Kw; kx++) {
+                            dxdata[dx_row + ox + kx] += w.data[W_row + kx * w.st[3]] * g;
+                        }
+                    }
+                }
+            }
+        }
+    }
+}
+
+// x: (Din,), W: (Din, Dout), b: (Dout,) -> z: (Dout,)
+static void dense_forward_sample(view_t x, view_t w, view_t b, Py_ssize_t din, Py_ssize_t dout, real *zdata) {
+    // z[j] = b[j] + sum_k x[k] * W[k,j]
+    CNN_OMP_FOR
+    for (Py_ssize_t j = 0; j < dout; j++) {
+        real acc = b.data[b.off + j * b.st[0]];
+
+        Py_ssize_t W_col_base = w.off + j * w.st[1]; // base of W[:, j]
+        for (Py_ssize_t k = 0; k < din; k++) {
+            acc += x.data[x.off + k * x.st[0]] * w.data[W_col_base + k * w.st[0]];
+        }
+        zdata[j] = acc;
+    }
+}
+
+// Accumulates into dW/db and writes dx: contiguous (Din,), which must be zeroed.
+static void dense_backward_sample(view_t x, view_t dz, view_t w, view_t dw, view_t db,
+                                  Py_ssize_t din, Py_ssize_t dout, real *dxdata) {
+    // db[j] += dz[j]
+    for (Py_ssize_t j = 0; j < dout; j++) {
+        db.data[db.off + j * db.st[0]] += dz.data[dz.off + j * dz.st[0]];
+    }
+
+    // dW[k,j] += x[k] * dz[j], split over columns j
+    CNN_OMP_FOR
+    for (Py_ssize_t j = 0; j < dout; j++) {
+        real g = dz.data[dz.off + j * dz.st[0]];
+        Py_ssize_t dW_col_base = dw.off + j * dw.st[1];
+
+        for (Py_ssize_t k = 0; k < din; k++) {
+            dw.data[dW_col_base + k * dw.st[0]] += x.data[x.off + k * x.st[0]] * g;
+        }
+    }
+
+    // dx[k] += W[k,j] * dz[j], split over rows k
+    CNN_OMP_FOR
+    for (Py_ssize_t k = 0; k < din; k++) {
+        Py_ssize_t W_row_base = w.off + k * w.st[0];
+        real acc = dxdata[k];
+
+        for (Py_ssize_t j = 0; j < dout; j++) {
+            acc += w.data[W_row_base + j * w.st[1]] * dz.data[dz.off + j * dz.st[0]];
+        }
+        dxdata[k] = acc;
+    }
+}
+
+// x: (C, H, W) -> y, argmax: contiguous (C, Hout, Wout); amdata may be NULL
+static void pool_max_forward_sample(view_t x, Py_ssize_t C, Py_ssize_t Hout, Py_ssize_t Wout,
+                                    Py_ssize_t ph, Py_ssize_t pw, Py_ssize_t s,
+                                    real *ydata, real *amdata) {
+    Py_ssize_t oc_stride = Hout * Wout;
+
+    CNN_OMP_FOR
+    for (Py_ssize_t c = 0; c < C; c++) {
+        Py_ssize_t x_c = x.off + c * x.st[0];
+        Py_ssize_t y_c = c * oc_stride;
+
+        for (Py_ssize_t oy = 0; oy < Hout; oy++) {
+            Py_ssize_t y_cy = y_c + oy * Wout;
+            Py_ssize_t x_win_row0 = x_c + oy * s * x.st[1];
+
+            for (Py_ssize_t ox = 0; ox < Wout; ox++) {
+                Py_ssize_t ix0 = ox * s;
+
+                real best_val = -1000000.0; // -inf
+                Py_ssize_t best_k = 0;
+                Py_ssize_t k = 0;
+
+                for (Py_ssize_t ky = 0; ky < ph; ky++) {
+                    Py_ssize_t x_col0 = x_win_row0 + ky * x.st[1] + ix0 * x.st[2];
+
+                    for (Py_ssize_t kx = 0; kx < pw; kx++) {
+                        real v = x.data[x_col0 + kx * x.st[2]];
+                        if (v > best_val) {
+                            best_val = v;
+                            best_k = k;
+                        }
+                        k++;
+                    }
+                }
+
+                ydata[y_cy + ox] = best_val;
+                if (amdata) amdata[y_cy + ox] = (real)best_k;
+            }
+        }
+    }
+}
+
+// x: (C, H, W) -> y: contiguous (C, Hout, Wout)
+static void pool_avg_forward_sample(view_t x, Py_ssize_t C, Py_ssize_t Hout, Py_ssize_t Wout,
+                                    Py_ssize_t ph, Py_ssize_t pw, Py_ssize_t s, real *ydata) {
+    real inv = 1.0 / (real)(ph * pw);
+    Py_ssize_t oc_stride = Hout * Wout;
+
+    CNN_OMP_FOR
+    for (Py_ssize_t c = 0; c < C; c++) {
+        Py_ssize_t x_c = x.off + c * x.st[0];
+        Py_ssize_t y_c = c * oc_stride;
+
+        for (Py_ssize_t oy = 0; oy < Hout; oy++) {
+            Py_ssize_t y_cy = y_c + oy * Wout;
+            Py_ssize_t x_win_row0 = x_c + oy * s * x.st[1];
+
+            for (Py_ssize_t ox = 0; ox < Wout; ox++) {
+                Py_ssize_t ix0 = ox * s;
+
+                real acc = 0.0;
+                for (Py_ssize_t ky = 0; ky < ph; ky++) {
+                    Py_ssize_t x_col0 = x_win_row0 + ky * x.st[1] + ix0 * x.st[2];
+                    for (Py_ssize_t kx = 0; kx < pw; kx++) {
+                        acc += x.data[x_col0 + kx * x.st[2]];
+                    }
+                }
+
+                ydata[y_cy + ox] = acc * inv;
+            }
+        }
+    }
+}
+
+// dy, argmax: (C, Hout, Wout) -> dx: contiguous (C, H, W), which must be zeroed
+static void pool_max_backward_sample(view_t dy, view_t am, Py_ssize_t C, Py_ssize_t H, Py_ssize_t W,
+                                     Py_ssize_t Hout, Py_ssize_t Wout, Py_ssize_t pw, Py_ssize_t s,
+                                     real *dxdata) {
+    Py_ssize_t dc_stride = H * W;
+
+    CNN_OMP_FOR
+    for (Py_ssize_t c = 0; c < C; c++) {
+        Py_ssize_t dy_c = dy.off + c * dy.st[0];
+        Py_ssize_t am_c = am.off + c * am.st[0];
+        Py_ssize_t dx_c = c * dc_stride;
+
+        for (Py_ssize_t oy = 0; oy < Hout; oy++) {
+            Py_ssize_t iy0 = oy * s;
+            Py_ssize_t dy_cy = dy_c + oy * dy.st[1];
+            Py_ssize_t am_cy = am_c + oy * am.st[1];
+
+            for (Py_ssize_t ox = 0; ox < Wout; ox++) {
+                real g = dy.data[dy_cy + ox * dy.st[2]];
+
+                Py_ssize_t k = (Py_ssize_t)am.data[am_cy + ox * am.st[2]];
+                Py_ssize_t ky = k / pw;
+                Py_ssize_t kx = k - ky * pw;
+
+                dxdata[dx_c + (iy0 + ky) * W + ox * s + kx] += g;
+            }
+        }
+    }
+}
+
+// dy: (C, Hout, Wout) -> dx: contiguous (C, H, W), which must be zeroed
+static void pool_avg_backward_sample(view_t dy, Py_ssize_t C, Py_ssize_t H, Py_ssize_t W,
+                                     Py_ssize_t Hout, Py_ssize_t Wout,
+                                     Py_ssize_t ph, Py_ssize_t pw, Py_ssize_t s, real *dxdata) {
+    real scale = 1.0 / (real)(ph * pw);
+    Py_ssize_t dc_stride = H * W;
+
+    CNN_OMP_FOR
+    for (Py_ssize_t c = 0; c < C; c++) {
+        Py_ssize_t dy_c = dy.off + c * dy.st[0];
+        Py_ssize_t dx_c = c * dc_stride;
+
+        for (Py_ssize_t oy = 0; oy < Hout; oy++) {
+            Py_ssize_t iy0 = oy * s;
+            Py_ssize_t dy_cy = dy_c + oy * dy.st[1];
+
+            for (Py_ssize_t ox = 0; ox < Wout; ox++) {
+                real g = dy.data[dy_cy + ox * dy.st[2]] * scale;
+                Py_ssize_t ix0 = ox * s;
+
+                for (Py_ssize_t ky = 0; ky < ph; ky++) {
+                    Py_ssize_t dx_row = dx_c + (iy0 + ky) * W;
+                    for (Py_ssize_t kx = 0; kx < pw; kx++) {
+                        dxdata[dx_row + ix0 + kx] += g;
+                    }
+                }
+            }
+        }
+    }
+}
+
+// ---------------------------------------------------------------------------
+// im2col + blocked GEMM convolution engine
+//
+// Lowers each sample to a (Cin*Kh*Kw, Hout*Wout) matrix so the convolution
+// becomes one dense matrix multiply per sample:
+//   forward:  y[Cout, P]   = W[Cout, K] * col[K, P] + b
+//   dW:       dW[Cout, K] += dy[Cout, P] * col^T[P, K]
+//   dx:       dcol[K, P]   = W^T[K, Cout] * dy[Cout, P], then col2im(dcol)
+// with K = Cin*Kh*Kw and P = Hout*Wout.
+// ---------------------------------------------------------------------------
+
+#if defined(_MSC_VER)
+#define CNN_RESTRICT __restrict
+#else
+#define CNN_RESTRICT restrict
+#endif
+
+// Cache blocking: a GEMM_KC x GEMM_NC panel of B (256 KB of doubles, half that for float) stays hot
+// in L2 while GEMM_MR rows of C stream over it.
+#define GEMM_MR 4
+#define GEMM_KC 128
+#define GEMM_NC 256
+
+enum { CONV_DIRECT = 0, CONV_IM2COL = 1, CONV_WINOGRAD = 2, CONV_FFT = 3 };
+
+static int parse_conv_algo(const char *name, int *algo) {
+    if (strcmp(name, "direct") == 0) { *algo = CONV_DIRECT; return 1; }
+    if (strcmp(name, "im2col") == 0) { *algo = CONV_IM2COL; return 1; }
+    if (strcmp(name, "winograd") == 0) { *algo = CONV_WINOGRAD; return 1; }
+    if (strcmp(name, "fft") == 0) { *algo = CONV_FFT; return 1; }
+    PyErr_Format(PyExc_ValueError, "unknown convolution algo '%s'", name);
+    return 0;
+}
+
+// Register tile: C[mb, nb] += A[mb, kb] * B[kb, nb] with mb <= GEMM_MR.
+// A is addressed as A[r*a_rs + k*a_ks] so the same kernel serves A and A^T.
+// Each B row is loaded once for all GEMM_MR rows of C; the j loop is unit-stride
+// over restrict pointers so the compiler can vectorize it.
+static void gemm_tile(Py_ssize_t mb, Py_ssize_t nb, Py_ssize_t kb,
+                      const real *A, Py_ssize_t a_rs, Py_ssize_t a_ks,
+                      const real *B, Py_ssize_t ldb, real *C, Py_ssize_t ldc) {
+    if (mb == GEMM_MR) {
+        real *CNN_RESTRICT c0 = C;
+        real *CNN_RESTRICT c1 = C + ldc;
+        real *CNN_RESTRICT c2 = C + 2 * ldc;
+        real *CNN_RESTRICT c3 = C + 3 * ldc;
+
+        for (Py_ssize_t k = 0; k < kb; k++) {
+            const real *CNN_RESTRICT b = B + k * ldb;
+            real a0 = A[k * a_ks];
+            real a1 = A[a_rs + k * a_ks];
+            real a2 = A[2 * a_rs + k * a_ks];
+            real a3 = A[3 * a_rs + k * a_ks];
+
+            for (Py_ssize_t j = 0; j < nb; j++) {
+                real bj = b[j];
+                c0[j] += a0 * bj;
+                c1[j] += a1 * bj;
+                c2[j] += a2 * bj;
+                c3[j] += a3 * bj;
+            }
+        }
+        return;
+    }
+
+    for (Py_ssize_t r = 0; r < mb; r++) {
+        real *CNN_RESTRICT c = C + r * ldc;
+        for (Py_ssize_t k = 0; k < kb; k++) {
+            const real *CNN_RESTRICT b = B + k * ldb;
+            real a = A[r * a_rs + k * a_ks];
+            for (Py_ssize_t j = 0; j < nb; j++) {
+                c[j] += a * b[j];
+            }
+        }
+    }
+}
+
+// C[M, N] += op(A)[M, K] * B[K, N], row-major. op(A)[i, k] = A[i*a_rs + k*a_ks].
+static void gemm(Py_ssize_t M, Py_ssize_t N, Py_ssize_t K,
+                 const real *A, Py_ssize_t a_rs, Py_ssize_t a_ks,
+                 const real *B, Py_ssize_t ldb, real *C, Py_ssize_t ldc) {
+    for (Py_ssize_t j0 = 0; j0 < N; j0 += GEMM_NC) {
+        Py_ssize_t nb = N - j0 < GEMM_NC ? N - j0 : GEMM_NC;
+
+        for (Py_ssize_t k0 = 0; k0 < K; k0 += GEMM_KC) {
+            Py_ssize_t kb = K - k0 < GEMM_KC ? K - k0 : GEMM_KC;
+
+            // row tiles of C are disjoint; per element the K order does not change
+            CNN_OMP_FOR_IF(M > GEMM_MR)
+            for (Py_ssize_t i = 0; i < M; i += GEMM_MR) {
+                Py_ssize_t mb = M - i < GEMM_MR ? M - i : GEMM_MR;
+                gemm_tile(mb, nb, kb, A + i * a_rs + k0 * a_ks, a_rs, a_ks,
+                          B + k0 * ldb + j0, ldb, C + i * ldc + j0, ldc);
+            }
+        }
+    }
+}
+
+// x: (Cin, H, W) -> col: (Cin*Kh*Kw, Hout*Wout)
+static void im2col_sample(view_t x, Py_ssize_t Cin, Py_ssize_t Kh, Py_ssize_t Kw,
+                          Py_ssize_t Hout, Py_ssize_t Wout, real *col) {
+    Py_ssize_t P = Hout * Wout;
+
+    CNN_OMP_FOR
+    for (Py_ssize_t ic = 0; ic < Cin; ic++) {
+        for (Py_ssize_t ky = 0; ky < Kh; ky++) {
+            for (Py_ssize_t kx = 0; kx < Kw; kx++) {
+                real *row = col + ((ic * Kh + ky) * Kw + kx) * P;
+
+                for (Py_ssize_t oy = 0; oy < Hout; oy++) {
+                    const real *src = x.data + x.off + ic * x.st[0] + (oy + ky) * x.st[1] + kx * x.st[2];
+                    real *dst = row + oy * Wout;
+
+                    if (x.st[2] == 1) {
+                        memcpy(dst, src, (size_t)Wout * sizeof(real));
+                    } else {
+                        for (Py_ssize_t ox = 0; ox < Wout; ox++) dst[ox] = src[ox * x.st[2]];
+                    }
+                }
+            }
+        }
+    }
+}
+
+// dx[ic, oy+ky, ox+kx] += col[(ic,ky,kx), (oy,ox)] with dx contiguous (Cin, H, W)
+static void col2im_sample(const real *col, Py_ssize_t Cin, Py_ssize_t H, Py_ssize_t W,
+                          Py_ssize_t Kh, Py_ssize_t Kw, Py_ssize_t Hout, Py_ssize_t Wout, real *dx) {
+    Py_ssize_t P = Hout * Wout;
+
+    CNN_OMP_FOR
+    for (Py_ssize_t ic = 0; ic < Cin; ic++) {
+        for (Py_ssize_t ky = 0; ky < Kh; ky++) {
+            for (Py_ssize_t kx = 0; kx < Kw; kx++) {
+                const real *row = col + ((ic * Kh + ky) * Kw + kx) * P;
+
+                for (Py_ssize_t oy = 0; oy < Hout; oy++) {
+                    real *CNN_RESTRICT dst = dx + ic * H * W + (oy + ky) * W + kx;
+                    const real *CNN_RESTRICT src = row + oy * Wout;
+                    for (Py_ssize_t ox = 0; ox < Wout; ox++) dst[ox] += src[ox];
+                }
+            }
+        }
+    }
+}
+
+// dst[c, r] = src[r, c] for src (R, C), in 32x32 tiles
+static void transpose(const real *src, Py_ssize_t R, Py_ssize_t C, real *dst) {
+    CNN_OMP_FOR
+    for (Py_ssize_t r0 = 0; r0 < R; r0 += 32) {
+        Py_ssize_t r1 = R - r0 < 32 ? R : r0 + 32;
+        for (Py_ssize_t c0 = 0; c0 < C; c0 += 32) {
+            Py_ssize_t c1 = C - c0 < 32 ? C : c0 + 32;
+            for (Py_ssize_t r = r0; r < r1; r++) {
+                for (Py_ssize_t c = c0; c < c1; c++) dst[c * R + r] = src[r * C + c];
+            }
+        }
+    }
+}
+
+// Copy a strided (Cout, Cin, Kh, Kw) kernel into a contiguous (Cout, K) matrix
+static void pack_kernel(view_t w, Py_ssize_t Cout, Py_ssize_t Cin, Py_ssize_t Kh, Py_ssize_t Kw, real *Wp) {
+    Py_ssize_t i = 0;
+    for (Py_ssize_t oc = 0; oc < Cout; oc++)
+        for (Py_ssize_t ic = 0; ic < Cin; ic++)
+            for (Py_ssize_t ky = 0; ky < Kh; ky++)
+                for (Py_ssize_t kx = 0; kx < Kw; kx++)
+                    Wp[i++] = w.data[w.off + oc * w.st[0] + ic * w.st[1] + ky * w.st[2] + kx * w.st[3]];
+}
+
+// Batched forward through im2col + GEMM. x: (N, Cin, H, W) with sample stride x_stn,
+// y: contiguous (N, Cout, Hout, Wout). Returns 0 on allocation failure.
+// Samples are split across threads, each with its own col matrix.
+static int conv_forward_im2col(view_t x, Py_ssize_t x_stn, view_t w, view_t b,
+                               Py_ssize_t N, Py_ssize_t Cin, Py_ssize_t Cout, Py_ssize_t Kh, Py_ssize_t Kw,
+                               Py_ssize_t Hout, Py_ssize_t Wout, real *ydata) {
+    Py_ssize_t K = Cin * Kh * Kw;
+    Py_ssize_t P = Hout * Wout;
+    int nt = cnn_threads;
+
+    real *Wp = (real*)cnn_scratch(CNN_SCRATCH_ENGINE, (size_t)(Cout * K + nt * K * P) * sizeof(real));
+    if (!Wp) return 0;
+    real *cols = Wp + Cout * K;
+
+    pack_kernel(w, Cout, Cin, Kh, Kw, Wp);
+
+    CNN_PRAGMA(omp parallel for num_threads(nt) if(nt > 1 && N > 1))
+    for (Py_ssize_t n = 0; n < N; n++) {
+        real *y = ydata + n * Cout * P;
+        real *col = cols + CNN_THREAD_ID() * K * P;
+
+        view_t xn = x;
+        xn.off = x.off + n * x_stn;
+        im2col_sample(xn, Cin, Kh, Kw, Hout, Wout, col);
+
+        for (Py_ssize_t oc = 0; oc < Cout; oc++) {
+            real b_oc = b.data[b.off + oc * b.st[0]];
+            for (Py_ssize_t p = 0; p < P; p++) y[oc * P + p] = b_oc;
+        }
+
+        gemm(Cout, P, K, Wp, K, 1, col, P, y, P);
+    }
+
+    return 1;
+}
+
+// Batched backward through im2col + GEMM. Accumulates into dW/db and writes
+// dx: contiguous (N, Cin, H, W), which must be zeroed.
+static int conv_backward_im2col(view_t x, Py_ssize_t x_stn, view_t dy, Py_ssize_t dy_stn,
+                                view_t w, view_t dw, view_t db,
+                                Py_ssize_t N, Py_ssize_t Cin, Py_ssize_t Cout, Py_ssize_t Kh, Py_ssize_t Kw,
+                                Py_ssize_t H, Py_ssize_t Ww, Py_ssize_t Hout, Py_ssize_t Wout, real *dxdata) {
+    Py_ssize_t K = Cin * Kh * Kw;
+    Py_ssize_t P = Hout * Wout;
+
+    // Wp, dWp: (Cout, K); col, dcol: (K, P); colT: (P, K); dyp: (Cout, P)
+    size_t n_scratch = (size_t)(2 * Cout * K + 3 * K * P + Cout * P);
+    real *Wp = (real*)cnn_scratch(CNN_SCRATCH_ENGINE, n_scratch * sizeof(real));
+    if (!Wp) return 0;
+    real *dWp  = Wp + Cout * K;
+    real *col  = dWp + Cout * K;
+    real *dcol = col + K * P;
+    real *colT = dcol + K * P;
+    real *dyp  = colT + K * P;
+
+    pack_kernel(w, Cout, Cin, Kh, Kw, Wp);
+    memset(dWp, 0, (size_t)(Cout * K) * sizeof(real));
+
+    Py_ssize_t x_off = x.off, dy_off = dy.off;
+    for (Py_ssize_t n = 0; n < N; n++) {
+        x.off = x_off + n * x_stn;
+        dy.off = dy_off + n * dy_stn;
+
+        // contiguous dy for this sample + db
+        CNN_OMP_FOR
+        for (Py_ssize_t oc = 0; oc < Cout; oc++) {
+            real acc = 0.0;
+            for (Py_ssize_t oy = 0; oy < Hout; oy++) {
+                for (Py_ssize_t ox = 0; ox < Wout; ox++) {
+                    real g = dy.data[dy.off + oc * dy.st[0] + oy * dy.st[1] + ox * dy.st[2]];
+                    dyp[oc * P + oy * Wout + ox] = g;
+                    acc += g;
+                }
+            }
+            db.data[db.off + oc * db.st[0]] += acc;
+        }
+
+        im2col_sample(x, Cin, Kh, Kw, Hout, Wout, col);
+        transpose(col, K, P, colT);
+
+        // dW += dy * col^T
+        gemm(Cout, K, P, dyp, P, 1, colT, K, dWp, K);
+
+        // dcol = W^T * dy
+        memset(dcol, 0, (size_t)(K * P) * sizeof(real));
+        gemm(K, P, Cout, Wp, 1, K, dyp, P, dcol, P);
+
+        col2im_sample(dcol, Cin, H, Ww, Kh, Kw, Hout, Wout, dxdata + n * Cin * H * Ww);
+    }
+
+    Py_ssize_t i = 0;
+    for (Py_ssize_t oc = 0; oc < Cout; oc++)
+        for (Py_ssize_t ic = 0; ic < Cin; ic++)
+            for (Py_ssize_t ky = 0; ky < Kh; ky++)
+                for (Py_ssize_t kx = 0; kx < Kw; kx++)
+                    dw.data[dw.off + oc * dw.st[0] + ic * dw.st[1] + ky * dw.st[2] + kx * dw.st[3]] += dWp[i++];
+
+    return 1;
+}
+
+// ---------------------------------------------------------------------------
+// Winograd and FFT convolution engines (forward only)
+//
+// Both trade multiplies per output pixel for transform work, so they pay off
+// on layers with many channels and large outputs. Backward passes for these
+// algos run through the im2col engine, which computes the same gradients.
+// ---------------------------------------------------------------------------
+
+#define CNN_PI 3.14159265358979323846
+
+// Output tile edge for Winograd F(m, r); clamped to the output size so tiny
+// outputs (e.g. 5x5 input, 5x5 kernel) do not waste a whole tile.
+#define WINO_M 4
+
+// Finite interpolation points for the Toom-Cook construction, plus one point at infinity
+static const double wino_points[] = {0.0, 1.0, -1.0, 2.0, -2.0, 0.5, -0.5, 3.0, -3.0, 1.0 / 3.0, -1.0 / 3.0};
+#define WINO_MAX_N ((Py_ssize_t)(sizeof(wino_points) / sizeof(wino_points[0])) + 1)
+
+// Largest kernel edge Winograd runs at in float32. Bigger kernels need the points
+// +-3, +-1/3, whose transforms lose ~1e-3 (k=7) to ~5e-2 (k=9) against "direct"
+// in float32; those convolutions fall back to im2col.
+#define WINO_F32_MAX_K 5
+
+static double ipow(double a, Py_ssize_t p) {
+    double v = 1.0;
+    for (Py_ssize_t i = 0; i < p; i++) v *= a;
+    return v;
+}
+
+// Builds the 1D transforms of F(m, r) with n = m + r - 1 (correlation form):
+//   y = AT [ (G g) .* (BT d) ],  AT: (m, n), G: (n, r), BT: (n, n)
+// G and AT evaluate the filter/output polynomials at the points, BT is the
+// transpose of the inverse Vandermonde matrix (interpolation), which follows
+// from transposing the Toom-Cook polynomial multiplication. Built in double and
+// rounded to real once, so float32 transforms carry no inversion error.
+static int winograd_matrices(Py_ssize_t m, Py_ssize_t r, real *AT, real *G, real *BT) {
+    Py_ssize_t n = m + r - 1;
+    if (n > WINO_MAX_N) return 0;
+
+    for (Py_ssize_t j = 0; j < n; j++) {
+        int inf = (j == n - 1);
+        for (Py_ssize_t k = 0; k < r; k++)
+            G[j * r + k] = (real)(inf ? (k == r - 1) : ipow(wino_points[j], k));
+        for (Py_ssize_t i = 0; i < m; i++)
+            AT[i * n + j] = (real)(inf ? (i == m - 1) : ipow(wino_points[j], i));
+    }
+
+    // [V | I] -> [I | V^-1] by Gauss-Jordan with partial pivoting
+    double aug[WINO_MAX_N][2 * WINO_MAX_N];
+    for (Py_ssize_t j = 0; j < n; j++) {
+        int inf = (j == n - 1);
+        for (Py_ssize_t p = 0; p < n; p++) {
+            aug[j][p] = inf ? (p == n - 1) : ipow(wino_points[j], p);
+            aug[j][n + p] = (j == p);
+        }
+    }
+    for (Py_ssize_t c = 0; c < n; c++) {
+        Py_ssize_t piv = c;
+        for (Py_ssize_t rr = c + 1; rr < n; rr++)
+            if (fabs(aug[rr][c]) > fabs(aug[piv][c])) piv = rr;
+        if (piv != c) {
+            for (Py_ssize_t k = 0; k < 2 * n; k++) {
+                double t = aug[c][k]; aug[c][k] = aug[piv][k]; aug[piv][k] = t;
+            }
+        }
+        double inv = 1.0 / aug[c][c];
+        for (Py_ssize_t k = 0; k < 2 * n; k++) aug[c][k] *= inv;
+        for (Py_ssize_t rr = 0; rr < n; rr++) {
+            if (rr == c || aug[rr][c] == 0.0) continue;
+            double f = aug[rr][c];
+            for (Py_ssize_t k = 0; k < 2 * n; k++) aug[rr][k] -= f * aug[c][k];
+        }
+    }
+
+    // BT = (V^-1)^T
+    for (Py_ssize_t j = 0; j < n; j++)
+        for (Py_ssize_t l = 0; l < n; l++)
+            BT[j * n + l] = (real)aug[l][n + j];
+
+    return 1;
+}
+
+// out (a, d) = L (a, b) * X (b, c) * R^T where R is (d, c); tmp holds (a, c)
+static void sandwich(const real *L, const real *X, const real *R,
+                     Py_ssize_t a, Py_ssize_t b, Py_ssize_t c, Py_ssize_t d, real *tmp, real *out) {
+    for (Py_ssize_t i = 0; i < a; i++) {
+        for (Py_ssize_t j = 0; j < c; j++) {
+            real acc = 0.0;
+            for (Py_ssize_t k = 0; k < b; k++) acc += L[i * b + k] * X[k * c + j];
+            tmp[i * c + j] = acc;
+        }
+    }
+    for (Py_ssize_t i = 0; i < a; i++) {
+        for (Py_ssize_t j = 0; j < d; j++) {
+            real acc = 0.0;
+            for (Py_ssize_t k = 0; k < c; k++) acc += tmp[i * c + k] * R[j * c + k];
+            out[i * d + j] = acc;
+        }
+    }
+}
+
+// Winograd tiles need m + r - 1 interpolation points along each axis
+static int winograd_supported(Py_ssize_t Kh, Py_ssize_t Kw, Py_ssize_t Hout, Py_ssize_t Wout) {
+    Py_ssize_t mh = Hout < WINO_M ? Hout : WINO_M;
+    Py_ssize_t mw = Wout < WINO_M ? Wout : WINO_M;
+    if (mh + Kh - 1 > WINO_MAX_N || mw + Kw - 1 > WINO_MAX_N) {
+        PyErr_SetString(PyExc_ValueError, "kernel too large for winograd");
+        return 0;
+    }
+    return 1;
+}
+
+// The engine a winograd request runs on: im2col for float32 kernels over WINO_F32_MAX_K
+static int winograd_or_im2col(int algo, Py_ssize_t Kh, Py_ssize_t Kw) {
+    if (algo == CONV_WINOGRAD && sizeof(real) < sizeof(double) && (Kh > WINO_F32_MAX_K || Kw > WINO_F32_MAX_K))
+        return CONV_IM2COL;
+    return algo;
+}
+
+// Batched Winograd forward. x: (N, Cin, H, W) with sample stride x_stn,
+// y: contiguous (N, Cout, Hout, Wout). Callers check winograd_supported() first.
+//
+// Per sample every (nh x nw) input tile is transformed once per input channel,
+// then each of the nh*nw transform-domain positions is an independent
+// (Cout x Cin) * (Cin x tiles) GEMM, followed by the output transform.
+static int conv_forward_winograd(view_t x, Py_ssize_t x_stn, view_t w, view_t b,
+                                 Py_ssize_t N, Py_ssize_t Cin, Py_ssize_t Cout, Py_ssize_t Kh, Py_ssize_t Kw,
+                                 Py_ssize_t H, Py_ssize_t Ww, Py_ssize_t Hout, Py_ssize_t Wout, real *ydata) {
+    Py_ssize_t mh = Hout < WINO_M ? Hout : WINO_M;
+    Py_ssize_t mw = Wout < WINO_M ? Wout : WINO_M;
+    Py_ssize_t nh = mh + Kh - 1;
+    Py_ssize_t nw = mw + Kw - 1;
+
+    Py_ssize_t E = nh * nw;
+    Py_ssize_t th = (Hout + mh - 1) / mh;
+    Py_ssize_t tw = (Wout + mw - 1) / mw;
+    Py_ssize_t T = th * tw;
+
+    real ATh[WINO_MAX_N * WINO_MAX_N], Gh[WINO_MAX_N * WINO_MAX_N], BTh[WINO_MAX_N * WINO_MAX_N];
+    real ATw[WINO_MAX_N * WINO_MAX_N], Gw[WINO_MAX_N * WINO_MAX_N], BTw[WINO_MAX_N * WINO_MAX_N];
+    if (!winograd_matrices(mh, Kh, ATh, Gh, BTh) || !winograd_matrices(mw, Kw, ATw, Gw, BTw)) return 0;
+
+    // U: (E, Cout, Cin) transformed kernels, V: (E, Cin, T) transformed tiles, M: (E, Cout, T)
+    size_t n_scratch = (size_t)(E * Cout * Cin + E * Cin * T + E * Cout * T);
+    real *U = (real*)cnn_scratch(CNN_SCRATCH_ENGINE, n_scratch * sizeof(real));
+    if (!U) return 0;
+    real *V = U + E * Cout * Cin;
+    real *M = V + E * Cin * T;
+
+    // U[:, oc, ic] = Gh g Gw^T
+    CNN_OMP_FOR
+    for (Py_ssize_t oc = 0; oc < Cout; oc++) {
+        real g[WINO_MAX_N * WINO_MAX_N], tmp[WINO_MAX_N * WINO_MAX_N], e[WINO_MAX_N * WINO_MAX_N];
+
+        for (Py_ssize_t ic = 0; ic < Cin; ic++) {
+            for (Py_ssize_t ky = 0; ky < Kh; ky++)
+                for (Py_ssize_t kx = 0; kx < Kw; kx++)
+                    g[ky * Kw + kx] = w.data[w.off + oc * w.st[0] + ic * w.st[1] + ky * w.st[2] + kx * w.st[3]];
+
+            sandwich(Gh, g, Gw, nh, Kh, Kw, nw, tmp, e);
+            for (Py_ssize_t k = 0; k < E; k++) U[(k * Cout + oc) * Cin + ic] = e[k];
+        }
+    }
+
+    Py_ssize_t x_off = x.off;
+    for (Py_ssize_t n = 0; n < N; n++) {
+        x.off = x_off + n * x_stn;
+
+        // V[:, ic, t] = BTh d BTw^T, zero padding past the input edge
+        CNN_OMP_FOR
+        for (Py_ssize_t ic = 0; ic < Cin; ic++) {
+            real d[WINO_MAX_N * WINO_MAX_N], tmp[WINO_MAX_N * WINO_MAX_N], e[WINO_MAX_N * WINO_MAX_N];
+
+            for (Py_ssize_t t = 0; t < T; t++) {
+                Py_ssize_t iy0 = (t / tw) * mh, ix0 = (t % tw) * mw;
+
+                for (Py_ssize_t i = 0; i < nh; i++) {
+                    for (Py_ssize_t j = 0; j < nw; j++) {
+                        Py_ssize_t iy = iy0 + i, ix = ix0 + j;
+                        d[i * nw + j] = (iy < H && ix < Ww)
+                                        ? x.data[x.off + ic * x.st[0] + iy * x.st[1] + ix * x.st[2]] : 0.0;
+                    }
+                }
+
+                sandwich(BTh, d, BTw, nh, nh, nw, nw, tmp, e);
+                for (Py_ssize_t k = 0; k < E; k++) V[(k * Cin + ic) * T + t] = e[k];
+            }
+        }
+
+        // M[k] = U[k] * V[k] for every transform-domain position k
+        memset(M, 0, (size_t)(E * Cout * T) * sizeof(real));
+        CNN_OMP_FOR
+        for (Py_ssize_t k = 0; k < E; k++) {
+            gemm(Cout, T, Cin, U + k * Cout * Cin, Cin, 1, V + k * Cin * T, T, M + k * Cout * T, T);
+        }
+
+        // y tile = ATh M ATw^T + b, keeping only outputs inside (Hout, Wout)
+        real *y = ydata + n * Cout * Hout * Wout;
+        CNN_OMP_FOR
+        for (Py_ssize_t oc = 0; oc < Cout; oc++) {
+            real b_oc = b.data[b.off + oc * b.st[0]];
+            real d[WINO_MAX_N * WINO_MAX_N], tmp[WINO_MAX_N * WINO_MAX_N], e[WINO_MAX_N * WINO_MAX_N];
+
+            for (Py_ssize_t t = 0; t < T; t++) {
+                Py_ssize_t oy0 = (t / tw) * mh, ox0 = (t % tw) * mw;
+
+                for (Py_ssize_t k = 0; k < E; k++) e[k] = M[(k * Cout + oc) * T + t];
+                sandwich(ATh, e, ATw, mh, nh, nw, mw, tmp, d);
+
+                for (Py_ssize_t i = 0; i < mh && oy0 + i < Hout; i++)
+                    for (Py_ssize_t j = 0; j < mw && ox0 + j < Wout; j++)
+                        y[(oc * Hout + oy0 + i) * Wout + ox0 + j] = d[i * mw + j] + b_oc;
+            }
+        }
+    }
+
+    return 1;
+}
+
+static Py_ssize_t next_pow2(Py_ssize_t v) {
+    Py_ssize_t p = 1;
+    while (p < v) p <<= 1;
+    return p;
+}
+
+// In-place radix-2 FFT of n complex values (interleaved re/im) spaced `stride`
+// complex elements apart. tw holds exp(-2*pi*i*k/tn) for k < tn/2, tn >= n.
+static void fft_1d(real *c, Py_ssize_t n, Py_ssize_t stride, const real *tw, Py_ssize_t tn, int inverse) {
+    for (Py_ssize_t i = 1, j = 0; i < n; i++) {
+        Py_ssize_t bit = n >> 1;
+        for (; j & bit; bit >>= 1) j ^= bit;
+        j ^= bit;
+        if (i < j) {
+            real *a = c + 2 * i * stride, *z = c + 2 * j * stride;
+            real t0 = a[0], t1 = a[1];
+            a[0] = z[0]; a[1] = z[1];
+            z[0] = t0; z[1] = t1;
+        }
+    }
+
+    for (Py_ssize_t len = 2; len <= n; len <<= 1) {
+        Py_ssize_t half = len >> 1;
+        Py_ssize_t step = tn / len;
+
+        for (Py_ssize_t i = 0; i < n; i += len) {
+            for (Py_ssize_t k = 0; k < half; k++) {
+                real wr = tw[2 * k * step];
+                real wi = inverse ? -tw[2 * k * step + 1] : tw[2 * k * step + 1];
+
+                real *u = c + 2 * (i + k) * stride;
+                real *v = c + 2 * (i + k + half) * stride;
+                real vr = v[0] * wr - v[1] * wi;
+                real vi = v[0] * wi + v[1] * wr;
+
+                v[0] = u[0] - vr; v[1] = u[1] - vi;
+                u[0] += vr;       u[1] += vi;
+            }
+        }
+    }
+}
+
+// 2D FFT of a contiguous (ph, pw) complex grid: rows, then columns
+static void fft_2d(real *c, Py_ssize_t ph, Py_ssize_t pw, const real *tw, Py_ssize_t tn, int inverse) {
+    for (Py_ssize_t i = 0; i < ph; i++) fft_1d(c + 2 * i * pw, pw, 1, tw, tn, inverse);
+    for (Py_ssize_t j = 0; j < pw; j++) fft_1d(c + 2 * j, ph, pw, tw, tn, inverse);
+}
+
+// Batched FFT forward. Cross-correlation is y = IFFT( FFT(x) .* conj(FFT(w)) ) on a
+// (ph, pw) power-of-two grid covering the input; valid outputs never wrap around.
+static int conv_forward_fft(view_t x, Py_ssize_t x_stn, view_t w, view_t b,
+                            Py_ssize_t N, Py_ssize_t Cin, Py_ssize_t Cout, Py_ssize_t Kh, Py_ssize_t Kw,
+                            Py_ssize_t H, Py_ssize_t Ww, Py_ssize_t Hout, Py_ssize_t Wout, real *ydata) {
+    Py_ssize_t ph = next_pow2(H), pw = next_pow2(Ww);
+    Py_ssize_t tn = ph > pw ? ph : pw;
+    Py_ssize_t P = ph * pw;
+    int nt = cnn_threads;
+
+    // Wf: (Cout, Cin, P), Xf: (Cin, P), accs: one (P) accumulator per thread, all complex; tw: tn/2 complex
+    size_t n_scratch = (size_t)(2 * (Cout * Cin * P + Cin * P + nt * P) + tn);
+    real *Wf = (real*)cnn_scratch(CNN_SCRATCH_ENGINE, n_scratch * sizeof(real));
+    if (!Wf) return 0;
+    real *Xf = Wf + 2 * Cout * Cin * P;
+    real *accs = Xf + 2 * Cin * P;
+    real *tw = accs + 2 * nt * P;
+
+    for (Py_ssize_t k = 0; k < tn / 2; k++) {
+        tw[2 * k] = cos(-2.0 * CNN_PI * (real)k / (real)tn);
+        tw[2 * k + 1] = sin(-2.0 * CNN_PI * (real)k / (real)tn);
+    }
+
+    memset(Wf, 0, (size_t)(2 * Cout * Cin * P) * sizeof(real));
+    CNN_PRAGMA(omp parallel for num_threads(nt) if(nt > 1))
+    for (Py_ssize_t oc = 0; oc < Cout; oc++) {
+        for (Py_ssize_t ic = 0; ic < Cin; ic++) {
+            real *f = Wf + 2 * (oc * Cin + ic) * P;
+            for (Py_ssize_t ky = 0; ky < Kh; ky++)
+                for (Py_ssize_t kx = 0; kx < Kw; kx++)
+                    f[2 * (ky * pw + kx)] = w.data[w.off + oc * w.st[0] + ic * w.st[1] + ky * w.st[2] + kx * w.st[3]];
+            fft_2d(f, ph, pw, tw, tn, 0);
+        }
+    }
+
+    real inv = 1.0 / (real)P;
+    Py_ssize_t x_off = x.off;
+    for (Py_ssize_t n = 0; n < N; n++) {
+        x.off = x_off + n * x_stn;
+
+        memset(Xf, 0, (size_t)(2 * Cin * P) * sizeof(real));
+        CNN_PRAGMA(omp parallel for num_threads(nt) if(nt > 1))
+        for (Py_ssize_t ic = 0; ic < Cin; ic++) {
+            real *f = Xf + 2 * ic * P;
+            for (Py_ssize_t iy = 0; iy < H; iy++)
+                for (Py_ssize_t ix = 0; ix < Ww; ix++)
+                    f[2 * (iy * pw + ix)] = x.data[x.off + ic * x.st[0] + iy * x.st[1] + ix * x.st[2]];
+            fft_2d(f, ph, pw, tw, tn, 0);
+        }
+
+        real *y = ydata + n * Cout * Hout * Wout;
+        CNN_PRAGMA(omp parallel for num_threads(nt) if(nt > 1))
+        for (Py_ssize_t oc = 0; oc < Cout; oc++) {
+            real *acc = accs + 2 * CNN_THREAD_ID() * P;
+            memset(acc, 0, (size_t)(2 * P) * sizeof(real));
+
+            for (Py_ssize_t ic = 0; ic < Cin; ic++) {
+                const real *CNN_RESTRICT xf = Xf + 2 * ic * P;
+                const real *CNN_RESTRICT wf = Wf + 2 * (oc * Cin + ic) * P;
+                real *CNN_RESTRICT a = acc;
+                for (Py_ssize_t k = 0; k < P; k++) {
+                    // x * conj(w)
+                    a[2 * k]     += xf[2 * k] * wf[2 * k]     + xf[2 * k + 1] * wf[2 * k + 1];
+                    a[2 * k + 1] += xf[2 * k + 1] * wf[2 * k] - xf[2 * k] * wf[2 * k + 1];
+                }
+            }
+
+            fft_2d(acc, ph, pw, tw, tn, 1);
+
+            real b_oc = b.data[b.off + oc * b.st[0]];
+            for (Py_ssize_t oy = 0; oy < Hout; oy++)
+                for (Py_ssize_t ox = 0; ox < Wout; ox++)
+                    y[(oc * Hout + oy) * Wout + ox] = acc[2 * (oy * pw + ox)] * inv + b_oc;
+        }
+    }
+
+    return 1;
+}
+
+// ---------------------------------------------------------------------------
+// Convolve
+// ---------------------------------------------------------------------------
+
+// Shared validation for conv forward/backward. x is (Cin, H, W) per sample.
+static int check_conv_shapes(Py_ssize_t Cin, Py_ssize_t H, Py_ssize_t Ww,
+                             Py_ssize_t W_Cout, Py_ssize_t W_Cin, Py_ssize_t Kh, Py_ssize_t Kw,
+                             Py_ssize_t b_s0, Py_ssize_t cout_arg, Py_ssize_t kh_arg, Py_ssize_t kw_arg) {
+    if (b_s0 != W_Cout) {
+        PyErr_SetString(PyExc_ValueError, "b.shape[0] must equal W.shape[0] (Cout)");
+        return 0;
+    }
+    if (W_Cin != Cin) {
+        PyErr_SetString(PyExc_ValueError, "W.shape[1] (Cin) must equal x.shape[0] (Cin)");
+        return 0;
+    }
+    if (cout_arg != W_Cout || kh_arg != Kh || kw_arg != Kw) {
+        PyErr_SetString(PyExc_ValueError, "cout/kh/kw args do not match kernel shape (W)");
+        return 0;
+    }
+    if (H - Kh + 1 <= 0 || Ww - Kw + 1 <= 0) {
+        PyErr_SetString(PyExc_ValueError, "Invalid output shape (Hout/Wout <= 0)");
+        return 0;
+    }
+    return 1;
+}
+
+PyObject* KERNEL(convolve_forward)(PyObject *self, PyObject *args) {
+    // Buffers
+    Py_buffer xb = {0}, Wb = {0}, bb = {0};
+
+    // x args3: (buf, x_off, x_s0, x_s1, x_s2, x_st0, x_st1, x_st2)
+    Py_ssize_t x_off, x_s0, x_s1, x_s2, x_st0, x_st1, x_st2;
+
+    // W args4: (buf, W_off, W_s0, W_s1, W_s2, W_s3, W_st0, W_st1, W_st2, W_st3)
+    Py_ssize_t W_off, W_s0, W_s1, W_s2, W_s3, W_st0, W_st1, W_st2, W_st3;
+
+    // b args1: (buf, b_off, b_s0, b_st0)
+    Py_ssize_t b_off, b_s0, b_st0;
+
+    // Extras (optional but matches your proposed call)
+    Py_ssize_t cout_arg, kh_arg, kw_arg;
+    PyObject *out = Py_None;
+    Py_ssize_t out_off = 0;
+
+    // Parse exactly: *x.args3(), *W.args4(), *b.args1(), cout, kh, kw[, out, out_off]
+    if (!PyArg_ParseTuple(
+            args,
+            "y*nnnnnnn"   // x: 1 buffer + 7 Py_ssize_t
+            "y*nnnnnnnnn" // W: 1 buffer + 9 Py_ssize_t
+            "y*nnn"       // b: 1 buffer + 3 Py_ssize_t
+            "nnn"         // extras: cout, kh, kw
+            "|On",        // out, out_off: write y into out[out_off:] instead of a new array
+            &xb, &x_off, &x_s0, &x_s1, &x_s2, &x_st0, &x_st1, &x_st2,
+            &Wb, &W_off, &W_s0, &W_s1, &W_s2, &W_s3, &W_st0, &W_st1, &W_st2, &W_st3,
+            &bb, &b_off, &b_s0, &b_st0,
+            &cout_arg, &kh_arg, &kw_arg,
+            &out, &out_off
+        )) {
+        return NULL;
+    }
+
+    // We rely on memoryview(array('d')) -> format "d" and itemsize 8.
+    if (!ensure_real_buf(&xb, "x") || !ensure_real_buf(&Wb, "W") || !ensure_real_buf(&bb, "b")) goto fail;
+
+    // x: (Cin, H, W), W: (Cout, Cin, Kh, Kw), b: (Cout,)
+    if (!check_conv_shapes(x_s0, x_s1, x_s2, W_s0, W_s1, W_s2, W_s3, b_s0, cout_arg, kh_arg, kw_arg)) goto fail;
+
+    // Output dims: valid convolution
+    Py_ssize_t Hout = x_s1 - W_s2 + 1;
+    Py_ssize_t Wout = x_s2 - W_s3 + 1;
+
+    PyObject *out_arr;
+    Py_buffer yb = {0};
+    real *ydata;
+    if (!open_output(out, out_off, W_s0 * Hout * Wout, 0, &yb, &out_arr, &ydata, "out")) goto fail;
+
+    // Using passed strides and offsets so it works with Tensor views/slices.
+    Py_BEGIN_ALLOW_THREADS
+    conv_forward_sample(make_view(&xb, x_off, x_st0, x_st1, x_st2, 0),
+                        make_view(&Wb, W_off, W_st0, W_st1, W_st2, W_st3),
+                        make_view(&bb, b_off, b_st0, 0, 0, 0),
+                        x_s0, W_s0, W_s2, W_s3, Hout, Wout, ydata);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&yb);
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&Wb);
+    PyBuffer_Release(&bb);
+
+    return out_arr;
+
+fail:
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&Wb);
+    PyBuffer_Release(&bb);
+    return NULL;
+}
+
+PyObject* KERNEL(convolve_forward_batch)(PyObject *self, PyObject *args) {
+    Py_buffer xb = {0}, Wb = {0}, bb = {0};
+
+    // x args4: (buf, x_off, N, Cin, H, W, x_st0, x_st1, x_st2, x_st3)
+    Py_ssize_t x_off, x_s0, x_s1, x_s2, x_s3, x_st0, x_st1, x_st2, x_st3;
+    Py_ssize_t W_off, W_s0, W_s1, W_s2, W_s3, W_st0, W_st1, W_st2, W_st3;
+    Py_ssize_t b_off, b_s0, b_st0;
+    Py_ssize_t cout_arg, kh_arg, kw_arg;
+    const char *algo_name = "direct";
+    int algo;
+    PyObject *out = Py_None;
+    Py_ssize_t out_off = 0;
+
+    // Parse: *x.args4(), *W.args4(), *b.args1(), cout, kh, kw[, algo, out, out_off]
+    if (!PyArg_ParseTuple(
+            args,
+            "y*nnnnnnnnn" // x
+            "y*nnnnnnnnn" // W
+            "y*nnn"       // b
+            "nnn"         // cout, kh, kw
+            "|sOn",       // algo: "direct" (default), "im2col", "winograd" or "fft"; out, out_off
+            &xb, &x_off, &x_s0, &x_s1, &x_s2, &x_s3, &x_st0, &x_st1, &x_st2, &x_st3,
+            &Wb, &W_off, &W_s0, &W_s1, &W_s2, &W_s3, &W_st0, &W_st1, &W_st2, &W_st3,
+            &bb, &b_off, &b_s0, &b_st0,
+            &cout_arg, &kh_arg, &kw_arg,
+            &algo_name, &out, &out_off
+        )) {
+        return NULL;
+    }
+
+    if (!parse_conv_algo(algo_name, &algo)) goto fail;
+    if (!ensure_real_buf(&xb, "x") || !ensure_real_buf(&Wb, "W") || !ensure_real_buf(&bb, "b")) goto fail;
+    if (!check_conv_shapes(x_s1, x_s2, x_s3, W_s0, W_s1, W_s2, W_s3, b_s0, cout_arg, kh_arg, kw_arg)) goto fail;
+
+    Py_ssize_t N = x_s0;
+    Py_ssize_t Hout = x_s2 - W_s2 + 1;
+    Py_ssize_t Wout = x_s3 - W_s3 + 1;
+    Py_ssize_t y_n = W_s0 * Hout * Wout;
+
+    algo = winograd_or_im2col(algo, W_s2, W_s3);
+    if (algo == CONV_WINOGRAD && !winograd_supported(W_s2, W_s3, Hout, Wout)) goto fail;
+
+    PyObject *out_arr;
+    Py_buffer yb = {0};
+    real *ydata;
+    if (!open_output(out, out_off, N * y_n, 0, &yb, &out_arr, &ydata, "out")) goto fail;
+
+    view_t w = make_view(&Wb, W_off, W_st0, W_st1, W_st2, W_st3);
+    view_t b = make_view(&bb, b_off, b_st0, 0, 0, 0);
+
+    view_t x = make_view(&xb, x_off, x_st1, x_st2, x_st3, 0);
+    int ok = 1;
+
+    Py_BEGIN_ALLOW_THREADS
+    if (algo == CONV_WINOGRAD) {
+        ok = conv_forward_winograd(x, x_st0, w, b, N, x_s1, W_s0, W_s2, W_s3, x_s2, x_s3, Hout, Wout, ydata);
+    } else if (algo == CONV_FFT) {
+        ok = conv_forward_fft(x, x_st0, w, b, N, x_s1, W_s0, W_s2, W_s3, x_s2, x_s3, Hout, Wout, ydata);
+    } else if (algo == CONV_IM2COL) {
+        ok = conv_forward_im2col(x, x_st0, w, b, N, x_s1, W_s0, W_s2, W_s3, Hout, Wout, ydata);
+    } else {
+        CNN_OMP_FOR_IF(N > 1)
+        for (Py_ssize_t n = 0; n < N; n++) {
+            view_t xn = x;
+            xn.off = x.off + n * x_st0;
+            conv_forward_sample(xn, w, b, x_s1, W_s0, W_s2, W_s3, Hout, Wout, ydata + n * y_n);
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    if (!ok) {
+        PyErr_NoMemory();
+        PyBuffer_Release(&yb);
+        Py_DECREF(out_arr);
+        goto fail;
+    }
+
+    PyBuffer_Release(&yb);
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&Wb);
+    PyBuffer_Release(&bb);
+
+    return out_arr;
+
+fail:
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&Wb);
+    PyBuffer_Release(&bb);
+    return NULL;
+}
+
+// Shared validation for conv backward. x is (Cin, H, W) and dy (Cout, Hout, Wout) per sample.
+static int check_conv_backward_shapes(Py_ssize_t Cin, Py_ssize_t H, Py_ssize_t Ww,
+                                      Py_ssize_t Cout, Py_ssize_t Hout, Py_ssize_t Wout,
+                                      Py_ssize_t W_Cout, Py_ssize_t W_Cin, Py_ssize_t Kh, Py_ssize_t Kw,
+                                      Py_ssize_t db_s0, Py_ssize_t cout_arg, Py_ssize_t kh_arg, Py_ssize_t kw_arg) {
+    if (Cout != W_Cout || Cin != W_Cin) {
+        PyErr_SetString(PyExc_ValueError, "Shape mismatch: dy/W or x/W channel dims");
+        return 0;
+    }
+    if (Kh != kh_arg || Kw != kw_arg || Cout != cout_arg) {
+        PyErr_SetString(PyExc_ValueError, "cout/kh/kw args do not match dy/W shapes");
+        return 0;
+    }
+    if (db_s0 != Cout) {
+        PyErr_SetString(PyExc_ValueError, "db.shape[0] must equal Cout");
+        return 0;
+    }
+    if (Hout != (H - Kh + 1) || Wout != (Ww - Kw + 1)) {
+        PyErr_SetString(PyExc_ValueError, "dy shape does not match valid conv output shape from x and kernel");
+        return 0;
+    }
+    return 1;
+}
+
+PyObject* KERNEL(convolve_backward)(PyObject *self, PyObject *args) {
+    // Buffers
+    Py_buffer xb = {0}, dyb = {0}, Wb = {0}, dWb = {0}, dbb = {0};
+
+    // x args3: (buf, off, s0,s1,s2, st0,st1,st2)
+    Py_ssize_t x_off, x_s0, x_s1, x_s2, x_st0, x_st1, x_st2;
+    // dy args3
+    Py_ssize_t dy_off, dy_s0, dy_s1, dy_s2, dy_st0, dy_st1, dy_st2;
+    // W args4: (buf, off, s0,s1,s2,s3, st0,st1,st2,st3)
+    Py_ssize_t W_off, W_s0, W_s1, W_s2, W_s3, W_st0, W_st1, W_st2, W_st3;
+    // dW args4 (writable)
+    Py_ssize_t dW_off, dW_s0, dW_s1, dW_s2, dW_s3, dW_st0, dW_st1, dW_st2, dW_st3;
+    // db args1 (writable): (buf, off, s0, st0)
+    Py_ssize_t db_off, db_s0, db_st0;
+
+    // extras
+    Py_ssize_t cout_arg, kh_arg, kw_arg;
+    PyObject *out = Py_None;
+    Py_ssize_t out_off = 0;
+
+    // Parse: *x.args3(), *dy.args3(), *W.args4(), *dW.args4(), *db.args1(), cout, kh, kw[, out, out_off]
+    if (!PyArg_ParseTuple(
+            args,
+            "y*nnnnnnn"    // x: 1 buffer + 7 ints
+            "y*nnnnnnn"    // dy: 1 buffer + 7 ints
+            "y*nnnnnnnnn"  // W: 1 buffer + 9 ints
+            "y*nnnnnnnnn"  // dW: 1 buffer + 9 ints
+            "y*nnn"        // db: 1 buffer + 3 ints
+            "nnn"          // extras
+            "|On",         // out, out_off: write dx into out[out_off:] instead of a new array
+            &xb, &x_off, &x_s0, &x_s1, &x_s2, &x_st0, &x_st1, &x_st2,
+            &dyb, &dy_off, &dy_s0, &dy_s1, &dy_s2, &dy_st0, &dy_st1, &dy_st2,
+            &Wb, &W_off, &W_s0, &W_s1, &W_s2, &W_s3, &W_st0, &W_st1, &W_st2, &W_st3,
+            &dWb, &dW_off, &dW_s0, &dW_s1, &dW_s2, &dW_s3, &dW_st0, &dW_st1, &dW_st2, &dW_st3,
+            &dbb, &db_off, &db_s0, &db_st0,
+            &cout_arg, &kh_arg, &kw_arg,
+            &out, &out_off
+        )) {
+        return NULL;
+    }
+
+    // Validate dtype
+    if (!ensure_real_buf(&xb, "x") ||
+        !ensure_real_buf(&dyb, "dy") ||
+        !ensure_real_buf(&Wb, "W") ||
+        !ensure_real_buf(&dWb, "dW") ||
+        !ensure_real_buf(&dbb, "db")) {
+        goto fail;
+    }
+
+    if (dWb.readonly) { PyErr_SetString(PyExc_TypeError, "dW buffer must be writable"); goto fail; }
+    if (dbb.readonly) { PyErr_SetString(PyExc_TypeError, "db buffer must be writable"); goto fail; }
+
+    if (!check_conv_backward_shapes(x_s0, x_s1, x_s2, dy_s0, dy_s1, dy_s2, W_s0, W_s1, W_s2, W_s3,
+                                    db_s0, cout_arg, kh_arg, kw_arg)) goto fail;
+
+    // dx = zeros(Cin, H, W)
+    PyObject *dx_arr;
+    Py_buffer dxb = {0};
+    real *dxdata;
+    if (!open_output(out, out_off, x_s0 * x_s1 * x_s2, 1, &dxb, &dx_arr, &dxdata, "out")) goto fail;
+
+    Py_BEGIN_ALLOW_THREADS
+    conv_backward_sample(make_view(&xb, x_off, x_st0, x_st1, x_st2, 0),
+                         make_view(&dyb, dy_off, dy_st0, dy_st1, dy_st2, 0),
+                         make_view(&Wb, W_off, W_st0, W_st1, W_st2, W_st3),
+                         make_view(&dWb, dW_off, dW_st0, dW_st1, dW_st2, dW_st3),
+                         make_view(&dbb, db_off, db_st0, 0, 0, 0),
+                         x_s0, dy_s0, W_s2, W_s3, x_s1, x_s2, dy_s1, dy_s2, dxdata);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&dxb);
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&dyb);
+    PyBuffer_Release(&Wb);
+    PyBuffer_Release(&dWb);
+    PyBuffer_Release(&dbb);
+
+    return dx_arr;
+
+fail:
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&dyb);
+    PyBuffer_Release(&Wb);
+    PyBuffer_Release(&dWb);
+    PyBuffer_Release(&dbb);
+    return NULL;
+}
+
+PyObject* KERNEL(convolve_backward_batch)(PyObject *self, PyObject *args) {
+    Py_buffer xb = {0}, dyb = {0}, Wb = {0}, dWb = {0}, dbb = {0};
+
+    Py_ssize_t x_off, x_s0, x_s1, x_s2, x_s3, x_st0, x_st1, x_st2, x_st3;
+    Py_ssize_t dy_off, dy_s0, dy_s1, dy_s2, dy_s3, dy_st0, dy_st1, dy_st2, dy_st3;
+    Py_ssize_t W_off, W_s0, W_s1, W_s2, W_s3, W_st0, W_st1, W_st2, W_st3;
+    Py_ssize_t dW_off, dW_s0, dW_s1, dW_s2, dW_s3, dW_st0, dW_st1, dW_st2, dW_st3;
+    Py_ssize_t db_off, db_s0, db_st0;
+    Py_ssize_t cout_arg, kh_arg, kw_arg;
+    const char *algo_name = "direct";
+    int algo;
+
+    PyObject *out = Py_None;
+    Py_ssize_t out_off = 0;
+
+    // Parse: *x.args4(), *dy.args4(), *W.args4(), *dW.args4(), *db.args1(), cout, kh, kw[, algo, out, out_off]
+    if (!PyArg_ParseTuple(
+            args,
+            "y*nnnnnnnnn"  // x
+            "y*nnnnnnnnn"  // dy
+            "y*nnnnnnnnn"  // W
+            "y*nnnnnnnnn"  // dW
+            "y*nnn"        // db
+            "nnn"          // extras
+            "|sOn",        // algo: "direct" (default), "im2col", "winograd" or "fft"; out, out_off
+            &xb, &x_off, &x_s0, &x_s1, &x_s2, &x_s3, &x_st0, &x_st1, &x_st2, &x_st3,
+            &dyb, &dy_off, &dy_s0, &dy_s1, &dy_s2, &dy_s3, &dy_st0, &dy_st1, &dy_st2, &dy_st3,
+            &Wb, &W_off, &W_s0, &W_s1, &W_s2, &W_s3, &W_st0, &W_st1, &W_st2, &W_st3,
+            &dWb, &dW_off, &dW_s0, &dW_s1, &dW_s2, &dW_s3, &dW_st0, &dW_st1, &dW_st2, &dW_st3,
+            &dbb, &db_off, &db_s0, &db_st0,
+            &cout_arg, &kh_arg, &kw_arg,
+            &algo_name, &out, &out_off
+        )) {
+        return NULL;
+    }
+
+    if (!parse_conv_algo(algo_name, &algo)) goto fail;
+
+    if (!ensure_real_buf(&xb, "x") ||
+        !ensure_real_buf(&dyb, "dy") ||
+        !ensure_real_buf(&Wb, "W") ||
+        !ensure_real_buf(&dWb, "dW") ||
+        !ensure_real_buf(&dbb, "db")) {
+        goto fail;
+    }
+
+    if (dWb.readonly) { PyErr_SetString(PyExc_TypeError, "dW buffer must be writable"); goto fail; }
+    if (dbb.readonly) { PyErr_SetString(PyExc_TypeError, "db buffer must be writable"); goto fail; }
+
+    if (dy_s0 != x_s0) {
+        PyErr_SetString(PyExc_ValueError, "Batch size mismatch between x and dy");
+        goto fail;
+    }
+    if (!check_conv_backward_shapes(x_s1, x_s2, x_s3, dy_s1, dy_s2, dy_s3, W_s0, W_s1, W_s2, W_s3,
+                                    db_s0, cout_arg, kh_arg, kw_arg)) goto fail;
+
+    Py_ssize_t N = x_s0;
+    Py_ssize_t dx_n = x_s1 * x_s2 * x_s3;
+
+    // dx = zeros(N, Cin, H, W)
+    PyObject *dx_arr;
+    Py_buffer dxb = {0};
+    real *dxdata;
+    if (!open_output(out, out_off, N * dx_n, 1, &dxb, &dx_arr, &dxdata, "out")) goto fail;
+
+    view_t w = make_view(&Wb, W_off, W_st0, W_st1, W_st2, W_st3);
+    view_t dw = make_view(&dWb, dW_off, dW_st0, dW_st1, dW_st2, dW_st3);
+    view_t db = make_view(&dbb, db_off, db_st0, 0, 0, 0);
+
+    // dW/db accumulate over the whole batch, so samples run in order and each one
+    // is split across threads internally. winograd/fft are forward-only engines,
+    // their gradients come from the im2col engine.
+    int ok = 1;
+
+    Py_BEGIN_ALLOW_THREADS
+    if (algo != CONV_DIRECT) {
+        ok = conv_backward_im2col(make_view(&xb, x_off, x_st1, x_st2, x_st3, 0), x_st0,
+                                  make_view(&dyb, dy_off, dy_st1, dy_st2, dy_st3, 0), dy_st0,
+                                  w, dw, db, N, x_s1, dy_s1, W_s2, W_s3, x_s2, x_s3, dy_s2, dy_s3, dxdata);
+    } else {
+        for (Py_ssize_t n = 0; n < N; n++) {
+            conv_backward_sample(make_view(&xb, x_off + n * x_st0, x_st1, x_st2, x_st3, 0),
+                                 make_view(&dyb, dy_off + n * dy_st0, dy_st1, dy_st2, dy_st3, 0),
+                                 w, dw, db,
+                                 x_s1, dy_s1, W_s2, W_s3, x_s2, x_s3, dy_s2, dy_s3, dxdata + n * dx_n);
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    if (!ok) {
+        PyErr_NoMemory();
+        PyBuffer_Release(&dxb);
+        Py_DECREF(dx_arr);
+        goto fail;
+    }
+
+    PyBuffer_Release(&dxb);
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&dyb);
+    PyBuffer_Release(&Wb);
+    PyBuffer_Release(&dWb);
+    PyBuffer_Release(&dbb);
+
+    return dx_arr;
+
+fail:
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&dyb);
+    PyBuffer_Release(&Wb);
+    PyBuffer_Release(&dWb);
+    PyBuffer_Release(&dbb);
+    return NULL;
+}
+
+// ---------------------------------------------------------------------------
+// Dense
+// ---------------------------------------------------------------------------
+
+PyObject* KERNEL(dense_forward)(PyObject *self, PyObject *args) {
+    Py_buffer xb = {0}, Wb = {0}, bb = {0};
+    Py_ssize_t x_off, x_s0, x_st0;
+    Py_ssize_t W_off, W_s0, W_s1, W_st0, W_st1;
+    Py_ssize_t b_off, b_s0, b_st0;
+    Py_ssize_t din, dout;
+    PyObject *out = Py_None;
+    Py_ssize_t out_off = 0;
+
+    if (!PyArg_ParseTuple(
+            args,
+            "y*nnn"        // x
+            "y*nnnnn"      // W
+            "y*nnn"        // b
+            "nn"           // din, dout
+            "|On",         // out, out_off: write z into out[out_off:] instead of a new array
+            &xb, &x_off, &x_s0, &x_st0,
+            &Wb, &W_off, &W_s0, &W_s1, &W_st0, &W_st1,
+            &bb, &b_off, &b_s0, &b_st0,
+            &din, &dout,
+            &out, &out_off
+        )) {
+        return NULL;
+    }
+
+    if (!ensure_real_buf(&xb, "x") || !ensure_real_buf(&Wb, "W") || !ensure_real_buf(&bb, "b")) goto fail;
+
+    // shape checks
+    if (x_s0 != din || W_s0 != din || W_s1 != dout || b_s0 != dout) {
+        PyErr_SetString(PyExc_ValueError, "Dense.forward shape mismatch");
+        goto fail;
+    }
+
+    PyObject *z_arr;
+    Py_buffer zb = {0};
+    real *zdata;
+    if (!open_output(out, out_off, dout, 0, &zb, &z_arr, &zdata, "out")) goto fail;
+
+    Py_BEGIN_ALLOW_THREADS
+    dense_forward_sample(make_view(&xb, x_off, x_st0, 0, 0, 0),
+                         make_view(&Wb, W_off, W_st0, W_st1, 0, 0),
+                         make_view(&bb, b_off, b_st0, 0, 0, 0),
+                         din, dout, zdata);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&zb);
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&Wb);
+    PyBuffer_Release(&bb);
+    return z_arr;
+
+fail:
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&Wb);
+    PyBuffer_Release(&bb);
+    return NULL;
+}
+
+PyObject* KERNEL(dense_forward_batch)(PyObject *self, PyObject *args) {
+    Py_buffer xb = {0}, Wb = {0}, bb = {0};
+    Py_ssize_t x_off, x_s0, x_s1, x_st0, x_st1;
+    Py_ssize_t W_off, W_s0, W_s1, W_st0, W_st1;
+    Py_ssize_t b_off, b_s0, b_st0;
+    Py_ssize_t din, dout;
+    PyObject *out = Py_None;
+    Py_ssize_t out_off = 0;
+
+    if (!PyArg_ParseTuple(
+            args,
+            "y*nnnnn"      // x: (N, Din)
+            "y*nnnnn"      // W
+            "y*nnn"        // b
+            "nn"           // din, dout
+            "|On",         // out, out_off: write z into out[out_off:] instead of a new array
+            &xb, &x_off, &x_s0, &x_s1, &x_st0, &x_st1,
+            &Wb, &W_off, &W_s0, &W_s1, &W_st0, &W_st1,
+            &bb, &b_off, &b_s0, &b_st0,
+            &din, &dout,
+            &out, &out_off
+        )) {
+        return NULL;
+    }
+
+    if (!ensure_real_buf(&xb, "x") || !ensure_real_buf(&Wb, "W") || !ensure_real_buf(&bb, "b")) goto fail;
+
+    if (x_s1 != din || W_s0 != din || W_s1 != dout || b_s0 != dout) {
+        PyErr_SetString(PyExc_ValueError, "Dense.forward shape mismatch");
+        goto fail;
+    }
+
+    Py_ssize_t N = x_s0;
+
+    PyObject *z_arr;
+    Py_buffer zb = {0};
+    real *zdata;
+    if (!open_output(out, out_off, N * dout, 0, &zb, &z_arr, &zdata, "out")) goto fail;
+
+    view_t w = make_view(&Wb, W_off, W_st0, W_st1, 0, 0);
+    view_t b = make_view(&bb, b_off, b_st0, 0, 0, 0);
+
+    Py_BEGIN_ALLOW_THREADS
+    CNN_OMP_FOR_IF(N > 1)
+    for (Py_ssize_t n = 0; n < N; n++) {
+        dense_forward_sample(make_view(&xb, x_off + n * x_st0, x_st1, 0, 0, 0), w, b, din, dout, zdata + n * dout);
+    }
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&zb);
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&Wb);
+    PyBuffer_Release(&bb);
+    return z_arr;
+
+fail:
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&Wb);
+    PyBuffer_Release(&bb);
+    return NULL;
+}
+
+PyObject* KERNEL(dense_backward)(PyObject *self, PyObject *args) {
+    Py_buffer xb = {0}, dzb = {0}, Wb = {0}, dWb = {0}, dbb = {0};
+    Py_ssize_t x_off, x_s0, x_st0;
+    Py_ssize_t dz_off, dz_s0, dz_st0;
+    Py_ssize_t W_off, W_s0, W_s1, W_st0, W_st1;
+    Py_ssize_t dW_off, dW_s0, dW_s1, dW_st0, dW_st1;
+    Py_ssize_t db_off, db_s0, db_st0;
+    Py_ssize_t din, dout;
+    PyObject *out = Py_None;
+    Py_ssize_t out_off = 0;
+
+    if (!PyArg_ParseTuple(
+            args,
+            "y*nnn"        // x
+            "y*nnn"        // dz
+            "y*nnnnn"      // W
+            "y*nnnnn"      // dW
+            "y*nnn"        // db
+            "nn"           // din, dout
+            "|On",         // out, out_off: write dx into out[out_off:] instead of a new array
+            &xb, &x_off, &x_s0, &x_st0,
+            &dzb, &dz_off, &dz_s0, &dz_st0,
+            &Wb, &W_off, &W_s0, &W_s1, &W_st0, &W_st1,
+            &dWb, &dW_off, &dW_s0, &dW_s1, &dW_st0, &dW_st1,
+            &dbb, &db_off, &db_s0, &db_st0,
+            &din, &dout,
+            &out, &out_off
+        )) {
+        return NULL;
+    }
+
+    if (!ensure_real_buf(&xb, "x") || !ensure_real_buf(&dzb, "dz") ||
+        !ensure_real_buf(&Wb, "W") || !ensure_real_buf(&dWb, "dW") || !ensure_real_buf(&dbb, "db")) goto fail;
+
+    if (dWb.readonly) { PyErr_SetString(PyExc_TypeError, "dW buffer must be writable"); goto fail; }
+    if (dbb.readonly) { PyErr_SetString(PyExc_TypeError, "db buffer must be writable"); goto fail; }
+
+    // shape checks
+    if (x_s0 != din || dz_s0 != dout ||
+        W_s0 != din || W_s1 != dout ||
+        dW_s0 != din || dW_s1 != dout ||
+        db_s0 != dout) {
+        PyErr_SetString(PyExc_ValueError, "Dense.backward shape mismatch");
+        goto fail;
+    }
+
+    // dx output (contiguous)
+    PyObject *dx_arr;
+    Py_buffer dxb = {0};
+    real *dxdata;
+    if (!open_output(out, out_off, din, 1, &dxb, &dx_arr, &dxdata, "out")) goto fail;
+
+    Py_BEGIN_ALLOW_THREADS
+    dense_backward_sample(make_view(&xb, x_off, x_st0, 0, 0, 0),
+                          make_view(&dzb, dz_off, dz_st0, 0, 0, 0),
+                          make_view(&Wb, W_off, W_st0, W_st1, 0, 0),
+                          make_view(&dWb, dW_off, dW_st0, dW_st1, 0, 0),
+                          make_view(&dbb, db_off, db_st0, 0, 0, 0),
+                          din, dout, dxdata);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&dxb);
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&dzb);
+    PyBuffer_Release(&Wb);
+    PyBuffer_Release(&dWb);
+    PyBuffer_Release(&dbb);
+    return dx_arr;
+
+fail:
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&dzb);
+    PyBuffer_Release(&Wb);
+    PyBuffer_Release(&dWb);
+    PyBuffer_Release(&dbb);
+    return NULL;
+}
+
+PyObject* KERNEL(dense_backward_batch)(PyObject *self, PyObject *args) {
+    Py_buffer xb = {0}, dzb = {0}, Wb = {0}, dWb = {0}, dbb = {0};
+    Py_ssize_t x_off, x_s0, x_s1, x_st0, x_st1;
+    Py_ssize_t dz_off, dz_s0, dz_s1, dz_st0, dz_st1;
+    Py_ssize_t W_off, W_s0, W_s1, W_st0, W_st1;
+    Py_ssize_t dW_off, dW_s0, dW_s1, dW_st0, dW_st1;
+    Py_ssize_t db_off, db_s0, db_st0;
+    Py_ssize_t din, dout;
+    PyObject *out = Py_None;
+    Py_ssize_t out_off = 0;
+
+    if (!PyArg_ParseTuple(
+            args,
+            "y*nnnnn"      // x: (N, Din)
+            "y*nnnnn"      // dz: (N, Dout)
+            "y*nnnnn"      // W
+            "y*nnnnn"      // dW
+            "y*nnn"        // db
+            "nn"           // din, dout
+            "|On",         // out, out_off: write dx into out[out_off:] instead of a new array
+            &xb, &x_off, &x_s0, &x_s1, &x_st0, &x_st1,
+            &dzb, &dz_off, &dz_s0, &dz_s1, &dz_st0, &dz_st1,
+            &Wb, &W_off, &W_s0, &W_s1, &W_st0, &W_st1,
+            &dWb, &dW_off, &dW_s0, &dW_s1, &dW_st0, &dW_st1,
+            &dbb, &db_off, &db_s0, &db_st0,
+            &din, &dout,
+            &out, &out_off
+        )) {
+        return NULL;
+    }
+
+    if (!ensure_real_buf(&xb, "x") || !ensure_real_buf(&dzb, "dz") ||
+        !ensure_real_buf(&Wb, "W") || !ensure_real_buf(&dWb, "dW") || !ensure_real_buf(&dbb, "db")) goto fail;
+
+    if (dWb.readonly) { PyErr_SetString(PyExc_TypeError, "dW buffer must be writable"); goto fail; }
+    if (dbb.readonly) { PyErr_SetString(PyExc_TypeError, "db buffer must be writable"); goto fail; }
+
+    if (x_s0 != dz_s0 || x_s1 != din || dz_s1 != dout ||
+        W_s0 != din || W_s1 != dout ||
+        dW_s0 != din || dW_s1 != dout ||
+        db_s0 != dout) {
+        PyErr_SetString(PyExc_ValueError, "Dense.backward shape mismatch");
+        goto fail;
+    }
+
+    Py_ssize_t N = x_s0;
+
+    PyObject *dx_arr;
+    Py_buffer dxb = {0};
+    real *dxdata;
+    if (!open_output(out, out_off, N * din, 1, &dxb, &dx_arr, &dxdata, "out")) goto fail;
+
+    view_t w = make_view(&Wb, W_off, W_st0, W_st1, 0, 0);
+    view_t dw = make_view(&dWb, dW_off, dW_st0, dW_st1, 0, 0);
+    view_t db = make_view(&dbb, db_off, db_st0, 0, 0, 0);
+
+    // dW/db accumulate across rows: samples in order, each split across threads
+    Py_BEGIN_ALLOW_THREADS
+    for (Py_ssize_t n = 0; n < N; n++) {
+        dense_backward_sample(make_view(&xb, x_off + n * x_st0, x_st1, 0, 0, 0),
+                              make_view(&dzb, dz_off + n * dz_st0, dz_st1, 0, 0, 0),
+                              w, dw, db, din, dout, dxdata + n * din);
+    }
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&dxb);
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&dzb);
+    PyBuffer_Release(&Wb);
+    PyBuffer_Release(&dWb);
+    PyBuffer_Release(&dbb);
+    return dx_arr;
+
+fail:
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&dzb);
+    PyBuffer_Release(&Wb);
+    PyBuffer_Release(&dWb);
+    PyBuffer_Release(&dbb);
+    return NULL;
+}
+
+// ---------------------------------------------------------------------------
+// Pooling
+// ---------------------------------------------------------------------------
+
+static int pool_out_shape(Py_ssize_t H, Py_ssize_t W, Py_ssize_t ph, Py_ssize_t pw, Py_ssize_t s,
+                          Py_ssize_t *Hout, Py_ssize_t *Wout) {
+    if (ph <= 0 || pw <= 0 || s <= 0) {
+        PyErr_SetString(PyExc_ValueError, "ph/pw/stride must be > 0");
+        return 0;
+    }
+
+    *Hout = (H - ph) / s + 1;
+    *Wout = (W - pw) / s + 1;
+    if (*Hout <= 0 || *Wout <= 0) {
+        PyErr_SetString(PyExc_ValueError, "Invalid output shape for pooling");
+        return 0;
+    }
+    return 1;
+}
+
+// Shared body of pool_forward_max / pool_forward_max_batch. x is (N, C, H, W).
+// y / argmax go to out[out_off:] / am_out[am_off:] when those are given, else to new arrays.
+static PyObject* pool_forward_max_impl(view_t x, Py_ssize_t N, Py_ssize_t x_stn,
+                                       Py_ssize_t C, Py_ssize_t H, Py_ssize_t W,
+                                       Py_ssize_t ph, Py_ssize_t pw, Py_ssize_t s, int want_argmax,
+                                       PyObject *out, Py_ssize_t out_off, PyObject *am_out, Py_ssize_t am_off) {
+    Py_ssize_t Hout, Wout;
+    if (!pool_out_shape(H, W, ph, pw, s, &Hout, &Wout)) return NULL;
+
+    Py_ssize_t out_n = C * Hout * Wout;
+    PyObject *y_arr;
+    Py_buffer yb = {0}, amb = {0};
+    real *ydata, *amdata = NULL;
+    if (!open_output(out, out_off, N * out_n, 0, &yb, &y_arr, &ydata, "out")) return NULL;
+
+    // argmax is only needed by backward; inference skips it and returns None in its place
+    PyObject *am_arr = Py_None;
+    if (!want_argmax) {
+        Py_INCREF(am_arr);
+    } else if (!open_output(am_out, am_off, N * out_n, 0, &amb, &am_arr, &amdata, "argmax")) {
+        PyBuffer_Release(&yb);
+        Py_DECREF(y_arr);
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    CNN_OMP_FOR_IF(N > 1)
+    for (Py_ssize_t n = 0; n < N; n++) {
+        view_t xn = x;
+        xn.off = x.off + n * x_stn;
+        pool_max_forward_sample(xn, C, Hout, Wout, ph, pw, s, ydata + n * out_n, amdata ? amdata + n * out_n : NULL);
+    }
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&yb);
+    if (want_argmax) PyBuffer_Release(&amb);
+
+    // return (y_arr, am_arr)
+    PyObject *ret = PyTuple_New(2);
+    PyTuple_SET_ITEM(ret, 0, y_arr);
+    PyTuple_SET_ITEM(ret, 1, am_arr);
+    return ret;
+}
+
+PyObject* KERNEL(pool_forward_max)(PyObject *self, PyObject *args) {
+    Py_buffer xb = {0};
+    Py_ssize_t x_off, C, H, W, xs0, xs1, xs2;
+    Py_ssize_t ph, pw, s;
+    int want_argmax = 1;
+    PyObject *out = Py_None, *am = Py_None;
+    Py_ssize_t out_off = 0, am_off = 0;
+
+    if (!PyArg_ParseTuple(
+            args,
+            "y*nnnnnnn"  // *x.args3()
+            "nnn"        // ph, pw, s
+            "|pOnOn",    // want_argmax: False skips argmax (inference), returns (y, None);
+                         // out, out_off, am, am_off: write y / argmax there instead of new arrays
+            &xb, &x_off, &C, &H, &W, &xs0, &xs1, &xs2,
+            &ph, &pw, &s, &want_argmax, &out, &out_off, &am, &am_off
+        )) return NULL;
+
+    PyObject *ret = NULL;
+    if (ensure_real_buf(&xb, "x")) {
+        ret = pool_forward_max_impl(make_view(&xb, x_off, xs0, xs1, xs2, 0), 1, 0, C, H, W, ph, pw, s,
+                                    want_argmax, out, out_off, am, am_off);
+    }
+
+    PyBuffer_Release(&xb);
+    return ret;
+}
+
+PyObject* KERNEL(pool_forward_max_batch)(PyObject *self, PyObject *args) {
+    Py_buffer xb = {0};
+    Py_ssize_t x_off, N, C, H, W, xsn, xs0, xs1, xs2;
+    Py_ssize_t ph, pw, s;
+    int want_argmax = 1;
+    PyObject *out = Py_None, *am = Py_None;
+    Py_ssize_t out_off = 0, am_off = 0;
+
+    if (!PyArg_ParseTuple(
+            args,
+            "y*nnnnnnnnn"  // *x.args4()
+            "nnn"          // ph, pw, s
+            "|pOnOn",      // want_argmax: False skips argmax (inference), returns (y, None);
+                           // out, out_off, am, am_off: write y / argmax there instead of new arrays
+            &xb, &x_off, &N, &C, &H, &W, &xsn, &xs0, &xs1, &xs2,
+            &ph, &pw, &s, &want_argmax, &out, &out_off, &am, &am_off
+        )) return NULL;
+
+    PyObject *ret = NULL;
+    if (ensure_real_buf(&xb, "x")) {
+        ret = pool_forward_max_impl(make_view(&xb, x_off, xs0, xs1, xs2, 0), N, xsn, C, H, W, ph, pw, s,
+                                    want_argmax, out, out_off, am, am_off);
+    }
+
+    PyBuffer_Release(&xb);
+    return ret;
+}
+
+// Shared body of pool_forward_avg / pool_forward_avg_batch. x is (N, C, H, W).
+static PyObject* pool_forward_avg_impl(view_t x, Py_ssize_t N, Py_ssize_t x_stn,
+                                       Py_ssize_t C, Py_ssize_t H, Py_ssize_t W,
+                                       Py_ssize_t ph, Py_ssize_t pw, Py_ssize_t s,
+                                       PyObject *out, Py_ssize_t out_off) {
+    Py_ssize_t Hout, Wout;
+    if (!pool_out_shape(H, W, ph, pw, s, &Hout, &Wout)) return NULL;
+
+    Py_ssize_t out_n = C * Hout * Wout;
+    PyObject *y_arr;
+    Py_buffer yb = {0};
+    real *ydata;
+    if (!open_output(out, out_off, N * out_n, 0, &yb, &y_arr, &ydata, "out")) return NULL;
+
+    Py_BEGIN_ALLOW_THREADS
+    CNN_OMP_FOR_IF(N > 1)
+    for (Py_ssize_t n = 0; n < N; n++) {
+        view_t xn = x;
+        xn.off = x.off + n * x_stn;
+        pool_avg_forward_sample(xn, C, Hout, Wout, ph, pw, s, ydata + n * out_n);
+    }
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&yb);
+    return y_arr;
+}
+
+PyObject* KERNEL(pool_forward_avg)(PyObject *self, PyObject *args) {
+    Py_buffer xb = {0};
+    Py_ssize_t x_off, C, H, W, xs0, xs1, xs2;
+    Py_ssize_t ph, pw, s;
+    PyObject *out = Py_None;
+    Py_ssize_t out_off = 0;
+
+    if (!PyArg_ParseTuple(
+            args,
+            "y*nnnnnnn"  // *x.args3()
+            "nnn"        // ph, pw, s
+            "|On",       // out, out_off: write y into out[out_off:] instead of a new array
+            &xb, &x_off, &C, &H, &W, &xs0, &xs1, &xs2,
+            &ph, &pw, &s, &out, &out_off
+        )) return NULL;
+
+    PyObject *ret = NULL;
+    if (ensure_real_buf(&xb, "x")) {
+        ret = pool_forward_avg_impl(make_view(&xb, x_off, xs0, xs1, xs2, 0), 1, 0, C, H, W, ph, pw, s,
+                                    out, out_off);
+    }
+
+    PyBuffer_Release(&xb);
+    return ret;
+}
+
+PyObject* KERNEL(pool_forward_avg_batch)(PyObject *self, PyObject *args) {
+    Py_buffer xb = {0};
+    Py_ssize_t x_off, N, C, H, W, xsn, xs0, xs1, xs2;
+    Py_ssize_t ph, pw, s;
+    PyObject *out = Py_None;
+    Py_ssize_t out_off = 0;
+
+    if (!PyArg_ParseTuple(
+            args,
+            "y*nnnnnnnnn"  // *x.args4()
+            "nnn"          // ph, pw, s
+            "|On",         // out, out_off: write y into out[out_off:] instead of a new array
+            &xb, &x_off, &N, &C, &H, &W, &xsn, &xs0, &xs1, &xs2,
+            &ph, &pw, &s, &out, &out_off
+        )) return NULL;
+
+    PyObject *ret = NULL;
+    if (ensure_real_buf(&xb, "x")) {
+        ret = pool_forward_avg_impl(make_view(&xb, x_off, xs0, xs1, xs2, 0), N, xsn, C, H, W, ph, pw, s,
+                                    out, out_off);
+    }
+
+    PyBuffer_Release(&xb);
+    return ret;
+}
+
+// Shared body of pool_backward_max / pool_backward_max_batch. dy/argmax are (N, C, Hout, Wout).
+static PyObject* pool_backward_max_impl(view_t dy, Py_ssize_t dy_stn, view_t am, Py_ssize_t am_stn,
+                                        Py_ssize_t N, Py_ssize_t C, Py_ssize_t Hout, Py_ssize_t Wout,
+                                        Py_ssize_t H, Py_ssize_t W, Py_ssize_t ph, Py_ssize_t pw, Py_ssize_t s,
+                                        PyObject *out, Py_ssize_t out_off) {
+    if (ph <= 0 || pw <= 0 || s <= 0) {
+        PyErr_SetString(PyExc_ValueError, "ph/pw/stride must be > 0");
+        return NULL;
+    }
+
+    // Validate dy shape corresponds to (H,W,ph,pw,s)
+    if (Hout != (H - ph) / s + 1 || Wout != (W - pw) / s + 1) {
+        PyErr_SetString(PyExc_ValueError, "dy shape does not match pooling output shape from (H,W,ph,pw,s)");
+        return NULL;
+    }
+
+    Py_ssize_t dx_n = C * H * W;
+    PyObject *dx_arr;
+    Py_buffer dxb = {0};
+    real *dxdata;
+    if (!open_output(out, out_off, N * dx_n, 1, &dxb, &dx_arr, &dxdata, "out")) return NULL;
+
+    Py_BEGIN_ALLOW_THREADS
+    CNN_OMP_FOR_IF(N > 1)
+    for (Py_ssize_t n = 0; n < N; n++) {
+        view_t dyn = dy, amn = am;
+        dyn.off = dy.off + n * dy_stn;
+        amn.off = am.off + n * am_stn;
+        pool_max_backward_sample(dyn, amn, C, H, W, Hout, Wout, pw, s, dxdata + n * dx_n);
+    }
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&dxb);
+    return dx_arr;
+}
+
+PyObject* KERNEL(pool_backward_max)(PyObject *self, PyObject *args) {
+    Py_buffer dyb = {0}, amb = {0};
+
+    // dy args3
+    Py_ssize_t dy_off, dyC, Hout, Wout, dys0, dys1, dys2;
+
+    // argmax args3
+    Py_ssize_t am_off, amC, amH, amW, ams0, ams1, ams2;
+
+    // extras
+    Py_ssize_t H, W, ph, pw, s;
+    PyObject *out = Py_None;
+    Py_ssize_t out_off = 0;
+
+    if (!PyArg_ParseTuple(
+            args,
+            "y*nnnnnnn"  // dy: buf, off, C, Hout, Wout, st0, st1, st2
+            "y*nnnnnnn"  // am: buf, off, C, Hout, Wout, st0, st1, st2
+            "nnnnn"      // H, W, ph, pw, s
+            "|On",       // out, out_off: write dx into out[out_off:] instead of a new array
+            &dyb, &dy_off, &dyC, &Hout, &Wout, &dys0, &dys1, &dys2,
+            &amb, &am_off, &amC, &amH, &amW, &ams0, &ams1, &ams2,
+            &H, &W, &ph, &pw, &s, &out, &out_off
+        )) {
+        return NULL;
+    }
+
+    PyObject *ret = NULL;
+    if (!ensure_real_buf(&dyb, "dy") || !ensure_real_buf(&amb, "argmax")) goto done;
+
+    if (amC != dyC || amH != Hout || amW != Wout) {
+        PyErr_SetString(PyExc_ValueError, "argmax shape mismatch vs dy");
+        goto done;
+    }
+
+    ret = pool_backward_max_impl(make_view(&dyb, dy_off, dys0, dys1, dys2, 0), 0,
+                                 make_view(&amb, am_off, ams0, ams1, ams2, 0), 0,
+                                 1, dyC, Hout, Wout, H, W, ph, pw, s, out, out_off);
+
+done:
+    PyBuffer_Release(&dyb);
+    PyBuffer_Release(&amb);
+    return ret;
+}
+
+PyObject* KERNEL(pool_backward_max_batch)(PyObject *self, PyObject *args) {
+    Py_buffer dyb = {0}, amb = {0};
+    Py_ssize_t dy_off, dyN, dyC, Hout, Wout, dysn, dys0, dys1, dys2;
+    Py_ssize_t am_off, amN, amC, amH, amW, amsn, ams0, ams1, ams2;
+    Py_ssize_t H, W, ph, pw, s;
+    PyObject *out = Py_None;
+    Py_ssize_t out_off = 0;
+
+    if (!PyArg_ParseTuple(
+            args,
+            "y*nnnnnnnnn"  // dy: buf, off, N, C, Hout, Wout, stn, st0, st1, st2
+            "y*nnnnnnnnn"  // am: buf, off, N, C, Hout, Wout, stn, st0, st1, st2
+            "nnnnn"        // H, W, ph, pw, s
+            "|On",         // out, out_off: write dx into out[out_off:] instead of a new array
+            &dyb, &dy_off, &dyN, &dyC, &Hout, &Wout, &dysn, &dys0, &dys1, &dys2,
+            &amb, &am_off, &amN, &amC, &amH, &amW, &amsn, &ams0, &ams1, &ams2,
+            &H, &W, &ph, &pw, &s, &out, &out_off
+        )) {
+        return NULL;
+    }
+
+    PyObject *ret = NULL;
+    if (!ensure_real_buf(&dyb, "dy") || !ensure_real_buf(&amb, "argmax")) goto done;
+
+    if (amN != dyN || amC != dyC || amH != Hout || amW != Wout) {
+        PyErr_SetString(PyExc_ValueError, "argmax shape mismatch vs dy");
+        goto done;
+    }
+
+    ret = pool_backward_max_impl(make_view(&dyb, dy_off, dys0, dys1, dys2, 0), dysn,
+                                 make_view(&amb, am_off, ams0, ams1, ams2, 0), amsn,
+                                 dyN, dyC, Hout, Wout, H, W, ph, pw, s, out, out_off);
+
+done:
+    PyBuffer_Release(&dyb);
+    PyBuffer_Release(&amb);
+    return ret;
+}
+
+// Shared body of pool_backward_avg / pool_backward_avg_batch. dy is (N, C, Hout, Wout).
+static PyObject* pool_backward_avg_impl(view_t dy, Py_ssize_t dy_stn,
+                                        Py_ssize_t N, Py_ssize_t C, Py_ssize_t Hout, Py_ssize_t Wout,
+                                        Py_ssize_t H, Py_ssize_t W, Py_ssize_t ph, Py_ssize_t pw, Py_ssize_t s,
+                                        PyObject *out, Py_ssize_t out_off) {
+    if (ph <= 0 || pw <= 0 || s <= 0) {
+        PyErr_SetString(PyExc_ValueError, "ph/pw/stride must be > 0");
+        return NULL;
+    }
+    if (Hout != (H - ph) / s + 1 || Wout != (W - pw) / s + 1) {
+        PyErr_SetString(PyExc_ValueError, "dy shape does not match pooling output shape from (C,H,W,ph,pw,s)");
+        return NULL;
+    }
+
+    Py_ssize_t dx_n = C * H * W;
+    PyObject *dx_arr;
+    Py_buffer dxb = {0};
+    real *dxdata;
+    if (!open_output(out, out_off, N * dx_n, 1, &dxb, &dx_arr, &dxdata, "out")) return NULL;
+
+    Py_BEGIN_ALLOW_THREADS
+    CNN_OMP_FOR_IF(N > 1)
+    for (Py_ssize_t n = 0; n < N; n++) {
+        view_t dyn = dy;
+        dyn.off = dy.off + n * dy_stn;
+        pool_avg_backward_sample(dyn, C, H, W, Hout, Wout, ph, pw, s, dxdata + n * dx_n);
+    }
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&dxb);
+    return dx_arr;
+}
+
+PyObject* KERNEL(pool_backward_avg)(PyObject *self, PyObject *args) {
+    Py_buffer dyb = {0};
+    Py_ssize_t dy_off, C, Hout, Wout, dys0, dys1, dys2;
+    Py_ssize_t H, W, ph, pw, s;
+    PyObject *out = Py_None;
+    Py_ssize_t out_off = 0;
+
+    if (!PyArg_ParseTuple(
+            args,
+            "y*nnnnnnn"  // *dy.args3()
+            "nnnnn"      // H, W, ph, pw, s
+            "|On",       // out, out_off: write dx into out[out_off:] instead of a new array
+            &dyb, &dy_off, &C, &Hout, &Wout, &dys0, &dys1, &dys2,
+            &H, &W, &ph, &pw, &s, &out, &out_off
+        )) return NULL;
+
+    PyObject *ret = NULL;
+    if (ensure_real_buf(&dyb, "dy")) {
+        ret = pool_backward_avg_impl(make_view(&dyb, dy_off, dys0, dys1, dys2, 0), 0,
+                                     1, C, Hout, Wout, H, W, ph, pw, s, out, out_off);
+    }
+
+    PyBuffer_Release(&dyb);
+    return ret;
+}
+
+PyObject* KERNEL(pool_backward_avg_batch)(PyObject *self, PyObject *args) {
+    Py_buffer dyb = {0};
+    Py_ssize_t dy_off, N, C, Hout, Wout, dysn, dys0, dys1, dys2;
+    Py_ssize_t H, W, ph, pw, s;
+    PyObject *out = Py_None;
+    Py_ssize_t out_off = 0;
+
+    if (!PyArg_ParseTuple(
+            args,
+            "y*nnnnnnnnn"  // *dy.args4()
+            "nnnnn"        // H, W, ph, pw, s
+            "|On",         // out, out_off: write dx into out[out_off:] instead of a new array
+            &dyb, &dy_off, &N, &C, &Hout, &Wout, &dysn, &dys0, &dys1, &dys2,
+            &H, &W, &ph, &pw, &s, &out, &out_off
+        )) return NULL;
+
+    PyObject *ret = NULL;
+    if (ensure_real_buf(&dyb, "dy")) {
+        ret = pool_backward_avg_impl(make_view(&dyb, dy_off, dys0, dys1, dys2, 0), dysn,
+                                     N, C, Hout, Wout, H, W, ph, pw, s, out, out_off);
+    }
+
+    PyBuffer_Release(&dyb);
+    return ret;
+}
+
+// ---------------------------------------------------------------------------
+// Activations and loss
+//
+// Elementwise kernels run over n contiguous values starting at off, like the
+// Python layers they replace. Each mirrors its Python loop operation for
+// operation, so results are bitwise identical.
+// ---------------------------------------------------------------------------
+
+static int check_range(Py_buffer *b, Py_ssize_t off, Py_ssize_t n, const char *name) {
+    if (n < 0 || off < 0 || (off + n) * (Py_ssize_t)sizeof(real) > b->len) {
+        PyErr_Format(PyExc_IndexError, "%s: range out of bounds", name);
+        return 0;
+    }
+    return 1;
+}
+
+enum { ACT_RELU_FWD, ACT_RELU_BWD, ACT_SIGMOID_FWD, ACT_SIGMOID_BWD };
+
+// out = op(a) or op(a, b) over n values; b is only read by the backward ops
+static void activation_apply(int op, const real *a, const real *b, real *out, Py_ssize_t n) {
+    CNN_OMP_FOR_IF(n > 4096)
+    for (Py_ssize_t k = 0; k < n; k++) {
+        real v = a[k];
+        switch (op) {
+            case ACT_RELU_FWD:    out[k] = v > 0.0 ? v : 0.0; break;
+            case ACT_RELU_BWD:    out[k] = b[k] * (v > 0.0 ? 1.0 : 0.0); break;      // a: x, b: dy
+            case ACT_SIGMOID_FWD: out[k] = 1.0 / (1.0 + exp(-v)); break;
+            default:              out[k] = b[k] * v * (1.0 - v); break;              // a: y, b: dy
+        }
+    }
+}
+
+static PyObject* activation_impl(PyObject *args, int op) {
+    Py_buffer ab = {0}, bb = {0}, ob = {0};
+    Py_ssize_t a_off, b_off = 0, n;
+    PyObject *out = Py_None;
+    Py_ssize_t out_off = 0;
+    int backward = op == ACT_RELU_BWD || op == ACT_SIGMOID_BWD;
+
+    // Parse: forward: buf, off, n / backward: x (relu) or y (sigmoid) buf, off, dy buf, off, n;
+    // then optionally out, out_off to write the result into out[out_off:] instead of a new array
+    if (backward) {
+        if (!PyArg_ParseTuple(args, "y*ny*nn|On", &ab, &a_off, &bb, &b_off, &n, &out, &out_off)) return NULL;
+    } else {
+        if (!PyArg_ParseTuple(args, "y*nn|On", &ab, &a_off, &n, &out, &out_off)) return NULL;
+    }
+
+    PyObject *out_arr = NULL;
+    real *odata;
+    if (!ensure_real_buf(&ab, "x") || !check_range(&ab, a_off, n, "x")) goto done;
+    if (backward && (!ensure_real_buf(&bb, "dy") || !check_range(&bb, b_off, n, "dy"))) goto done;
+
+    if (!open_output(out, out_off, n, 0, &ob, &out_arr, &odata, "out")) goto done;
+
+    Py_BEGIN_ALLOW_THREADS
+    activation_apply(op, (const real*)ab.buf + a_off, backward ? (const real*)bb.buf + b_off : NULL, odata, n);
+    Py_END_ALLOW_THREADS
+
+done:
+    PyBuffer_Release(&ab);
+    PyBuffer_Release(&bb);
+    PyBuffer_Release(&ob);
+    return out_arr;
+}
+
+PyObject* KERNEL(relu_forward)(PyObject *self, PyObject *args) { return activation_impl(args, ACT_RELU_FWD); }
+PyObject* KERNEL(relu_backward)(PyObject *self, PyObject *args) { return activation_impl(args, ACT_RELU_BWD); }
+PyObject* KERNEL(sigmoid_forward)(PyObject *self, PyObject *args) { return activation_impl(args, ACT_SIGMOID_FWD); }
+PyObject* KERNEL(sigmoid_backward)(PyObject *self, PyObject *args) { return activation_impl(args, ACT_SIGMOID_BWD); }
+
+// One row: z with stride sz -> y contiguous (D,); returns the row sum of exp(z - max)
+static real softmax_row(const real *z, Py_ssize_t sz, Py_ssize_t D, real *y) {
+    // numerical stability: subtract max
+    real m = -INFINITY;
+    for (Py_ssize_t j = 0; j < D; j++) {
+        if (z[j * sz] > m) m = z[j * sz];
+    }
+
+    real s = 0.0;
+    for (Py_ssize_t j = 0; j < D; j++) s += exp(z[j * sz] - m);
+
+    for (Py_ssize_t j = 0; j < D; j++) y[j] = exp(z[j * sz] - m) / s;
+    return s;
+}
+
+PyObject* KERNEL(softmax_forward)(PyObject *self, PyObject *args) {
+    Py_buffer zb = {0}, yb = {0};
+    Py_ssize_t z_off, N, D, z_st0, z_st1;
+    PyObject *out = Py_None;
+    Py_ssize_t out_off = 0;
+
+    // Parse: *z.args() of z (N, D)[, out, out_off], softmax over the last axis.
+    // Returns a new array, or out after writing (N, D) to out[out_off:].
+    if (!PyArg_ParseTuple(args, "y*nnnnn|On", &zb, &z_off, &N, &D, &z_st0, &z_st1, &out, &out_off)) return NULL;
+
+    PyObject *ret = NULL;
+    real *y;
+    if (!ensure_real_buf(&zb, "z")) goto done;
+    if (!open_output(out, out_off, N * D, 0, &yb, &ret, &y, "out")) goto done;
+
+    const real *z = (const real*)zb.buf + z_off;
+
+    Py_BEGIN_ALLOW_THREADS
+    CNN_OMP_FOR_IF(N > 1)
+    for (Py_ssize_t n = 0; n < N; n++) softmax_row(z + n * z_st0, z_st1, D, y + n * D);
+    Py_END_ALLOW_THREADS
+
+done:
+    PyBuffer_Release(&zb);
+    PyBuffer_Release(&yb);
+    return ret;
+}
+
+// Indices of the k largest values of every row, largest first; ties keep the lower index first.
+PyObject* KERNEL(topk)(PyObject *self, PyObject *args) {
+    Py_buffer zb = {0}, ob = {0};
+    Py_ssize_t z_off, N, D, z_st0, z_st1, k, out_off;
+    PyObject *out;
+
+    // Parse: *z.args() of z (N, D), k, out, out_off: int64 (N, k) is written to out[out_off:]
+    if (!PyArg_ParseTuple(args, "y*nnnnnnOn", &zb, &z_off, &N, &D, &z_st0, &z_st1, &k, &out, &out_off)) return NULL;
+
+    if (!ensure_real_buf(&zb, "z")) goto fail;
+    if (k < 1 || k > D) {
+        PyErr_SetString(PyExc_ValueError, "topk: k must be in [1, D]");
+        goto fail;
+    }
+    if (PyObject_GetBuffer(out, &ob, PyBUF_WRITABLE) != 0) goto fail;
+    if (ob.itemsize != (Py_ssize_t)sizeof(long long)) {
+        PyErr_SetString(PyExc_TypeError, "topk: out must be a buffer of int64 (array('q'))");
+        goto fail;
+    }
+    if (out_off < 0 || (out_off + N * k) * (Py_ssize_t)sizeof(long long) > ob.len) {
+        PyErr_SetString(PyExc_IndexError, "topk: out range out of bounds");
+        goto fail;
+    }
+
+    const real *z = (const real*)zb.buf + z_off;
+    long long *idx = (long long*)ob.buf + out_off;
+
+    Py_BEGIN_ALLOW_THREADS
+    CNN_OMP_FOR_IF(N > 64)
+    for (Py_ssize_t n = 0; n < N; n++) {
+        const real *row = z + n * z_st0;
+        long long *best = idx + n * k;
+        Py_ssize_t len = 0;
+
+        // insertion into the sorted best-k list; strict > keeps earlier indices ahead on ties
+        for (Py_ssize_t j = 0; j < D; j++) {
+            real v = row[j * z_st1];
+            if (len == k && !(v > row[best[k - 1] * z_st1])) continue;
+
+            Py_ssize_t pos = len < k ? len++ : k - 1;
+            while (pos > 0 && v > row[best[pos - 1] * z_st1]) {
+                best[pos] = best[pos - 1];
+                pos--;
+            }
+            best[pos] = j;
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&zb);
+    PyBuffer_Release(&ob);
+    Py_RETURN_NONE;
+
+fail:
+    PyBuffer_Release(&zb);
+    PyBuffer_Release(&ob);
+    return NULL;
+}
+
+// Softmax + cross entropy, forward and backward in one pass.
+// Returns (mean loss, dlogits) with dlogits = (softmax(pred) - onehot(labels)) / N, contiguous (N, K).
+PyObject* KERNEL(softmax_cross_entropy)(PyObject *self, PyObject *args) {
+    Py_buffer pb = {0};
+    Py_ssize_t p_off, N, K, p_st0, p_st1;
+    PyObject *labels_obj;
+    double eps;
+    PyObject *out = Py_None;
+    Py_ssize_t out_off = 0;
+
+    // Parse: *pred.args2() of pred (N, K), labels: sequence of N ints, eps[, out, out_off]
+    // out, out_off: write the gradient into out[out_off:] instead of a new array
+    if (!PyArg_ParseTuple(args, "y*nnnnnOd|On", &pb, &p_off, &N, &K, &p_st0, &p_st1, &labels_obj, &eps,
+                          &out, &out_off)) return NULL;
+
+    PyObject *ret = NULL, *labels_seq = NULL, *g_arr = NULL;
+    Py_buffer gb = {0};
+    real *g;
+    Py_ssize_t *labels = NULL;
+
+    if (!ensure_real_buf(&pb, "pred")) goto done;
+    if (N < 1) {
+        PyErr_SetString(PyExc_ValueError, "pred must have at least one row");
+        goto done;
+    }
+
+    labels_seq = PySequence_Fast(labels_obj, "labels must be a sequence of ints");
+    if (!labels_seq) goto done;
+    if (PySequence_Fast_GET_SIZE(labels_seq) != N) {
+        PyErr_SetString(PyExc_ValueError, "softmax_cross_entropy expects one label per row of pred");
+        goto done;
+    }
+
+    labels = (Py_ssize_t*)PyMem_Malloc((size_t)N * sizeof(Py_ssize_t));
+    if (!labels) { PyErr_NoMemory(); goto done; }
+    for (Py_ssize_t n = 0; n < N; n++) {
+        labels[n] = PyNumber_AsSsize_t(PySequence_Fast_GET_ITEM(labels_seq, n), PyExc_OverflowError);
+        if (labels[n] == -1 && PyErr_Occurred()) goto done;
+        if (labels[n] < 0 || labels[n] >= K) {
+            PyErr_Format(PyExc_ValueError, "label %zd out of range for %zd classes", labels[n], K);
+            goto done;
+        }
+    }
+
+    if (!open_output(out, out_off, N * K, 0, &gb, &g_arr, &g, "out")) goto done;
+
+    const real *pred = (const real*)pb.buf + p_off;
+    real total = 0.0;
+    real inv = 1.0 / (real)N;
+
+    Py_BEGIN_ALLOW_THREADS
+    // rows are summed in order so the loss does not depend on the thread count
+    for (Py_ssize_t n = 0; n < N; n++) {
+        real *row = g + n * K;
+        softmax_row(pred + n * p_st0, p_st1, K, row);
+
+        real p_y = row[labels[n]];
+        total += -log(eps > p_y ? eps : p_y); // max(p_y, eps)
+
+        row[labels[n]] -= 1.0;
+        for (Py_ssize_t j = 0; j < K; j++) row[j] *= inv;
+    }
+    Py_END_ALLOW_THREADS
+
+    ret = Py_BuildValue("(dO)", total / (real)N, g_arr);
+
+done:
+    PyBuffer_Release(&pb);
+    PyBuffer_Release(&gb);
+    Py_XDECREF(labels_seq);
+    Py_XDECREF(g_arr);
+    PyMem_Free(labels);
+    return ret;
+}
+
+// ---------------------------------------------------------------------------
+// Vector ops on flat real buffers
+// ---------------------------------------------------------------------------
+
+// axpby(alpha, x, x_off, beta, y, y_off, n): y[y_off:y_off+n] = alpha*x[x_off:x_off+n] + beta*y[...]
+// beta == 0 overwrites y without reading it.
+PyObject* KERNEL(axpby)(PyObject *self, PyObject *args) {
+    Py_buffer xb = {0}, yb = {0};
+    double alpha, beta;
+    Py_ssize_t x_off, y_off, n;
+
+    if (!PyArg_ParseTuple(args, "dy*ndw*nn", &alpha, &xb, &x_off, &beta, &yb, &y_off, &n)) return NULL;
+
+    PyObject *ret = NULL;
+    if (!ensure_real_buf(&xb, "x") || !ensure_real_buf(&yb, "y")) goto done;
+
+    if (n < 0 || x_off < 0 || y_off < 0 ||
+        (x_off + n) * (Py_ssize_t)sizeof(real) > xb.len ||
+        (y_off + n) * (Py_ssize_t)sizeof(real) > yb.len) {
+        PyErr_SetString(PyExc_IndexError, "axpby range out of bounds");
+        goto done;
+    }
+
+    const real *x = (const real*)xb.buf + x_off;
+    real *y = (real*)yb.buf + y_off;
+
+    Py_BEGIN_ALLOW_THREADS
+    if (beta == 0.0) {
+        for (Py_ssize_t i = 0; i < n; i++) y[i] = alpha * x[i];
+    } else {
+        for (Py_ssize_t i = 0; i < n; i++) y[i] = alpha * x[i] + beta * y[i];
+    }
+    Py_END_ALLOW_THREADS
+
+    ret = Py_None;
+    Py_INCREF(ret);
+
+done:
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&yb);
+    return ret;
+}
+
+// y[i] = scale * x[i] for n uint8 values x (pixels) -> reals
+PyObject* KERNEL(u8_to_real)(PyObject *self, PyObject *args) {
+    Py_buffer xb = {0}, yb = {0};
+    Py_ssize_t x_off, y_off, n;
+    double scale;
+
+    // Parse: x buf (uint8), off, y buf (reals), off, n, scale
+    if (!PyArg_ParseTuple(args, "y*nw*nnd", &xb, &x_off, &yb, &y_off, &n, &scale)) return NULL;
+
+    PyObject *ret = NULL;
+    if (xb.itemsize != 1) {
+        PyErr_SetString(PyExc_TypeError, "x: expected buffer of bytes (itemsize=1)");
+        goto done;
+    }
+    if (!ensure_real_buf(&yb, "y") || !check_range(&yb, y_off, n, "y")) goto done;
+    if (n < 0 || x_off < 0 || x_off + n > xb.len) {
+        PyErr_SetString(PyExc_IndexError, "x: range out of bounds");
+        goto done;
+    }
+
+    const unsigned char *x = (const unsigned char*)xb.buf + x_off;
+    real *y = (real*)yb.buf + y_off;
+
+    Py_BEGIN_ALLOW_THREADS
+    for (Py_ssize_t i = 0; i < n; i++) y[i] = scale * (real)x[i];
+    Py_END_ALLOW_THREADS
+
+    ret = Py_None;
+    Py_INCREF(ret);
+
+done:
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&yb);
+    return ret;
+}
+
+// Optimizer updates over n contiguous parameters w and their gradients g.
+// SGD: w -= lr * g, or with momentum: v = momentum * v + g; w -= lr * v
+PyObject* KERNEL(sgd_update)(PyObject *self, PyObject *args) {
+    Py_buffer wb = {0}, gb = {0}, vb = {0};
+    Py_ssize_t w_off, g_off, v_off = 0, n;
+    double lr, momentum = 0.0;
+    PyObject *v_obj = Py_None;
+
+    // Parse: w buf, off, g buf, off, n, lr[, v buf, off, momentum]
+    if (!PyArg_ParseTuple(args, "w*ny*nnd|Ond", &wb, &w_off, &gb, &g_off, &n, &lr, &v_obj, &v_off, &momentum)) {
+        return NULL;
+    }
+
+    PyObject *ret = NULL;
+    if (!ensure_real_buf(&wb, "w") || !check_range(&wb, w_off, n, "w")) goto done;
+    if (!ensure_real_buf(&gb, "g") || !check_range(&gb, g_off, n, "g")) goto done;
+    if (v_obj != Py_None && !get_out_buffer(v_obj, v_off, n, &vb, "v")) goto done;
+
+    real *w = (real*)wb.buf + w_off;
+    const real *g = (const real*)gb.buf + g_off;
+    real *v = vb.buf ? (real*)vb.buf + v_off : NULL;
+
+    Py_BEGIN_ALLOW_THREADS
+    if (v) {
+        CNN_OMP_FOR_IF(n > 4096)
+        for (Py_ssize_t i = 0; i < n; i++) {
+            v[i] = momentum * v[i] + g[i];
+            w[i] -= lr * v[i];
+        }
+    } else {
+        CNN_OMP_FOR_IF(n > 4096)
+        for (Py_ssize_t i = 0; i < n; i++) w[i] -= lr * g[i];
+    }
+    Py_END_ALLOW_THREADS
+
+    ret = Py_None;
+    Py_INCREF(ret);
+
+done:
+    PyBuffer_Release(&wb);
+    PyBuffer_Release(&gb);
+    PyBuffer_Release(&vb);
+    return ret;
+}
+
+// Adam, step t >= 1: m = b1 * m + (1 - b1) * g; v = b2 * v + (1 - b2) * g^2
+//                    w -= lr * (m / (1 - b1^t)) / (sqrt(v / (1 - b2^t)) + eps)
+PyObject* KERNEL(adam_update)(PyObject *self, PyObject *args) {
+    Py_buffer wb = {0}, gb = {0}, mb = {0}, vb = {0};
+    Py_ssize_t w_off, g_off, m_off, v_off, n, t;
+    double lr, beta1, beta2, eps;
+
+    // Parse: w buf, off, g buf, off, m buf, off, v buf, off, n, lr, beta1, beta2, eps, t
+    if (!PyArg_ParseTuple(args, "w*ny*nw*nw*nnddddn", &wb, &w_off, &gb, &g_off, &mb, &m_off, &vb, &v_off, &n,
+                          &lr, &beta1, &beta2, &eps, &t)) {
+        return NULL;
+    }
+
+    PyObject *ret = NULL;
+    if (!ensure_real_buf(&wb, "w") || !check_range(&wb, w_off, n, "w")) goto done;
+    if (!ensure_real_buf(&gb, "g") || !check_range(&gb, g_off, n, "g")) goto done;
+    if (!ensure_real_buf(&mb, "m") || !check_range(&mb, m_off, n, "m")) goto done;
+    if (!ensure_real_buf(&vb, "v") || !check_range(&vb, v_off, n, "v")) goto done;
+    if (t < 1) {
+        PyErr_SetString(PyExc_ValueError, "adam step t must be >= 1");
+        goto done;
+    }
+
+    real *w = (real*)wb.buf + w_off;
+    const real *g = (const real*)gb.buf + g_off;
+    real *m = (real*)mb.buf + m_off;
+    real *v = (real*)vb.buf + v_off;
+
+    real c1 = 1.0 - pow(beta1, (real)t);
+    real c2 = 1.0 - pow(beta2, (real)t);
+
+    Py_BEGIN_ALLOW_THREADS
+    CNN_OMP_FOR_IF(n > 4096)
+    for (Py_ssize_t i = 0; i < n; i++) {
+        m[i] = beta1 * m[i] + (1.0 - beta1) * g[i];
+        v[i] = beta2 * v[i] + (1.0 - beta2) * g[i] * g[i];
+        w[i] -= lr * (m[i] / c1) / (sqrt(v[i] / c2) + eps);
+    }
+    Py_END_ALLOW_THREADS
+
+    ret = Py_None;
+    Py_INCREF(ret);
+
+done:
+    PyBuffer_Release(&wb);
+    PyBuffer_Release(&gb);
+    PyBuffer_Release(&mb);
+    PyBuffer_Release(&vb);
+    return ret;
+}
+
+// ---------------------------------------------------------------------------
+// Fused Convolve + ReLU + Pooling
+//
+// One call runs a conv layer, an optional ReLU and an optional pooling layer
+// and writes the result into a caller-owned buffer. With the direct algo each
+// (sample, channel) conv plane is pooled while it is still in cache, so the
+// full conv output is never materialised. Results are identical to running
+// the three layers one after another. Backward (max pooling) routes dy through
+// the argmax and the ReLU mask straight into the conv gradient engines.
+// ---------------------------------------------------------------------------
+
+enum { POOL_NONE = 0, POOL_MAX = 1, POOL_AVG = 2 };
+
+static int parse_pool_mode(const char *name, int *mode) {
+    if (strcmp(name, "none") == 0) { *mode = POOL_NONE; return 1; }
+    if (strcmp(name, "max") == 0) { *mode = POOL_MAX; return 1; }
+    if (strcmp(name, "avg") == 0) { *mode = POOL_AVG; return 1; }
+    PyErr_Format(PyExc_ValueError, "unknown pool mode '%s'", name);
+    return 0;
+}
+
+// One channel: conv output c: contiguous (Hc, Wc) -> y: contiguous (Hp, Wp).
+// am (max pooling only) receives the window index like pool_forward_max, or is NULL.
+static void relu_pool_plane(const real *c, Py_ssize_t Hc, Py_ssize_t Wc, int relu, int pool,
+                            Py_ssize_t ph, Py_ssize_t pw, Py_ssize_t s, Py_ssize_t Hp, Py_ssize_t Wp,
+                            real *y, real *am) {
+    if (pool == POOL_NONE) {
+        for (Py_ssize_t i = 0; i < Hc * Wc; i++) {
+            real v = c[i];
+            y[i] = (relu && !(v > 0.0)) ? 0.0 : v;
+        }
+        return;
+    }
+
+    real inv = 1.0 / (real)(ph * pw);
+
+    for (Py_ssize_t oy = 0; oy < Hp; oy++) {
+        for (Py_ssize_t ox = 0; ox < Wp; ox++) {
+            const real *win = c + oy * s * Wc + ox * s;
+
+            if (pool == POOL_MAX) {
+                real best_val = -1000000.0; // -inf, as pool_max_forward_sample
+                Py_ssize_t best_k = 0;
+                Py_ssize_t k = 0;
+
+                for (Py_ssize_t ky = 0; ky < ph; ky++) {
+                    for (Py_ssize_t kx = 0; kx < pw; kx++) {
+                        real v = win[ky * Wc + kx];
+                        if (relu && !(v > 0.0)) v = 0.0;
+                        if (v > best_val) {
+                            best_val = v;
+                            best_k = k;
+                        }
+                        k++;
+                    }
+                }
+
+                y[oy * Wp + ox] = best_val;
+                if (am) am[oy * Wp + ox] = (real)best_k;
+            } else {
+                real acc = 0.0;
+                for (Py_ssize_t ky = 0; ky < ph; ky++) {
+                    for (Py_ssize_t kx = 0; kx < pw; kx++) {
+                        real v = win[ky * Wc + kx];
+                        acc += (relu && !(v > 0.0)) ? 0.0 : v;
+                    }
+                }
+                y[oy * Wp + ox] = acc * inv;
+            }
+        }
+    }
+}
+
+// x: (N, Cin, H, W) with sample stride x_stn -> y, am: contiguous (N, Cout, Hp, Wp).
+// Returns 0 on allocation failure.
+static int conv_relu_pool(view_t x, Py_ssize_t x_stn, view_t w, view_t b, int algo, int relu, int pool,
+                          Py_ssize_t N, Py_ssize_t Cin, Py_ssize_t Cout, Py_ssize_t Kh, Py_ssize_t Kw,
+                          Py_ssize_t H, Py_ssize_t Ww, Py_ssize_t Hc, Py_ssize_t Wc,
+                          Py_ssize_t ph, Py_ssize_t pw, Py_ssize_t s, Py_ssize_t Hp, Py_ssize_t Wp,
+                          real *ydata, real *amdata) {
+    Py_ssize_t P = Hc * Wc;
+    Py_ssize_t Q = Hp * Wp;
+    int nt = cnn_threads;
+
+    if (algo == CONV_DIRECT) {
+        // one conv plane of scratch per thread
+        real *planes = (real*)cnn_scratch(CNN_SCRATCH_OUTER, (size_t)(nt * P) * sizeof(real));
+        if (!planes) return 0;
+
+        CNN_PRAGMA(omp parallel for num_threads(nt) if(nt > 1))
+        for (Py_ssize_t t = 0; t < N * Cout; t++) {
+            Py_ssize_t n = t / Cout, oc = t % Cout;
+            real *c = planes + CNN_THREAD_ID() * P;
+
+            view_t xn = x;
+            xn.off = x.off + n * x_stn;
+            conv_forward_plane(xn, w, b, oc, Cin, Kh, Kw, Hc, Wc, c);
+            relu_pool_plane(c, Hc, Wc, relu, pool, ph, pw, s, Hp, Wp, ydata + t * Q, amdata ? amdata + t * Q : NULL);
+        }
+
+        return 1;
+    }
+
+    // the GEMM / transform-domain engines produce the whole batch at once
+    real *conv = (real*)cnn_scratch(CNN_SCRATCH_OUTER, (size_t)(N * Cout * P) * sizeof(real));
+    if (!conv) return 0;
+
+    int ok;
+    if (algo == CONV_WINOGRAD) {
+        ok = conv_forward_winograd(x, x_stn, w, b, N, Cin, Cout, Kh, Kw, H, Ww, Hc, Wc, conv);
+    } else if (algo == CONV_FFT) {
+        ok = conv_forward_fft(x, x_stn, w, b, N, Cin, Cout, Kh, Kw, H, Ww, Hc, Wc, conv);
+    } else {
+        ok = conv_forward_im2col(x, x_stn, w, b, N, Cin, Cout, Kh, Kw, Hc, Wc, conv);
+    }
+
+    if (ok) {
+        CNN_OMP_FOR
+        for (Py_ssize_t t = 0; t < N * Cout; t++) {
+            relu_pool_plane(conv + t * P, Hc, Wc, relu, pool, ph, pw, s, Hp, Wp,
+                            ydata + t * Q, amdata ? amdata + t * Q : NULL);
+        }
+    }
+
+    return ok;
+}
+
+PyObject* KERNEL(conv_relu_pool_forward)(PyObject *self, PyObject *args) {
+    Py_buffer xb = {0}, Wb = {0}, bb = {0}, yb = {0}, amb = {0};
+
+    Py_ssize_t x_off, x_s0, x_s1, x_s2, x_s3, x_st0, x_st1, x_st2, x_st3;
+    Py_ssize_t W_off, W_s0, W_s1, W_s2, W_s3, W_st0, W_st1, W_st2, W_st3;
+    Py_ssize_t b_off, b_s0, b_st0;
+    Py_ssize_t cout_arg, kh_arg, kw_arg;
+    const char *algo_name, *pool_name;
+    int algo, relu, pool;
+    Py_ssize_t ph, pw, s;
+    PyObject *out, *am_obj = Py_None;
+    Py_ssize_t out_off, am_off = 0;
+
+    // Parse: *x.args4(), *W.args4(), *b.args1(), cout, kh, kw, algo, relu, pool, ph, pw, s, out, out_off[, argmax, am_off]
+    if (!PyArg_ParseTuple(
+            args,
+            "y*nnnnnnnnn" // x: (N, Cin, H, W)
+            "y*nnnnnnnnn" // W
+            "y*nnn"       // b
+            "nnn"         // cout, kh, kw
+            "s"           // algo: "direct", "im2col", "winograd" or "fft"
+            "p"           // relu
+            "snnn"        // pool: "none", "max" or "avg"; ph, pw, stride (ignored for "none")
+            "On"          // out, out_off: (N, Cout, Hp, Wp) is written to out[out_off:]
+            "|On",        // argmax, am_off: max pooling window indices for backward, or None
+            &xb, &x_off, &x_s0, &x_s1, &x_s2, &x_s3, &x_st0, &x_st1, &x_st2, &x_st3,
+            &Wb, &W_off, &W_s0, &W_s1, &W_s2, &W_s3, &W_st0, &W_st1, &W_st2, &W_st3,
+            &bb, &b_off, &b_s0, &b_st0,
+            &cout_arg, &kh_arg, &kw_arg,
+            &algo_name,
+            &relu,
+            &pool_name, &ph, &pw, &s,
+            &out, &out_off,
+            &am_obj, &am_off
+        )) {
+        return NULL;
+    }
+
+    if (!parse_conv_algo(algo_name, &algo) || !parse_pool_mode(pool_name, &pool)) goto fail;
+    if (!ensure_real_buf(&xb, "x") || !ensure_real_buf(&Wb, "W") || !ensure_real_buf(&bb, "b")) goto fail;
+    if (!check_conv_shapes(x_s1, x_s2, x_s3, W_s0, W_s1, W_s2, W_s3, b_s0, cout_arg, kh_arg, kw_arg)) goto fail;
+
+    Py_ssize_t N = x_s0;
+    Py_ssize_t Hc = x_s2 - W_s2 + 1;
+    Py_ssize_t Wc = x_s3 - W_s3 + 1;
+    Py_ssize_t Hp = Hc, Wp = Wc;
+
+    if (pool != POOL_NONE && !pool_out_shape(Hc, Wc, ph, pw, s, &Hp, &Wp)) goto fail;
+    algo = winograd_or_im2col(algo, W_s2, W_s3);
+    if (algo == CONV_WINOGRAD && !winograd_supported(W_s2, W_s3, Hc, Wc)) goto fail;
+    if (am_obj != Py_None && pool != POOL_MAX) {
+        PyErr_SetString(PyExc_ValueError, "argmax is only produced for max pooling");
+        goto fail;
+    }
+
+    Py_ssize_t y_total = N * W_s0 * Hp * Wp;
+    if (!get_out_buffer(out, out_off, y_total, &yb, "out")) goto fail;
+    if (am_obj != Py_None && !get_out_buffer(am_obj, am_off, y_total, &amb, "argmax")) goto fail;
+
+    real *ydata = (real*)yb.buf + out_off;
+    real *amdata = amb.buf ? (real*)amb.buf + am_off : NULL;
+    int ok;
+
+    Py_BEGIN_ALLOW_THREADS
+    ok = conv_relu_pool(make_view(&xb, x_off, x_st1, x_st2, x_st3, 0), x_st0,
+                        make_view(&Wb, W_off, W_st0, W_st1, W_st2, W_st3),
+                        make_view(&bb, b_off, b_st0, 0, 0, 0),
+                        algo, relu, pool, N, x_s1, W_s0, W_s2, W_s3, x_s2, x_s3, Hc, Wc, ph, pw, s, Hp, Wp,
+                        ydata, amdata);
+    Py_END_ALLOW_THREADS
+
+    if (!ok) {
+        PyErr_NoMemory();
+        goto fail;
+    }
+
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&Wb);
+    PyBuffer_Release(&bb);
+    PyBuffer_Release(&yb);
+    PyBuffer_Release(&amb);
+    Py_RETURN_NONE;
+
+fail:
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&Wb);
+    PyBuffer_Release(&bb);
+    PyBuffer_Release(&yb);
+    PyBuffer_Release(&amb);
+    return NULL;
+}
+
+// dy, y, am: (N, Cout, Hp, Wp) -> dc: contiguous (N, Cout, Hc, Wc), zeroed by the caller.
+// Each pooled gradient goes to its argmax window position. With relu it only passes where
+// the pooled output is > 0, which is exactly where the conv value under the argmax was > 0.
+static void relu_pool_max_backward(view_t dy, view_t y, view_t am, int relu,
+                                   Py_ssize_t N, Py_ssize_t Cout, Py_ssize_t Hc, Py_ssize_t Wc,
+                                   Py_ssize_t pw, Py_ssize_t s, Py_ssize_t Hp, Py_ssize_t Wp, real *dc) {
+    CNN_OMP_FOR
+    for (Py_ssize_t t = 0; t < N * Cout; t++) {
+        Py_ssize_t n = t / Cout, oc = t % Cout;
+        real *plane = dc + t * Hc * Wc;
+
+        for (Py_ssize_t oy = 0; oy < Hp; oy++) {
+            for (Py_ssize_t ox = 0; ox < Wp; ox++) {
+                if (relu) {
+                    real v = y.data[y.off + n * y.st[0] + oc * y.st[1] + oy * y.st[2] + ox * y.st[3]];
+                    if (!(v > 0.0)) continue;
+                }
+
+                Py_ssize_t a = am.off + n * am.st[0] + oc * am.st[1] + oy * am.st[2] + ox * am.st[3];
+                Py_ssize_t k = (Py_ssize_t)am.data[a];
+                Py_ssize_t ky = k / pw, kx = k % pw;
+
+                plane[(oy * s + ky) * Wc + ox * s + kx] +=
+                    dy.data[dy.off + n * dy.st[0] + oc * dy.st[1] + oy * dy.st[2] + ox * dy.st[3]];
+            }
+        }
+    }
+}
+
+PyObject* KERNEL(conv_relu_pool_backward)(PyObject *self, PyObject *args) {
+    Py_buffer xb = {0}, dyb = {0}, yb = {0}, amb = {0}, Wb = {0}, dWb = {0}, dbb = {0};
+
+    Py_ssize_t x_off, x_s0, x_s1, x_s2, x_s3, x_st0, x_st1, x_st2, x_st3;
+    Py_ssize_t dy_off, dy_s0, dy_s1, dy_s2, dy_s3, dy_st0, dy_st1, dy_st2, dy_st3;
+    Py_ssize_t y_off, y_s0, y_s1, y_s2, y_s3, y_st0, y_st1, y_st2, y_st3;
+    Py_ssize_t am_off, am_s0, am_s1, am_s2, am_s3, am_st0, am_st1, am_st2, am_st3;
+    Py_ssize_t W_off, W_s0, W_s1, W_s2, W_s3, W_st0, W_st1, W_st2, W_st3;
+    Py_ssize_t dW_off, dW_s0, dW_s1, dW_s2, dW_s3, dW_st0, dW_st1, dW_st2, dW_st3;
+    Py_ssize_t db_off, db_s0, db_st0;
+    Py_ssize_t cout_arg, kh_arg, kw_arg;
+    const char *algo_name;
+    int algo, relu;
+    Py_ssize_t ph, pw, s;
+    PyObject *out = Py_None;
+    Py_ssize_t out_off = 0;
+
+    // Parse: *x.args4(), *dy.args4(), *y.args4(), *argmax.args4(), *W.args4(), *dW.args4(), *db.args1(),
+    //        cout, kh, kw, algo, relu, ph, pw, s[, out, out_off]
+    if (!PyArg_ParseTuple(
+            args,
+            "y*nnnnnnnnn"  // x: (N, Cin, H, W) cached by forward
+            "y*nnnnnnnnn"  // dy: (N, Cout, Hp, Wp)
+            "y*nnnnnnnnn"  // y: pooled forward output (N, Cout, Hp, Wp)
+            "y*nnnnnnnnn"  // argmax: (N, Cout, Hp, Wp) from conv_relu_pool_forward
+            "y*nnnnnnnnn"  // W
+            "y*nnnnnnnnn"  // dW
+            "y*nnn"        // db
+            "nnn"          // cout, kh, kw
+            "s"            // algo: "direct", "im2col", "winograd" or "fft"
+            "p"            // relu
+            "nnn"          // max pooling ph, pw, stride
+            "|On",         // out, out_off: write dx into out[out_off:] instead of a new array
+            &xb, &x_off, &x_s0, &x_s1, &x_s2, &x_s3, &x_st0, &x_st1, &x_st2, &x_st3,
+            &dyb, &dy_off, &dy_s0, &dy_s1, &dy_s2, &dy_s3, &dy_st0, &dy_st1, &dy_st2, &dy_st3,
+            &yb, &y_off, &y_s0, &y_s1, &y_s2, &y_s3, &y_st0, &y_st1, &y_st2, &y_st3,
+            &amb, &am_off, &am_s0, &am_s1, &am_s2, &am_s3, &am_st0, &am_st1, &am_st2, &am_st3,
+            &Wb, &W_off, &W_s0, &W_s1, &W_s2, &W_s3, &W_st0, &W_st1, &W_st2, &W_st3,
+            &dWb, &dW_off, &dW_s0, &dW_s1, &dW_s2, &dW_s3, &dW_st0, &dW_st1, &dW_st2, &dW_st3,
+            &dbb, &db_off, &db_s0, &db_st0,
+            &cout_arg, &kh_arg, &kw_arg,
+            &algo_name,
+            &relu,
+            &ph, &pw, &s,
+            &out, &out_off
+        )) {
+        return NULL;
+    }
+
+    if (!parse_conv_algo(algo_name, &algo)) goto fail;
+
+    if (!ensure_real_buf(&xb, "x") ||
+        !ensure_real_buf(&dyb, "dy") ||
+        !ensure_real_buf(&yb, "y") ||
+        !ensure_real_buf(&amb, "argmax") ||
+        !ensure_real_buf(&Wb, "W") ||
+        !ensure_real_buf(&dWb, "dW") ||
+        !ensure_real_buf(&dbb, "db")) {
+        goto fail;
+    }
+
+    if (dWb.readonly) { PyErr_SetString(PyExc_TypeError, "dW buffer must be writable"); goto fail; }
+    if (dbb.readonly) { PyErr_SetString(PyExc_TypeError, "db buffer must be writable"); goto fail; }
+
+    Py_ssize_t N = x_s0;
+    Py_ssize_t Hc = x_s2 - W_s2 + 1;
+    Py_ssize_t Wc = x_s3 - W_s3 + 1;
+    Py_ssize_t Hp, Wp;
+
+    if (!check_conv_backward_shapes(x_s1, x_s2, x_s3, dy_s1, Hc, Wc, W_s0, W_s1, W_s2, W_s3,
+                                    db_s0, cout_arg, kh_arg, kw_arg)) goto fail;
+    if (!pool_out_shape(Hc, Wc, ph, pw, s, &Hp, &Wp)) goto fail;
+
+    if (dy_s0 != N || dy_s2 != Hp || dy_s3 != Wp ||
+        y_s0 != N || y_s1 != dy_s1 || y_s2 != Hp || y_s3 != Wp ||
+        am_s0 != N || am_s1 != dy_s1 || am_s2 != Hp || am_s3 != Wp) {
+        PyErr_SetString(PyExc_ValueError, "dy, y and argmax must all be (N, Cout, Hp, Wp) of the pooled output");
+        goto fail;
+    }
+
+    Py_ssize_t dx_n = x_s1 * x_s2 * x_s3;
+    Py_ssize_t dc_n = dy_s1 * Hc * Wc;
+
+    PyObject *dx_arr;
+    Py_buffer dxb = {0};
+    real *dxdata;
+    if (!open_output(out, out_off, N * dx_n, 1, &dxb, &dx_arr, &dxdata, "out")) goto fail;
+
+    view_t w = make_view(&Wb, W_off, W_st0, W_st1, W_st2, W_st3);
+    view_t dw = make_view(&dWb, dW_off, dW_st0, dW_st1, dW_st2, dW_st3);
+    view_t db = make_view(&dbb, db_off, db_st0, 0, 0, 0);
+    view_t x = make_view(&xb, x_off, x_st1, x_st2, x_st3, 0);
+    int ok = 1;
+
+    Py_BEGIN_ALLOW_THREADS
+    // gradient w.r.t. the conv output, never seen by Python
+    real *dc = (real*)cnn_scratch(CNN_SCRATCH_OUTER, (size_t)(N * dc_n) * sizeof(real));
+    if (!dc) {
+        ok = 0;
+    } else {
+        memset(dc, 0, (size_t)(N * dc_n) * sizeof(real));
+        relu_pool_max_backward(make_view(&dyb, dy_off, dy_st0, dy_st1, dy_st2, dy_st3),
+                               make_view(&yb, y_off, y_st0, y_st1, y_st2, y_st3),
+                               make_view(&amb, am_off, am_st0, am_st1, am_st2, am_st3),
+                               relu, N, dy_s1, Hc, Wc, pw, s, Hp, Wp, dc);
+
+        view_t dcv = { dc, 0, { Hc * Wc, Wc, 1, 0 } };
+
+        // same engines and order as convolve_backward_batch
+        if (algo != CONV_DIRECT) {
+            ok = conv_backward_im2col(x, x_st0, dcv, dc_n, w, dw, db, N, x_s1, dy_s1, W_s2, W_s3,
+                                      x_s2, x_s3, Hc, Wc, dxdata);
+        } else {
+            for (Py_ssize_t n = 0; n < N; n++) {
+                view_t xn = x;
+                xn.off = x.off + n * x_st0;
+                view_t dcn = dcv;
+                dcn.off = n * dc_n;
+                conv_backward_sample(xn, dcn, w, dw, db, x_s1, dy_s1, W_s2, W_s3, x_s2, x_s3, Hc, Wc,
+                                     dxdata + n * dx_n);
+            }
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    if (!ok) {
+        PyErr_NoMemory();
+        PyBuffer_Release(&dxb);
+        Py_DECREF(dx_arr);
+        goto fail;
+    }
+
+    PyBuffer_Release(&dxb);
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&dyb);
+    PyBuffer_Release(&yb);
+    PyBuffer_Release(&amb);
+    PyBuffer_Release(&Wb);
+    PyBuffer_Release(&dWb);
+    PyBuffer_Release(&dbb);
+
+    return dx_arr;
+
+fail:
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&dyb);
+    PyBuffer_Release(&yb);
+    PyBuffer_Release(&amb);
+    PyBuffer_Release(&Wb);
+    PyBuffer_Release(&dWb);
+    PyBuffer_Release(&dbb);
+    return NULL;
+}
+
+// ---------------------------------------------------------------------------
+// Augmentation
+//
+// Random shift, rotation, scale, elastic distortion and stroke thickness of
+// single-channel (H, W) images. Every random number of a sample comes from a
+// splitmix64 stream seeded by (seed, the sample's id) alone, so a sample gets
+// the same transform whatever batch, thread or worker it is processed in.
+// ---------------------------------------------------------------------------
+
+#define AUG_GRID 4  // elastic displacement control points per side
+
+static uint64_t aug_next(uint64_t *s) {
+    uint64_t z = (*s += 0x9E3779B97F4A7C15ULL);
+    z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9ULL;
+    z = (z ^ (z >> 27)) * 0x94D049BB133111EBULL;
+    return z ^ (z >> 31);
+}
+
+// uniform in [-1, 1)
+static double aug_sym(uint64_t *s) {
+    return (double)(aug_next(s) >> 11) * (2.0 / 9007199254740992.0) - 1.0;
+}
+
+// src at (sx, sy), bilinear, 0 outside the image
+static real aug_sample(const real *src, Py_ssize_t H, Py_ssize_t W, double sx, double sy) {
+    double fx = floor(sx), fy = floor(sy);
+    Py_ssize_t x0 = (Py_ssize_t)fx, y0 = (Py_ssize_t)fy;
+    double ax = sx - fx, ay = sy - fy;
+    double v = 0.0;
+
+    for (int j = 0; j < 2; j++) {
+        Py_ssize_t r = y0 + j;
+        if (r < 0 || r >= H) continue;
+        double wy = j ? ay : 1.0 - ay;
+        for (int i = 0; i < 2; i++) {
+            Py_ssize_t c = x0 + i;
+            if (c < 0 || c >= W) continue;
+            v += wy * (i ? ax : 1.0 - ax) * (double)src[r * W + c];
+        }
+    }
+    return (real)v;
+}
+
+// One image x -> y. p: max shift (pixels), max rotation (radians), max scale change (fraction),
+// max elastic displacement (pixels), max thickness blend. src, tmp: H*W scratch each.
+static void augment_image(const real *x, real *y, Py_ssize_t H, Py_ssize_t W, uint64_t s, const double *p,
+                          real *src, real *tmp) {
+    // always drawn in the same order, so a parameter set to 0 leaves the others' draws unchanged
+    double dx = p[0] * aug_sym(&s), dy = p[0] * aug_sym(&s);
+    double angle = p[1] * aug_sym(&s);
+    double inv_scale = 1.0 / (1.0 + p[2] * aug_sym(&s));
+    double thick = p[4] * aug_sym(&s);
+    double ex[AUG_GRID * AUG_GRID], ey[AUG_GRID * AUG_GRID];
+    for (int g = 0; g < AUG_GRID * AUG_GRID; g++) {
+        ex[g] = p[3] * aug_sym(&s);
+        ey[g] = p[3] * aug_sym(&s);
+    }
+
+    memcpy(src, x, (size_t)(H * W) * sizeof(real));  // y may be x
+
+    // stroke thickness: blend towards the 3x3 max (thicker bright strokes) or min (thinner)
+    if (thick != 0.0) {
+        double a = fabs(thick);
+        for (Py_ssize_t r = 0; r < H; r++) {
+            for (Py_ssize_t c = 0; c < W; c++) {
+                real m = src[r * W + c];
+                for (Py_ssize_t rr = r - 1; rr <= r + 1; rr++) {
+                    if (rr < 0 || rr >= H) continue;
+                    for (Py_ssize_t cc = c - 1; cc <= c + 1; cc++) {
+                        if (cc < 0 || cc >= W) continue;
+                        real v = src[rr * W + cc];
+                        if (thick > 0.0 ? v > m : v < m) m = v;
+                    }
+                }
+                tmp[r * W + c] = (real)(src[r * W + c] + a * (m - src[r * W + c]));
+            }
+        }
+        real *t = src;
+        src = tmp;
+        tmp = t;
+    }
+
+    // inverse map of every output pixel: undo the shift and elastic displacement, then the
+    // rotation and scale about the image center
+    double cx = 0.5 * (double)(W - 1), cy = 0.5 * (double)(H - 1);
+    double cs = cos(angle) * inv_scale, sn = sin(angle) * inv_scale;
+    double gsx = W > 1 ? (double)(AUG_GRID - 1) / (double)(W - 1) : 0.0;
+    double gsy = H > 1 ? (double)(AUG_GRID - 1) / (double)(H - 1) : 0.0;
+
+    for (Py_ssize_t r = 0; r < H; r++) {
+        double gy = r * gsy;
+        int gy0 = (int)gy < AUG_GRID - 1 ? (int)gy : AUG_GRID - 2;
+        double ay = gy - gy0;
+        for (Py_ssize_t c = 0; c < W; c++) {
+            double gx = c * gsx;
+            int gx0 = (int)gx < AUG_GRID - 1 ? (int)gx : AUG_GRID - 2;
+            double ax = gx - gx0;
+            int g = gy0 * AUG_GRID + gx0;
+            double w00 = (1.0 - ay) * (1.0 - ax), w01 = (1.0 - ay) * ax, w10 = ay * (1.0 - ax), w11 = ay * ax;
+            double ox = c - cx - dx + w00 * ex[g] + w01 * ex[g + 1] + w10 * ex[g + AUG_GRID] + w11 * ex[g + AUG_GRID + 1];
+            double oy = r - cy - dy + w00 * ey[g] + w01 * ey[g + 1] + w10 * ey[g + AUG_GRID] + w11 * ey[g + AUG_GRID + 1];
+
+            y[r * W + c] = aug_sample(src, H, W, cs * ox + sn * oy + cx, -sn * ox + cs * oy + cy);
+        }
+    }
+}
+
+// n images x (n, H, W) -> y (n, H, W), y may be x. Image i is transformed by the stream of
+// (seed, ids[i]); ids is int64, usually the samples' dataset indices.
+// Bright strokes on a dark background are assumed: pixels moved in from outside are 0.
+PyObject* KERNEL(augment)(PyObject *self, PyObject *args) {
+    Py_buffer xb = {0}, yb = {0}, ib = {0};
+    Py_ssize_t x_off, y_off, n, H, W;
+    unsigned long long seed;
+    double p[5];
+
+    // Parse: x buf, off, y buf, off, n, H, W, seed, ids buf (int64),
+    //        shift, rotate (radians), scale, elastic, thickness
+    if (!PyArg_ParseTuple(args, "y*nw*nnnnKy*ddddd", &xb, &x_off, &yb, &y_off, &n, &H, &W, &seed, &ib,
+                          &p[0], &p[1], &p[2], &p[3], &p[4])) return NULL;
+
+    PyObject *ret = NULL;
+    if (!ensure_real_buf(&xb, "x") || !ensure_real_buf(&yb, "y")) goto done;
+    if (H < 1 || W < 1 || !check_range(&xb, x_off, n * H * W, "x") || !check_range(&yb, y_off, n * H * W, "y")) {
+        if (!PyErr_Occurred()) PyErr_SetString(PyExc_ValueError, "augment: H and W must be >= 1");
+        goto done;
+    }
+    if (ib.itemsize != 8 || ib.len < n * 8) {
+        PyErr_SetString(PyExc_ValueError, "ids: expected n int64 values");
+        goto done;
+    }
+
+    int nt = cnn_threads;
+    real *scratch = (real*)cnn_scratch(CNN_SCRATCH_OUTER, (size_t)(nt * 2 * H * W) * sizeof(real));
+    if (!scratch) {
+        PyErr_NoMemory();
+        goto done;
+    }
+
+    const real *x = (const real*)xb.buf + x_off;
+    real *y = (real*)yb.buf + y_off;
+    const long long *ids = (const long long*)ib.buf;
+
+    Py_BEGIN_ALLOW_THREADS
+    CNN_PRAGMA(omp parallel for num_threads(nt) if(nt > 1 && n > 1))
+    for (Py_ssize_t i = 0; i < n; i++) {
+        real *src = scratch + CNN_THREAD_ID() * 2 * H * W;
+        uint64_t s = (uint64_t)seed;
+        s = aug_next(&s) ^ (uint64_t)ids[i];
+        augment_image(x + i * H * W, y + i * H * W, H, W, aug_next(&s), p, src, src + H * W);
+    }
+    Py_END_ALLOW_THREADS
+
+    ret = Py_None;
+    Py_INCREF(ret);
+
+done:
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&yb);
+    PyBuffer_Release(&ib);
+    return ret;
+}
@@ -1,8 +1,22 @@
+import sys
+
 from setuptools import setup, Extension
 
+# OpenMP for the threaded kernels (see set_num_threads). Apple clang ships without it,
+# there the extension builds single-threaded; the kernels still release the GIL.
+if sys.platform == "win32":
+    openmp_compile, openmp_link = ["/openmp"], []
+elif sys.platform == "darwin":
+    openmp_compile, openmp_link = [], []
+else:
+    openmp_compile, openmp_link = ["-fopenmp"], ["-fopenmp"]
+
 ext = Extension(
     name="cnn",                 # import name: import cnn
-    sources=["cnn.c"],          # adjust path if needed
+    sources=["cnn.c", "cnn_f64.c", "cnn_f32.c", "cnn_int8.c"],  # adjust path if needed
+    depends=["cnn.h", "cnn_kernels.h"],
+    extra_compile_args=openmp_compile,
+    extra_link_args=openmp_link,
 )
 
 setup(
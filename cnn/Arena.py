@@ -0,0 +1,65 @@
+from array import array
+
+from cnn.Tensor import Tensor
+
+
+class Arena:
+    """
+    Output buffers of the C-backed layers, kept between calls.
+
+    Every layer output (forward y, backward dx, pooling argmax, loss gradient) is written by
+    its kernel into a buffer owned by the arena instead of a freshly allocated array, keyed
+    by (layer, role). A buffer is reused while its dtype matches and it is big enough, and
+    the Tensor over it is reused while the shape matches, so steady-state training and
+    inference allocate no arrays at all.
+
+    The catch: a layer's output is overwritten by its next call, so a Tensor returned by
+    forward() / backward() is only valid until then. Copy it (t.astype(...) on another
+    dtype, array(t.data)) to keep it.
+
+        model = CNN(layers, loss, arena=Arena())  # or model.arena = Arena()
+        model.train_epoch(x_train, y_train, batch_size=32)
+    """
+
+    def __init__(self):
+        self._bufs = {}  # key -> array, grown on demand
+        self._tensors = {}  # key -> Tensor over the key's buffer, with the last shape asked for
+
+    def tensor(self, key, shape, dtype):
+        """the Tensor of shape / dtype for key, backed by a reused buffer; its contents are stale"""
+        t = self._tensors.get(key)
+        if t is not None and t.shape == shape and t.dtype == dtype:
+            return t
+
+        n = 1
+        for s in shape:
+            n *= s
+
+        buf = self._bufs.get(key)
+        if buf is None or buf.typecode != dtype or len(buf) < n:
+            buf = self._bufs[key] = array(dtype, [0.0]) * n
+
+        t = self._tensors[key] = Tensor(buf, shape)
+        return t
+
+    @staticmethod
+    def out(arena, owner, role, shape, dtype):
+        """arena.tensor((owner, role), ...), or None without an arena"""
+        return None if arena is None else arena.tensor((owner, role), tuple(shape), dtype)
+
+    @staticmethod
+    def args(out):
+        """the trailing out, out_off kernel arguments for an Arena.out() result"""
+        return () if out is None else (out.data, out.offset)
+
+    def clear(self):
+        self._bufs.clear()
+        self._tensors.clear()
+
+    @property
+    def nbytes(self):
+        return sum(len(b) * b.itemsize for b in self._bufs.values())
+
+    def __getstate__(self):
+        # buffers are scratch, a copied model starts with an empty arena
+        return {"_bufs": {}, "_tensors": {}}
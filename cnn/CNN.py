@@ -1,36 +1,172 @@
-import time
+import ast
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
 from random import seed, shuffle
 
 from cnn.Dense import Dense
-from cnn.Tensor import Tensor
+from cnn.Tensor import DTYPES, Tensor, View
+
+# .mwb: binary model file
+#   MWB_HEAD (magic, version, header length), a UTF-8 JSON header with the layer specs and
+#   the shape/dtype/offset of every parameter, then the raw little-endian parameter blobs.
+#   Blob offsets are relative to the data section; the data section and every blob start
+#   on a MWB_ALIGN boundary.
+MWB_MAGIC = b"AKSHRMWB"
+MWB_VERSION = 1
+MWB_HEAD = struct.Struct("<8sII")
+MWB_ALIGN = 64
+
+
+def _mwb_align(n):
+    return (n + MWB_ALIGN - 1) // MWB_ALIGN * MWB_ALIGN
+
+
+class _Plans(threading.local):
+    """predict_batch's InferencePlans, one set per thread: a plan's activation buffers are reused by every run"""
+
+    def __init__(self):
+        self.plans = {}  # (input_shape, batch_size, dtype) -> InferencePlan
+
+    def __reduce__(self):
+        # a copied model compiles its own plans
+        return _Plans, ()
+
+
+class _Inputs:
+    """
+    The model inputs for samples of x, an (N, H, W) Tensor or a cnn.Data dataset, without a copy
+    or a new Tensor per batch. A single sample or a range of samples of a Tensor is a View onto
+    its buffer, moved to the sample's offset; other batches (shuffled indices, cnn.Data samples)
+    are copied into one buffer that every batch reuses. So each input is only valid until the
+    next call.
+    """
+
+    def __init__(self, x):
+        self.x = x
+        self.H, self.W = x.shape[-2:]
+        self.window = None if hasattr(x, "read") else View(x.data, (1, self.H, self.W), x.offset)
+        self.copy = None  # View over the copy buffer, grown on demand
+
+    def __call__(self, idxs, batched):
+        x, n, k = self.x, self.H * self.W, len(idxs)
+        shape = (k, 1, self.H, self.W) if batched else (1, self.H, self.W)
+
+        if self.window is not None and (k == 1 or isinstance(idxs, range) and idxs.step == 1):
+            return self.window.at(x.offset + idxs[0] * n, shape)
+
+        if self.copy is None or len(self.copy.data) < k * n:
+            # cnn.Data samples are converted to doubles
+            self.copy = View(array('d' if self.window is None else x.dtype, [0.0]) * (k * n), shape)
+        out = self.copy.at(0, shape)
+
+        if self.window is None:
+            for j, i in enumerate(idxs):
+                x.read(i, out.data, j * n)
+        else:
+            src, dst = memoryview(x.data), memoryview(out.data)
+            for j, i in enumerate(idxs):
+                base = x.offset + i * n
+                dst[j * n: (j + 1) * n] = src[base: base + n]
+        return out
 
 
 class CNN:
-    def __init__(self, layers, loss_fn, random_seed=1):
+    def __init__(self, layers, loss_fn, random_seed=1, optimizer=None, profiler=None, arena=None, checkpoint=None):
         seed(random_seed)
         self.random_seed = random_seed
 
         self.layers = list(layers)
         self.loss_fn = loss_fn
+        self.optimizer = optimizer  # cnn.Optimizer instance, None: every layer runs its own SGD step()
+        self.profiler = profiler  # cnn.Profiler instance timing every layer call, None: no profiling
+        self.arena = arena  # cnn.Arena the C layers write their outputs into, None: new arrays per call
+        self.checkpoint = checkpoint  # cnn.Checkpoint taking snapshots during train_epoch, None: no checkpoints
+        self._resume = None  # (idxs, position, loss, correct) of an epoch for train_epoch to finish, see Checkpoint
+        self._plans = _Plans()  # InferencePlans used by predict_batch, per thread
+
+    @property
+    def arena(self):
+        return self._arena
+
+    @arena.setter
+    def arena(self, arena):
+        """hands arena to every layer (fused ones and their parts) and the loss; set it again after replacing layers"""
+        self._arena = arena
+        for obj in (*self.layers, *CNN._unfused(self.layers), self.loss_fn):
+            if hasattr(obj, "arena"):
+                obj.arena = arena
 
     def zero_grad(self):
         for layer in self.layers:
             layer.zero_grad()
 
-    def forward(self, x, train=True):
+    @property
+    def dtype(self):
+        """element type of the parameters, 'd' (float64) or 'f' (float32)"""
         for layer in self.layers:
-            x = layer.forward(x, train=train)
+            if hasattr(layer, "W"):
+                return layer.W.dtype
+        return 'd'
+
+    def astype(self, dtype):
+        """convert parameters, gradients and optimizer state to dtype in place, returns the model"""
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype must be one of {DTYPES}")
+
+        for layer in CNN._unfused(self.layers):
+            if hasattr(layer, "W") and hasattr(layer, "b"):
+                for name in ("W", "b", "dW", "db"):
+                    setattr(layer, name, getattr(layer, name).astype(dtype))
+        if self.optimizer is not None:
+            self.optimizer.astype(dtype)
+        self._plans = _Plans()  # compiled plans (of every thread) point at the replaced buffers
+        return self
+
+    def forward(self, x, train=True):
+        x = x.astype(self.dtype)
+        prof = self.profiler
+        for i, layer in enumerate(self.layers):
+            if prof is None:
+                x = layer.forward(x, train=train)
+            else:
+                x = prof.call(i, layer, "forward", layer.forward, x, train)
         return x
 
     def backward(self, dlogits):
         dy = dlogits
-        for layer in reversed(self.layers):
-            dy = layer.backward(dy)
+        prof = self.profiler
+        for i in reversed(range(len(self.layers))):
+            layer = self.layers[i]
+            if prof is None:
+                dy = layer.backward(dy)
+            else:
+                dy = prof.call(i, layer, "backward", layer.backward, dy)
         return dy
 
     def step(self):
-        for layer in self.layers:
-            layer.step()
+        prof = self.profiler
+        if self.optimizer is not None:
+            if prof is None:
+                self.optimizer.step(self.layers)
+            else:
+                prof.call(None, self.optimizer, "step", self.optimizer.step, self.layers)
+            return
+
+        for i, layer in enumerate(self.layers):
+            if prof is None:
+                layer.step()
+            else:
+                prof.call(i, layer, "step", layer.step)
+
+    def _loss(self, logits, y):
+        if self.profiler is None:
+            return self.loss_fn.forward(logits, y)
+        return self.profiler.call(None, self.loss_fn, "forward", self.loss_fn.forward, logits, y)
 
     @staticmethod
     def _argmax_row(logits_row):
@@ -44,6 +180,15 @@ class CNN:
                 best_j = j
         return best_j
 
+    @staticmethod
+    def _argmax_rows(logits):
+        if len(logits.shape) == 1:
+            return [CNN._argmax_row(logits)]
+
+        N, K = logits.shape
+        row = View(logits.data, (K,))
+        return [CNN._argmax_row(row.at(logits.offset + n * logits.strides[0])) for n in range(N)]
+
     @staticmethod
     def _accuracy(preds, labels):
         correct = 0
@@ -52,87 +197,265 @@ class CNN:
                 correct += 1
         return correct / max(1, len(labels))
 
-    def train_epoch(self, x_train, y_train):
-        N, H, W = x_train.shape
-        if len(y_train) != N:
-            raise ValueError("x_train first dim must equal len(y_train)")
-
-        idxs = list(range(N))
-        shuffle(idxs)
+    @staticmethod
+    def _count(x):
+        return len(x) if hasattr(x, "read") else x.shape[0]
 
+    @staticmethod
+    def _gather(x, y, idxs, batched, inputs=None):
+        """
+        Samples x[idxs] as model input; x is an (N, H, W) Tensor or a cnn.Data dataset.
+        batched=False: one index -> (1, H, W) and a scalar label
+        batched=True: (len(idxs), 1, H, W) and a list of labels
+        inputs: the _Inputs(x) of a loop, reused across its calls; see _Inputs for what is copied
+        """
+        xb = (inputs or _Inputs(x))(idxs, batched)
+        return xb, [y[i] for i in idxs] if batched else y[idxs[0]]
+
+    def _train_batch(self, xb, yb):
+        logits = self.forward(xb, train=True)
+
+        loss = self._loss(logits, yb)
+        dlogits = self.loss_fn.backward()
+
+        self.zero_grad()
+        self.backward(dlogits)
+        self.step()
+
+        return logits, loss
+
+    def _run_batches(self, batches, train):
+        """one epoch over an iterable of (x, y) batches, as yielded by cnn.Data.Loader"""
         total_loss = 0.0
         total_correct = 0
+        n = 0
 
-        # TIME = time.time()
-        # t = 0
-        for i in idxs:
-            base = x_train.offset + i * (H * W)
-            xb = Tensor(x_train.data[base: base + H * W], (1, H, W))
-            yb = y_train[i]
+        for xb, yb in batches:
+            if train:
+                logits, loss = self._train_batch(xb, yb)
+            else:
+                logits = self.forward(xb, train=False)
+                loss = self._loss(logits, yb)
+
+            labels = yb if isinstance(yb, list) else [yb]
+            for pred, y in zip(self._argmax_rows(logits), labels):
+                if pred == y:
+                    total_correct += 1
+            total_loss += loss * len(labels)
+            n += len(labels)
+
+        if train and self.checkpoint is not None:
+            self.checkpoint.end_epoch(self, batches)
+        return total_loss / max(1, n), total_correct / max(1, n)
+
+    def train_epoch(self, x_train, y_train=None, batch_size=1):
+        """
+        One pass over (x_train, y_train) in shuffled order.
+        batch_size > 1 runs every layer on (N, ...) mini-batches and takes one step() per batch
+        on the batch-mean gradient; batch_size=1 is plain online SGD on (1, H, W) samples.
+
+        x_train may also be a cnn.Data dataset (e.g. a Shard) with y_train=None, sampled the
+        same way, or an iterable of (x, y) batches (e.g. a cnn.Data.Loader) with y_train=None,
+        used as given with batch_size ignored.
+
+        With a checkpoint set, snapshots are taken as it says (for an iterable of batches only
+        at the end of the epoch, with the Loader's state), and an epoch it resumed midway is
+        finished first.
+        """
+        if y_train is None:
+            if not hasattr(x_train, "read"):
+                return self._run_batches(x_train, train=True)
+            y_train = x_train.labels
+
+        N = CNN._count(x_train)
+        if len(y_train) != N:
+            raise ValueError("x_train first dim must equal len(y_train)")
+        if batch_size < 1:
+            raise ValueError("batch_size must be >= 1")
+
+        if self._resume is not None:
+            idxs, begin, total_loss, total_correct = self._resume
+            self._resume = None
+            if len(idxs) != N:
+                raise ValueError(f"resumed epoch is over {len(idxs)} samples, x_train has {N}")
+        else:
+            idxs = list(range(N))
+            shuffle(idxs)
+            begin, total_loss, total_correct = 0, 0.0, 0
 
-            logits = self.forward(xb, train=True)
+        batched = batch_size > 1
+        inputs = _Inputs(x_train)
+        ckpt = self.checkpoint
 
-            loss = self.loss_fn.forward(logits, yb)
-            dlogits = self.loss_fn.backward()
+        for start in range(begin, N, batch_size):
+            batch = idxs[start: start + batch_size]
+            xb, yb = self._gather(x_train, y_train, batch, batched, inputs)
 
-            self.zero_grad()
-            self.backward(dlogits)
-            self.step()
+            logits, loss = self._train_batch(xb, yb)
 
-            # t += 1
-            # if t % 100 == 0:
-            #     print(t, " - ", round(time.time() - TIME, 4), "s",sep="")
+            for pred, i in zip(self._argmax_rows(logits), batch):
+                if pred == y_train[i]:
+                    total_correct += 1
+            total_loss += loss * len(batch)
 
-            pred = self._argmax_row(logits)
-            if pred == y_train[i]:
-                total_correct += 1
-            total_loss += loss
+            if ckpt is not None:
+                ckpt.batch(self, idxs, start + len(batch), total_loss, total_correct, len(batch))
 
-        # print(round(time.time() - TIME, 4), "s", sep="")
+        if ckpt is not None:
+            ckpt.end_epoch(self)
         return total_loss / max(1, N), total_correct / max(1, N)
 
-    def eval_epoch(self, x_test, y_test):
-        N, H, W = x_test.shape
+    def eval_epoch(self, x_test, y_test=None, batch_size=1):
+        """x_test may be a cnn.Data dataset or an iterable of (x, y) batches with y_test=None, as for train_epoch"""
+        if y_test is None:
+            if not hasattr(x_test, "read"):
+                return self._run_batches(x_test, train=False)
+            y_test = x_test.labels
+
+        N = CNN._count(x_test)
 
         total_loss = 0.0
         total_correct = 0
+        batched = batch_size > 1
+        inputs = _Inputs(x_test)
 
-        for i in range(N):
-            base = x_test.offset + i * (H * W)
-            xb = Tensor(x_test.data[base: base + H * W], (1, H, W))
-            yb = y_test[i]
+        for start in range(0, N, batch_size):
+            batch = range(start, min(N, start + batch_size))
+            xb, yb = self._gather(x_test, y_test, batch, batched, inputs)
 
             logits = self.forward(xb, train=False)
 
-            loss = self.loss_fn.forward(logits, yb)
+            loss = self._loss(logits, yb)
 
-            pred = self._argmax_row(logits)
-            if pred == y_test[i]:
-                total_correct += 1
-            total_loss += loss
+            for pred, i in zip(self._argmax_rows(logits), batch):
+                if pred == y_test[i]:
+                    total_correct += 1
+            total_loss += loss * len(batch)
 
         return total_loss / max(1, N), total_correct / max(1, N)
 
     def predict(self, x):
         return list(Dense.softmax(self.forward(x, train=False)).data)
 
+    def predict_batch(self, images, k=5, batch_size=256, input_shape=(1, 32, 32)):
+        """
+        images: Tensor (N, *input_shape), or any C-contiguous float64 / float32 buffer holding
+                N samples of input_shape back to back (array, memoryview, mmap, numpy array, ...)
+        returns: (softmax probabilities Tensor (N, D), memoryview of int64 (N, k) with the
+                 indices of the k most probable classes per sample, most probable first)
+
+        Runs through a cached InferencePlan batch_size samples at a time, so the images are
+        never copied into Tensors and the only allocations are the two outputs. Plans are
+        cached per thread, so threads sharing a model (e.g. through cnn.Registry) can call
+        predict_batch concurrently; each thread compiles its own plan on its first call.
+        """
+        from c_cnn.c_extension import cnn as kernels
+
+        input_shape = tuple(input_shape)
+        n_in = 1
+        for s in input_shape:
+            n_in *= s
+
+        if isinstance(images, Tensor):
+            data, offset = images.data, images.offset
+            if tuple(images.shape[1:]) != input_shape:
+                raise ValueError(f"predict_batch expects images shape (N, *{input_shape})")
+            N = images.shape[0]
+        else:
+            data, offset = Tensor._flat_view(images), 0
+            if data is None or data.format not in DTYPES:
+                raise ValueError("predict_batch expects a C-contiguous float64 / float32 buffer")
+            if len(data) % n_in:
+                raise ValueError(f"buffer of {len(data)} values is not a whole number of {input_shape} samples")
+            N = len(data) // n_in
+
+        key = (input_shape, batch_size, self.dtype)
+        plans = self._plans.plans
+        plan = plans.get(key)
+        if plan is None:
+            plan = plans[key] = self.compile(input_shape, batch_size)
+
+        D = 1
+        for s in plan.output_shape:
+            D *= s
+        k = min(k, D)
+
+        probs = array(self.dtype, [0.0]) * (N * D)
+        top = array("q", [0]) * (N * k)
+
+        for start in range(0, N, batch_size):
+            n = min(batch_size, N - start)
+            logits = plan.run(Tensor(data, (n, *input_shape), offset + start * n_in))
+            kernels.softmax_forward(*logits.reshape((n, D)).args(), probs, start * D)
+
+        if not N:
+            return Tensor(probs, (0, D)), memoryview(top)  # memoryview cannot take a shape with a 0
+        kernels.topk(*Tensor(probs, (N, D)).args(), k, top, 0)
+
+        return Tensor(probs, (N, D)), memoryview(top).cast("B").cast("q", (N, k))
+
+    def compile(self, input_shape, batch_size=1):
+        """forward-only InferencePlan for inputs of input_shape (see cnn.Inference)"""
+        from cnn.Inference import InferencePlan
+        return InferencePlan(self, input_shape, batch_size)
+
     @staticmethod
-    def from_mw(filename, use_c=True):
+    def _layer_namespace(use_c=True):
+        """names available to the layer / loss specs stored in model files"""
         if use_c:
+            from c_cnn.Activation import ReLU, Sigmoid
             from c_cnn.Convolve import Convolve
             from c_cnn.Dense import Dense
+            from c_cnn.Loss import CrossEntropyLoss
             from c_cnn.Pooling import Pooling
         else:
+            from cnn.Activation import ReLU, Sigmoid
             from cnn.Convolve import Convolve
             from cnn.Dense import Dense
+            from cnn.Loss import CrossEntropyLoss
             from cnn.Pooling import Pooling
 
-        from cnn.Activation import ReLU, Sigmoid
         from cnn.Flatten import Flatten
-        from cnn.Loss import CrossEntropyLoss
-        from cnn.Tensor import Tensor
 
-        from array import array
+        return {"Convolve": Convolve, "Dense": Dense, "Pooling": Pooling, "ReLU": ReLU, "Sigmoid": Sigmoid,
+                "Flatten": Flatten, "CrossEntropyLoss": CrossEntropyLoss, "Tensor": Tensor, "array": array}
+
+    @staticmethod
+    def fuse(layers):
+        """C layers with every Convolve -> ReLU -> Pooling(mode='max') run replaced by one ConvReLUPool"""
+        import c_cnn.Activation
+        import cnn.Activation
+        from c_cnn.Convolve import Convolve
+        from c_cnn.ConvReLUPool import ConvReLUPool
+        from c_cnn.Pooling import Pooling
+
+        relus = (c_cnn.Activation.ReLU, cnn.Activation.ReLU)
+
+        out = []
+        i = 0
+        while i < len(layers):
+            run = layers[i: i + 3]
+            if (len(run) == 3 and isinstance(run[0], Convolve) and isinstance(run[1], relus)
+                    and isinstance(run[2], Pooling) and run[2].mode == "max"):
+                out.append(ConvReLUPool(*run))
+                i += 3
+            else:
+                out.append(layers[i])
+                i += 1
+        return out
+
+    @staticmethod
+    def _unfused(layers):
+        """layers as saved in model files, fused layers expanded"""
+        out = []
+        for layer in layers:
+            out.extend(getattr(layer, "layers", (layer,)))
+        return out
+
+    @staticmethod
+    def from_mw(filename, use_c=True, dtype=None):
+        """dtype: None keeps the dtype of the stored parameters"""
+        ns = CNN._layer_namespace(use_c)
 
         with open(filename, "r") as f:
             config = list(map(str.strip, f.readlines()))
@@ -146,24 +469,96 @@ class CNN:
             if line.startswith("LOSS:"):
                 break
 
-            l = eval(line)
+            l = eval(line, ns)
             if hasattr(l, "W") and hasattr(l, "b"):
-                l.W = eval(config[i + 1])
-                l.b = eval(config[i + 2])
+                l.W = eval(config[i + 1], ns)
+                l.b = eval(config[i + 2], ns)
                 i += 3
             else:
                 i += 1
 
             layers.append(l)
 
-        loss = eval(line[len("LOSS:"):])
+        loss = eval(line[len("LOSS:"):], ns)
+
+        # gradients were allocated for the random init, match them to the stored parameters
+        model = CNN(CNN.fuse(layers) if use_c else layers, loss)
+        return model.astype(dtype or model.dtype)
+
+    @staticmethod
+    def from_mwb(filename, use_c=True, dtype=None, writable=True):
+        """
+        Load a model written by to_mwb.
+
+        The file is mapped copy-on-write: float64 parameters are used in place, W.data and
+        b.data are views straight into the mapping with no parsing or copying, and processes
+        loading the same file share its pages until they train. The model takes the dtype of
+        the file (float32 parameters are mapped in place too) unless dtype converts it on load.
+        writable=False maps the file read-only, for inference: the pages are then never
+        copied, and anything writing to the parameters (training) raises instead.
+        """
+        ns = CNN._layer_namespace(use_c)
+
+        with open(filename, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY if writable else mmap.ACCESS_READ)
+
+        if mm.size() < MWB_HEAD.size:
+            raise ValueError(f"{filename}: not a .mwb model file")
+        magic, version, header_len = MWB_HEAD.unpack_from(mm, 0)
+        if magic != MWB_MAGIC:
+            raise ValueError(f"{filename}: not a .mwb model file")
+        if version != MWB_VERSION:
+            raise ValueError(f"{filename}: unsupported .mwb version {version}")
+
+        header = json.loads(mm[MWB_HEAD.size: MWB_HEAD.size + header_len].decode("utf-8"))
+        base = _mwb_align(MWB_HEAD.size + header_len)
+        raw = memoryview(mm)
+
+        layers = []
+        for entry in header["layers"]:
+            params = {name: Tensor(CNN._mwb_blob(raw, base + p["offset"], p["shape"], p["dtype"]), p["shape"])
+                      for name, p in entry["params"].items()}
+
+            # stored parameters go straight to the constructor, skipping its random init
+            cls, args, kwargs = CNN._parse_spec(entry["spec"], ns)
+            layers.append(cls(*args, **kwargs, **params))
+
+        model = CNN(CNN.fuse(layers) if use_c else layers, eval(header["loss"], ns))
+        return model.astype(dtype) if dtype and dtype != model.dtype else model
+
+    @staticmethod
+    def _parse_spec(spec, ns):
+        """a layer spec "Name(literal, ..., key=literal)" -> (the class ns names, args, kwargs)"""
+        call = ast.parse(spec, mode="eval").body
+        if not (isinstance(call, ast.Call) and isinstance(call.func, ast.Name) and call.func.id in ns):
+            raise ValueError(f"not a layer spec: {spec}")
+        args = [ast.literal_eval(a) for a in call.args]
+        kwargs = {k.arg: ast.literal_eval(k.value) for k in call.keywords}
+        return ns[call.func.id], args, kwargs
 
-        return CNN(layers, loss)
+    @staticmethod
+    def _mwb_blob(raw, offset, shape, dtype):
+        n = 1
+        for s in shape:
+            n *= s
+
+        itemsize = array(dtype).itemsize
+        if offset + n * itemsize > len(raw):
+            raise ValueError("truncated .mwb file")
+
+        blob = raw[offset: offset + n * itemsize]
+        if sys.byteorder == "little":
+            return blob.cast(dtype)
+
+        out = array(dtype)
+        out.frombytes(blob)
+        out.byteswap()
+        return out
 
     def to_mw(model, filename):
         out = []
 
-        for layer in model.layers:
+        for layer in CNN._unfused(model.layers):
             out.append(layer.__str__())
             if hasattr(layer, "W") and hasattr(layer, "b"):
                 out.append(layer.W.__str__())
@@ -177,4 +572,72 @@ class CNN:
             pass
         with open(filename, 'w') as f:
             for line in out:
-                f.write(line + "\n")
\ No newline at end of file
+                f.write(line + "\n")
+
+    def to_mwb(model, filename, dtype=None):
+        """
+        Write the model as a .mwb file (see from_mwb). dtype 'd' stores float64 parameters,
+        'f' stores float32 at half the size, None the model's own dtype. The file is written
+        beside filename and renamed into place, so processes that have the old file mapped
+        keep a consistent copy.
+        """
+        tmp = filename + ".tmp"
+        with open(tmp, "wb") as f:
+            CNN._write_mwb(model, f, dtype)
+        os.replace(tmp, filename)
+
+    @staticmethod
+    def _write_mwb(model, f, dtype=None):
+        """the .mwb image of model, written to the binary file object f from its start"""
+        header, blobs, _ = CNN._mwb_parts(model, dtype)
+        CNN._write_mwb_parts(f, header, blobs)
+
+    @staticmethod
+    def _mwb_parts(model, dtype=None):
+        """
+        (header, [(offset, blob)], data section size) of the .mwb image of model. The blobs are
+        copies of the parameters, so they can be written out while the model keeps training
+        """
+        dtype = dtype or model.dtype
+        if dtype not in ('d', 'f'):
+            raise ValueError("dtype must be 'd' (float64) or 'f' (float32)")
+
+        entries = []
+        blobs = []
+        offset = 0
+        for layer in CNN._unfused(model.layers):
+            params = {}
+            if hasattr(layer, "W") and hasattr(layer, "b"):
+                for name in ("W", "b"):
+                    t = getattr(layer, name)
+                    params[name] = {"shape": list(t.shape), "dtype": dtype, "offset": offset}
+                    blob = CNN._mwb_copy(t.data, t.offset, t.volume(), dtype)
+                    blobs.append((offset, blob))
+                    offset = _mwb_align(offset + len(blob) * blob.itemsize)
+            entries.append({"spec": layer.__str__(), "params": params})
+
+        return {"layers": entries, "loss": model.loss_fn.__str__()}, blobs, offset
+
+    @staticmethod
+    def _mwb_copy(data, offset, n, dtype):
+        """data[offset: offset + n] as a little-endian blob of dtype; a plain memcpy when the dtype matches"""
+        src = memoryview(data)[offset: offset + n]
+        if src.format == dtype:
+            blob = array(dtype)
+            blob.frombytes(src.cast("B"))
+        else:
+            blob = array(dtype, src)
+        if sys.byteorder != "little":
+            blob.byteswap()
+        return blob
+
+    @staticmethod
+    def _write_mwb_parts(f, header, blobs):
+        header = json.dumps(header).encode("utf-8")
+        base = _mwb_align(MWB_HEAD.size + len(header))
+
+        f.write(MWB_HEAD.pack(MWB_MAGIC, MWB_VERSION, len(header)))
+        f.write(header)
+        for off, blob in blobs:
+            f.write(b"\0" * (base + off - f.tell()))
+            blob.tofile(f)
@@ -0,0 +1,237 @@
+import json
+import os
+import random
+import threading
+import time
+from array import array
+
+from c_cnn.c_extension import cnn as kernels
+from cnn.CNN import CNN, MWB_HEAD, MWB_MAGIC, MWB_VERSION, _mwb_align
+from cnn.Optimizer import parameters
+
+
+class Checkpoint:
+    """
+    Periodic training checkpoints, written in a background thread.
+
+    While a CNN with a checkpoint trains, a snapshot is taken after a batch once every_samples
+    samples or every_s seconds have passed since the last one, and at the end of every epoch.
+    Taking it is a copy of the parameter and optimizer buffers; a background thread then
+    writes it beside path and renames it into place, so path always holds a complete
+    checkpoint. Snapshots that come due while the previous one is still being written are taken
+    after the next batch instead.
+
+    A checkpoint is a .mwb file (CNN.from_mwb loads it as a model) that also holds the
+    optimizer state, the random module's state, the epoch count and, mid-epoch, the shuffled
+    sample order with the position in it and the loss / accuracy so far; for a run fed by a
+    cnn.Data.Loader, the loader's state() too. Resuming from it continues exactly where it
+    was taken: the rest of the run is the same as without the interruption.
+
+        ckpt = Checkpoint("run.ckpt", every_s=600)
+        model = CNN(layers, loss, optimizer=Adam(), checkpoint=ckpt)  # or model.checkpoint = ckpt
+        for epoch in range(ckpt.resume(model), 50):  # 0 when there is no checkpoint yet
+            model.train_epoch(x_train, y_train, batch_size=32)
+        ckpt.close()  # waits for the last write
+
+    or, with a Loader (snapshots at epoch ends only):
+        for epoch in range(ckpt.resume(model, loader), 50):
+            model.train_epoch(loader)
+    """
+
+    def __init__(self, path, every_samples=None, every_s=None):
+        self.path = path
+        self.every_samples = every_samples
+        self.every_s = every_s
+
+        self.epoch = 0  # finished train_epoch calls
+        self.saved = 0  # checkpoints written
+        self._samples = 0  # samples trained since the last snapshot
+        self._t = time.monotonic()
+
+        self._init_writer()
+
+    def _init_writer(self):
+        self._cond = threading.Condition()
+        self._job = None  # (header, blobs) waiting for the writer
+        self._busy = False
+        self._error = None
+        self._thread = None
+
+    # ---------------------------------------------------------------------
+    # Hooks, called by CNN.train_epoch
+    # ---------------------------------------------------------------------
+
+    def batch(self, model, idxs, pos, total_loss, total_correct, n):
+        """after a batch of n samples; idxs[pos:] are the samples of the epoch still to train on"""
+        self._samples += n
+        due = ((self.every_samples is not None and self._samples >= self.every_samples) or
+               (self.every_s is not None and time.monotonic() - self._t >= self.every_s))
+        if due and pos < len(idxs):
+            self._snapshot(model, (idxs, pos, total_loss, total_correct))
+
+    def end_epoch(self, model, batches=None):
+        """batches: the iterable of batches the epoch ran on, if any; a Loader's state() is saved"""
+        self.epoch += 1
+        self._snapshot(model, None, wait=True, loader=batches if hasattr(batches, "state") else None)
+
+    # ---------------------------------------------------------------------
+    # Writing
+    # ---------------------------------------------------------------------
+
+    def _snapshot(self, model, progress, wait=False, loader=None):
+        with self._cond:
+            self._raise()
+            if self._busy:
+                if not wait:
+                    return
+                while self._busy:
+                    self._cond.wait()
+                self._raise()
+
+        header, blobs, end = CNN._mwb_parts(model)
+
+        def add(data, offset, n, dtype):
+            nonlocal end
+            blobs.append((end, CNN._mwb_copy(data, offset, n, dtype)))
+            entry = {"shape": [n], "dtype": dtype, "offset": end}
+            end = _mwb_align(end + n * array(dtype).itemsize)
+            return entry
+
+        state = {"epoch": self.epoch, "random": random.getstate(), "time": time.time()}
+        opt = model.optimizer
+        if opt is not None:
+            state["optimizer"] = {"spec": str(opt), "t": opt.t,
+                                  "state": [{name: add(buf, 0, len(buf), buf.typecode) for name, buf in s.items()}
+                                            for s in opt.state]}
+        if progress is not None:
+            idxs, pos, total_loss, total_correct = progress
+            state["progress"] = {"idxs": add(array('q', idxs), 0, len(idxs), 'q'), "pos": pos,
+                                 "loss": total_loss, "correct": total_correct}
+        if loader is not None:
+            state["loader"] = loader.state()
+        header["checkpoint"] = state
+
+        with self._cond:
+            self._job = (header, blobs)
+            self._busy = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._writer, name="cnn-checkpoint", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+        self._samples = 0
+        self._t = time.monotonic()
+
+    def _writer(self):
+        while True:
+            with self._cond:
+                while self._job is None:
+                    self._cond.wait()
+                header, blobs = self._job
+                self._job = None
+
+            try:
+                tmp = self.path + ".tmp"
+                with open(tmp, "wb") as f:
+                    CNN._write_mwb_parts(f, header, blobs)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+            except BaseException as e:
+                with self._cond:
+                    self._error = e
+            else:
+                with self._cond:
+                    self.saved += 1
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+    def _raise(self):
+        if self._error is not None:
+            e, self._error = self._error, None
+            raise RuntimeError(f"writing checkpoint {self.path} failed") from e
+
+    def wait(self):
+        """block until the snapshot being written (if any) is on disk"""
+        with self._cond:
+            while self._busy:
+                self._cond.wait()
+            self._raise()
+
+    def close(self):
+        self.wait()
+
+    def __getstate__(self):
+        # a copied model (e.g. sent to another process) gets the settings, not the writer thread
+        return {k: v for k, v in self.__dict__.items()
+                if k not in ("_cond", "_job", "_busy", "_error", "_thread")}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_writer()
+
+    # ---------------------------------------------------------------------
+    # Resuming
+    # ---------------------------------------------------------------------
+
+    def resume(self, model, loader=None):
+        """
+        Load path, if it exists, into model (built the same way as the checkpointed one), and
+        into loader (a cnn.Data.Loader built the same way) for a run fed by one; returns the
+        number of finished epochs. An epoch checkpointed midway is finished by the next
+        model.train_epoch call, which must get the same training set
+        """
+        if not os.path.exists(self.path):
+            return 0
+
+        with open(self.path, "rb") as f:
+            self._load(model, loader, memoryview(f.read()))
+        return self.epoch
+
+    def _load(self, model, loader, raw):
+        magic, version, header_len = MWB_HEAD.unpack_from(raw, 0)
+        if magic != MWB_MAGIC or version != MWB_VERSION:
+            raise ValueError(f"{self.path}: not a checkpoint")
+        header = json.loads(bytes(raw[MWB_HEAD.size: MWB_HEAD.size + header_len]).decode("utf-8"))
+        state = header.get("checkpoint")
+        if state is None:
+            raise ValueError(f"{self.path}: a .mwb model file, not a checkpoint")
+        if loader is not None and "loader" not in state:
+            raise ValueError(f"{self.path}: checkpoint of a run not fed by a Loader")
+        base = _mwb_align(MWB_HEAD.size + header_len)
+
+        def blob(entry):
+            return CNN._mwb_blob(raw, base + entry["offset"], entry["shape"], entry["dtype"])
+
+        layers = list(CNN._unfused(model.layers))
+        if [layer.__str__() for layer in layers] != [e["spec"] for e in header["layers"]]:
+            raise ValueError(f"{self.path}: checkpoint is of a different model")
+
+        for layer, entry in zip(layers, header["layers"]):
+            for name, p in entry["params"].items():
+                t = getattr(layer, name)
+                kernels.cast(blob(p), 0, t.data, t.offset, t.volume())
+
+        opt = model.optimizer
+        saved = state.get("optimizer")
+        if (opt is None) != (saved is None) or (opt is not None and str(opt).split("(")[0] != saved["spec"].split("(")[0]):
+            raise ValueError(f"{self.path}: checkpoint optimizer {saved and saved['spec']} != model's {opt}")
+        if opt is not None:
+            dtypes = [p.dtype for _, p, _ in parameters(model.layers)]
+            opt.t = saved["t"]
+            opt.state = [{name: array(dtype, blob(e)) for name, e in s.items()} for s, dtype in zip(saved["state"], dtypes)]
+
+        version, internal, gauss_next = state["random"]
+        random.setstate((version, tuple(internal), gauss_next))
+        if loader is not None:
+            loader.load_state(state["loader"])
+
+        progress = state.get("progress")
+        model._resume = None
+        if progress is not None:
+            model._resume = (blob(progress["idxs"]).tolist(), progress["pos"], progress["loss"], progress["correct"])
+
+        self.epoch = state["epoch"]
+        self._samples = 0
+        self._t = time.monotonic()
@@ -4,7 +4,7 @@ from cnn.Tensor import Tensor
 
 
 class Convolve:
-    def __init__(self, cin, cout, kh, kw, lr=0.01, random_seed=1):
+    def __init__(self, cin, cout, kh, kw, lr=0.01, random_seed=1, W=None, b=None):
         self.cin = cin
         self.cout = cout
         self.kh = kh
@@ -16,8 +16,10 @@ class Convolve:
 
         scale = math.sqrt(2.0 / (cin * kh * kw))
 
-        self.W = Tensor([gauss(0.0, scale) for _ in range(cout * cin * kh * kw)], (cout, cin, kh, kw))
-        self.b = Tensor.zeros((cout,))
+        # W/b given when loading a saved model, random init otherwise
+        self.W = W if W is not None else Tensor([gauss(0.0, scale) for _ in range(cout * cin * kh * kw)],
+                                                (cout, cin, kh, kw))
+        self.b = b if b is not None else Tensor.zeros((cout,))
 
         self.dW = Tensor.zeros((cout, cin, kh, kw))
         self.db = Tensor.zeros((cout,))
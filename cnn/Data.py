@@ -0,0 +1,347 @@
+import json
+import mmap
+import os
+import queue
+import struct
+import sys
+import threading
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from random import Random
+
+from c_cnn.c_extension import cnn
+from cnn.Tensor import Tensor
+
+IMAGE_SIZE = 32
+
+# .shard: packed uint8 dataset
+#   SHARD_HEAD (magic, version, header length), a UTF-8 JSON header (count, sample shape,
+#   classes, section offsets), then three sections: pixels (count, H, W) uint8, labels
+#   (count,) uint8 and index (len(classes) + 1,) little-endian uint32. Samples are stored
+#   grouped by class, class c owning samples index[c]:index[c + 1]. Section offsets are
+#   relative to the data section; the data section and every section start on a
+#   SHARD_ALIGN boundary.
+SHARD_MAGIC = b"AKSHRSHD"
+SHARD_VERSION = 1
+SHARD_HEAD = struct.Struct("<8sII")
+SHARD_ALIGN = 64
+
+
+def _shard_align(n):
+    return (n + SHARD_ALIGN - 1) // SHARD_ALIGN * SHARD_ALIGN
+
+
+class ImageFolder:
+    """
+    The UCI Devanagari Handwritten Character Dataset as shipped: root/character_<k>_<label>/*.png,
+    root being its Train or Test folder. Only the file list is kept in memory.
+
+    Classes are the consonant labels in sorted order, the order the demo maps model outputs
+    to; digit_<d> folders are skipped. Pixels are scaled to [0, 1].
+    """
+
+    def __init__(self, root):
+        folders = {}
+        for name in os.listdir(root):
+            if name.startswith("character_") and os.path.isdir(os.path.join(root, name)):
+                folders[name.split("_", 2)[2]] = name
+        if not folders:
+            raise ValueError(f"{root}: no character_<k>_<label> folders")
+
+        self.root = root
+        self.classes = sorted(folders)
+        self.shape = (IMAGE_SIZE, IMAGE_SIZE)
+
+        self.items = []  # (path, label)
+        for y, label in enumerate(self.classes):
+            folder = os.path.join(root, folders[label])
+            self.items.extend((os.path.join(folder, f), y) for f in sorted(os.listdir(folder)) if f.endswith(".png"))
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def labels(self):
+        return [y for _, y in self.items]
+
+    def read_u8(self, i):
+        """decoded sample i: (uint8 pixels (H, W), label)"""
+        import cv2  # only needed for PNG folders, not for shards
+
+        path, y = self.items[i]
+        img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            raise ValueError(f"{path}: could not decode image")
+        if img.shape != self.shape:
+            raise ValueError(f"{path}: expected {self.shape} pixels, got {img.shape}")
+        return img, y
+
+    def read(self, i, out, off):
+        """decode sample i into out[off: off + H * W]; returns its label"""
+        img, y = self.read_u8(i)
+        cnn.u8_to_real(img, 0, out, off, IMAGE_SIZE * IMAGE_SIZE, 1.0 / 255.0)
+        return y
+
+
+class Shard:
+    """
+    A .shard file written by write_shard, mapped read-only.
+
+    Pixels stay uint8 in the mapping (1/8 the size of doubles, shared by every process that
+    opens the file) and read() converts one sample to doubles on demand, so opening is
+    instant and nothing is materialised up front. Usable wherever an ImageFolder is, and
+    directly as CNN.train_epoch / eval_epoch input.
+    """
+
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        mm = self._mm
+
+        if mm.size() < SHARD_HEAD.size:
+            raise ValueError(f"{filename}: not a .shard file")
+        magic, version, header_len = SHARD_HEAD.unpack_from(mm, 0)
+        if magic != SHARD_MAGIC:
+            raise ValueError(f"{filename}: not a .shard file")
+        if version != SHARD_VERSION:
+            raise ValueError(f"{filename}: unsupported .shard version {version}")
+
+        header = json.loads(mm[SHARD_HEAD.size: SHARD_HEAD.size + header_len].decode("utf-8"))
+        base = _shard_align(SHARD_HEAD.size + header_len)
+
+        self.filename = filename
+        self.classes = header["classes"]
+        self.shape = tuple(header["shape"])
+        N = header["count"]
+        H, W = self.shape
+
+        if base + header["index"] + 4 * (len(self.classes) + 1) > mm.size():
+            raise ValueError(f"{filename}: truncated .shard file")
+
+        raw = memoryview(mm)
+        self.pixels = raw[base + header["pixels"]: base + header["pixels"] + N * H * W]
+        self.labels = raw[base + header["labels"]: base + header["labels"] + N]
+        self.index = list(struct.unpack_from(f"<{len(self.classes) + 1}I", mm, base + header["index"]))
+
+    def __len__(self):
+        return len(self.labels)
+
+    def read_u8(self, i):
+        """sample i: (uint8 pixels (H, W) as a view into the mapping, label)"""
+        H, W = self.shape
+        return self.pixels[i * H * W: (i + 1) * H * W].cast('B', self.shape), self.labels[i]
+
+    def read(self, i, out, off):
+        """convert sample i into out[off: off + H * W]; returns its label"""
+        H, W = self.shape
+        cnn.u8_to_real(self.pixels, i * H * W, out, off, H * W, 1.0 / 255.0)
+        return self.labels[i]
+
+    def close(self):
+        self.pixels.release()
+        self.labels.release()
+        self._mm.close()
+
+
+class Samples:
+    """An in-memory (N, H, W) Tensor and its labels as a dataset, e.g. to feed a Loader"""
+
+    def __init__(self, x, labels):
+        N, H, W = x.shape
+        if len(labels) != N:
+            raise ValueError("x first dim must equal len(labels)")
+        self.x = x
+        self.labels = list(labels)
+        self.shape = (H, W)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def read(self, i, out, off):
+        """copy sample i into out[off: off + H * W]; returns its label"""
+        H, W = self.shape
+        cnn.cast(self.x.data, self.x.offset + i * H * W, out, off, H * W)
+        return self.labels[i]
+
+
+def write_shard(dataset, filename):
+    """
+    One-time conversion of a dataset (ImageFolder, Shard) into a .shard file (see Shard).
+    Samples are streamed one at a time, so memory stays flat; the file is written beside
+    filename and renamed into place.
+    """
+    N = len(dataset)
+    H, W = dataset.shape
+    classes = list(dataset.classes)
+    if len(classes) > 256:
+        raise ValueError(".shard stores labels as uint8, at most 256 classes")
+
+    labels = dataset.labels
+    order = sorted(range(N), key=lambda i: labels[i])
+
+    index = [0] * (len(classes) + 1)
+    for i in order:
+        index[labels[i] + 1] += 1
+    for c in range(len(classes)):
+        index[c + 1] += index[c]
+
+    pixels_off = 0
+    labels_off = _shard_align(N * H * W)
+    index_off = _shard_align(labels_off + N)
+    header = json.dumps({"count": N, "shape": [H, W], "classes": classes,
+                         "pixels": pixels_off, "labels": labels_off, "index": index_off}).encode("utf-8")
+    base = _shard_align(SHARD_HEAD.size + len(header))
+
+    tmp = filename + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(SHARD_HEAD.pack(SHARD_MAGIC, SHARD_VERSION, len(header)))
+        f.write(header)
+        f.write(b"\0" * (base - f.tell()))
+        for i in order:
+            img, _ = dataset.read_u8(i)
+            f.write(memoryview(img).cast('B'))
+
+        f.write(b"\0" * (base + labels_off - f.tell()))
+        f.write(bytes(labels[i] for i in order))
+        f.write(b"\0" * (base + index_off - f.tell()))
+        f.write(struct.pack(f"<{len(index)}I", *index))
+    os.replace(tmp, filename)
+
+
+class Loader:
+    """
+    Shuffled batches from a dataset (ImageFolder, Shard, Samples), decoded in a background thread.
+
+    At most `prefetch` batches are decoded ahead, so memory stays flat whatever the dataset
+    size, and decoding overlaps with compute (cv2 and the C kernels release the GIL). Each
+    iteration is one epoch in a fresh order drawn from random_seed. Batches look like the
+    ones train_epoch builds: ((1, H, W), label) for batch_size=1, else ((B, 1, H, W), labels).
+
+    augment (a cnn.Augment) distorts every batch after decoding, seeded by the epoch count
+    and sample indices. workers > 1 prepares up to `prefetch` batches at once on a thread
+    pool, still yielding them in order, for when decoding / augmenting outpaces one core.
+
+        loader = Loader(ImageFolder("data/Train"), batch_size=32)
+        for epoch in range(50):
+            loss, acc = model.train_epoch(loader)
+
+    The shuffle order and augmentation follow from the epoch count and the random state,
+    which state() / load_state() carry over (cnn.Checkpoint saves them at every epoch end).
+    """
+
+    def __init__(self, dataset, batch_size=1, shuffle=True, random_seed=1, prefetch=4, augment=None, workers=1):
+        if batch_size < 1:
+            raise ValueError("batch_size must be >= 1")
+        if prefetch < 1:
+            raise ValueError("prefetch must be >= 1")
+        if workers < 1:
+            raise ValueError("workers must be >= 1")
+
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rng = Random(random_seed)
+        self.prefetch = prefetch
+        self.augment = augment
+        self.workers = workers
+        self.epoch = 0  # iterations started, seeds the augmentation
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def state(self):
+        """the epoch count and shuffle random state, JSON-serializable"""
+        return {"epoch": self.epoch, "random": self.rng.getstate()}
+
+    def load_state(self, state):
+        """continue from the state() of a Loader built the same way: its next epoch comes next"""
+        version, internal, gauss_next = state["random"]
+        self.rng.setstate((version, tuple(internal), gauss_next))
+        self.epoch = state["epoch"]
+
+    def _batch(self, idxs, epoch):
+        H, W = self.dataset.shape
+        data = array('d', [0.0]) * (len(idxs) * H * W)
+        labels = [self.dataset.read(i, data, k * H * W) for k, i in enumerate(idxs)]
+
+        x = Tensor(data, (1, H, W) if self.batch_size == 1 else (len(idxs), 1, H, W))
+        if self.augment is not None:
+            self.augment.apply(x, idxs, epoch, out=x)
+        return (x, labels[0]) if self.batch_size == 1 else (x, labels)
+
+    def _batches(self, idxs, epoch):
+        """the epoch's batches in order, with workers > 1 prepared up to prefetch at a time on a pool"""
+        chunks = (idxs[start: start + self.batch_size] for start in range(0, len(idxs), self.batch_size))
+        if self.workers == 1:
+            for chunk in chunks:
+                yield self._batch(chunk, epoch)
+            return
+
+        pool = ThreadPoolExecutor(self.workers, thread_name_prefix="cnn-loader")
+        try:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.submit(self._batch, chunk, epoch))
+                if len(pending) >= self.prefetch:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _work(self, idxs, epoch, q, stop):
+        try:
+            for item in self._batches(idxs, epoch):
+                while not stop.is_set():
+                    try:
+                        q.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    return
+            item = None
+        except BaseException as e:
+            item = e
+
+        # end of epoch (None) or the worker's error, re-raised by the consumer
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def __iter__(self):
+        idxs = list(range(len(self.dataset)))
+        if self.shuffle:
+            self.rng.shuffle(idxs)
+
+        epoch = self.epoch
+        self.epoch += 1
+
+        q = queue.Queue(self.prefetch)
+        stop = threading.Event()
+        worker = threading.Thread(target=self._work, args=(idxs, epoch, q, stop), daemon=True)
+        worker.start()
+
+        try:
+            while True:
+                item = q.get()
+                if item is None:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # also runs when the consumer stops early
+            stop.set()
+            worker.join()
+
+
+if __name__ == "__main__":
+    # python -m cnn.Data <png folder, e.g. .../Train> <out.shard>
+    if len(sys.argv) != 3:
+        sys.exit("usage: python -m cnn.Data <png folder> <out.shard>")
+    write_shard(ImageFolder(sys.argv[1]), sys.argv[2])
\ No newline at end of file
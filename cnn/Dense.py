@@ -4,7 +4,7 @@ from cnn.Tensor import Tensor
 
 
 class Dense:
-    def __init__(self, din, dout, softmax=False, lr=0.01, random_seed=1):
+    def __init__(self, din, dout, softmax=False, lr=0.01, random_seed=1, W=None, b=None):
         self.din = din
         self.dout = dout
         self.softmax = softmax
@@ -15,8 +15,9 @@ class Dense:
 
         scale = math.sqrt(1.0 / din)
 
-        self.W = Tensor([gauss(0.0, scale) for _ in range(din * dout)], (din, dout))
-        self.b = Tensor.zeros((dout,))
+        # W/b given when loading a saved model, random init otherwise
+        self.W = W if W is not None else Tensor([gauss(0.0, scale) for _ in range(din * dout)], (din, dout))
+        self.b = b if b is not None else Tensor.zeros((dout,))
 
         self.dW = Tensor.zeros((din, dout))
         self.db = Tensor.zeros((dout,))
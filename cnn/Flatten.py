@@ -9,24 +9,24 @@ class Flatten:
         pass
 
     def forward(self, x, train=True):
-        if len(x.shape) != 3:
-            raise ValueError("Flatten.forward expects x shape (C, H, W)")
+        if len(x.shape) not in (3, 4):
+            raise ValueError("Flatten.forward expects x shape (C, H, W) or (N, C, H, W)")
 
-        C, H, W = x.shape
+        C, H, W = x.shape[-3:]
         if train:
             self.orig_shape = x.shape
 
-        return x.reshape((C * H * W,))
+        return x.reshape((*x.shape[:-3], C * H * W))
 
     def backward(self, dy):
         if self.orig_shape is None:
             raise RuntimeError("Must call forward(train=True) before backward")
 
-        C, H, W = self.orig_shape
-        if dy.shape != (C * H * W,):
+        C, H, W = self.orig_shape[-3:]
+        if dy.shape != (*self.orig_shape[:-3], C * H * W):
             raise ValueError("Flatten.backward shape mismatch")
 
-        return dy.reshape((C, H, W))
+        return dy.reshape(self.orig_shape)
 
     def step(self):
         pass
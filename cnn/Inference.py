@@ -0,0 +1,173 @@
+from array import array
+
+import c_cnn.Activation
+import c_cnn.Convolve
+import c_cnn.Dense
+import c_cnn.Pooling
+import cnn.Activation
+import cnn.Convolve
+import cnn.Dense
+import cnn.Pooling
+from c_cnn.c_extension import cnn as kernels
+from cnn.CNN import CNN
+from cnn.Flatten import Flatten
+from cnn.Tensor import Tensor
+
+# the C-backed and pure-Python layers share attributes and math, the plan runs both through C
+CONVOLVE = (c_cnn.Convolve.Convolve, cnn.Convolve.Convolve)
+POOLING = (c_cnn.Pooling.Pooling, cnn.Pooling.Pooling)
+DENSE = (c_cnn.Dense.Dense, cnn.Dense.Dense)
+RELU = (c_cnn.Activation.ReLU, cnn.Activation.ReLU)
+
+
+def _volume(shape):
+    n = 1
+    for s in shape:
+        n *= s
+    return n
+
+
+class InferencePlan:
+    """
+    Forward-only execution plan compiled from a CNN.
+
+    Output shapes are worked out once for samples of `input_shape`, and activations live in
+    two preallocated buffers of the model's dtype used ping-pong. Convolve [+ ReLU] [+ Pooling]
+    runs as one fused C call, Flatten is free and Dense writes straight into the next buffer,
+    so run() allocates no Tensors or arrays. Layers without a kernel here fall back to
+    forward(train=False).
+
+    The plan reads the model's W/b buffers in place: in-place training updates are picked up,
+    replacing a layer's W/b Tensor is not. Buffers are shared between calls, so a plan is not
+    thread-safe (use one per thread) and run() output is overwritten by the next call.
+
+        plan = InferencePlan(model, (1, 32, 32))
+        probs = plan.predict(x)
+    """
+
+    def __init__(self, model, input_shape, batch_size=1):
+        if batch_size < 1:
+            raise ValueError("batch_size must be >= 1")
+
+        self.model = model
+        self.input_shape = tuple(input_shape)
+        self.batch_size = batch_size
+
+        # ops: (kind, layer(s), per-sample output shape)
+        self.ops = []
+        shape = self.input_shape
+        max_volume = _volume(shape)
+
+        # fused training layers are re-planned from their parts
+        layers = CNN._unfused(model.layers)
+        i = 0
+        while i < len(layers):
+            layer = layers[i]
+
+            if isinstance(layer, CONVOLVE) and len(shape) == 3:
+                relu = i + 1 < len(layers) and isinstance(layers[i + 1], RELU)
+                j = i + 2 if relu else i + 1
+                pool = layers[j] if j < len(layers) and isinstance(layers[j], POOLING) else None
+
+                C, H, W = shape
+                shape = (layer.cout, H - layer.kh + 1, W - layer.kw + 1)
+                if pool is not None:
+                    C, H, W = shape
+                    shape = (C, (H - pool.ph) // pool.stride + 1, (W - pool.pw) // pool.stride + 1)
+                    j += 1
+
+                self.ops.append(("conv", (layer, relu, pool), shape))
+                i = j
+            elif isinstance(layer, Flatten):
+                shape = (_volume(shape),)
+                self.ops.append(("reshape", layer, shape))
+                i += 1
+            elif isinstance(layer, DENSE) and not layer.softmax and len(shape) == 1:
+                shape = (layer.dout,)
+                self.ops.append(("dense", layer, shape))
+                i += 1
+            else:
+                y = layer.forward(Tensor.zeros((1, *shape), model.dtype), train=False)
+                shape = y.shape[1:]
+                self.ops.append(("layer", layer, shape))
+                i += 1
+
+            max_volume = max(max_volume, _volume(shape))
+
+        self.output_shape = shape
+
+        self.dtype = model.dtype
+        self._bufs = [array(self.dtype, [0.0]) * (batch_size * max_volume) for _ in range(2)]
+        self._views = [memoryview(b) for b in self._bufs]
+        self._n_in = _volume(self.input_shape)
+        self._plans = {}  # n -> (calls, output Tensor (n, ...), output Tensor for a single sample)
+
+    def _compile(self, n):
+        """bind every op to its buffers and argument tuple for a batch of n samples"""
+        calls = []
+        src = 0
+        shape = self.input_shape
+
+        for kind, layer, out_shape in self.ops:
+            if kind == "reshape":
+                shape = out_shape
+                continue
+
+            dst = 1 - src
+            x = Tensor(self._bufs[src], (n, *shape))
+
+            if kind == "conv":
+                conv, relu, pool = layer
+                if pool is None:
+                    pool_args = ("none", 1, 1, 1)
+                else:
+                    pool_args = (pool.mode, pool.ph, pool.pw, pool.stride)
+
+                calls.append((kernels.conv_relu_pool_forward,
+                              (*x.args(), *conv.W.args(), *conv.b.args(), conv.cout, conv.kh, conv.kw,
+                               getattr(conv, "algo", "direct"), relu, *pool_args, self._views[dst], 0)))
+            elif kind == "dense":
+                calls.append((kernels.dense_forward_batch,
+                              (*x.args(), *layer.W.args(), *layer.b.args(), layer.din, layer.dout,
+                               self._views[dst], 0)))
+            else:
+                calls.append((InferencePlan._run_layer, (layer, x, self._views[dst])))
+
+            src = dst
+            shape = out_shape
+
+        out = Tensor(self._bufs[src], (n, *shape))
+        return calls, out, Tensor(self._bufs[src], shape)
+
+    @staticmethod
+    def _run_layer(layer, x, dst):
+        y = layer.forward(x, train=False)
+        kernels.cast(y.data, y.offset, dst, 0, y.volume())
+
+    def run(self, x):
+        """
+        x: Tensor input_shape or (n, *input_shape) with n <= batch_size
+        returns: logits Tensor (D,) or (n, D), a view of the plan's buffer
+        """
+        batched = len(x.shape) == len(self.input_shape) + 1
+        if tuple(x.shape[batched:]) != self.input_shape:
+            raise ValueError(f"InferencePlan expects x shape {self.input_shape} or (n, *{self.input_shape})")
+        n = x.shape[0] if batched else 1
+        if n > self.batch_size:
+            raise ValueError(f"batch of {n} exceeds the plan's batch_size={self.batch_size}")
+
+        plan = self._plans.get(n)
+        if plan is None:
+            plan = self._plans[n] = self._compile(n)
+        calls, out, single = plan
+
+        # converted to the model's dtype on the way in
+        kernels.cast(x.data, x.offset, self._views[0], 0, n * self._n_in)
+        for fn, args in calls:
+            fn(*args)
+
+        return out if batched else single
+
+    def predict(self, x):
+        """softmax probabilities as a list, like CNN.predict"""
+        return list(c_cnn.Dense.Dense.softmax(self.run(x)).data)
\ No newline at end of file
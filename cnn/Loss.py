@@ -4,6 +4,13 @@ from cnn.Tensor import Tensor
 
 
 class CrossEntropyLoss:
+    """
+    Softmax + cross entropy on raw logits.
+
+    pred (K,) with an int label, or pred (N, K) with N labels. For a batch the
+    loss (and so the gradient) is the mean over the N rows.
+    """
+
     def __init__(self, eps=1e-12):
         self.eps = eps
 
@@ -12,41 +19,65 @@ class CrossEntropyLoss:
         self.K = None
 
     def forward(self, pred, y_true):
-        K = pred.shape[0]
+        batched = len(pred.shape) == 2
+        N = pred.shape[0] if batched else 1
+        K = pred.shape[-1]
 
-        self.y_true = int(y_true)
+        self.y_true = [int(y) for y in y_true] if batched else int(y_true)
         self.K = K
 
-        m = -float("inf")
-        for j in range(K):
-            v = pred.item((j,))
-            if v > m:
-                m = v
+        labels = self.y_true if batched else [self.y_true]
+        if len(labels) != N:
+            raise ValueError("CrossEntropyLoss.forward expects one label per row of pred")
+
+        probs = Tensor.zeros(pred.shape)
+        pdata = pred.data
+        sk = pred.strides[-1]
+        sn = pred.strides[0] if batched else 0
+
+        total = 0.0
+        for n in range(N):
+            base = pred.offset + n * sn
+            row = n * K
 
-        s = 0.0
-        for j in range(K):
-            s += math.exp(pred.item((j,)) - m)
+            m = -float("inf")
+            for j in range(K):
+                v = pdata[base + j * sk]
+                if v > m:
+                    m = v
 
-        probs = Tensor.zeros((K,))
-        p_y = 0.0
-        for j in range(K):
-            p = math.exp(pred.item((j,)) - m) / s
-            probs[(j,)] = p
-            if j == self.y_true:
-                p_y = p
+            s = 0.0
+            for j in range(K):
+                s += math.exp(pdata[base + j * sk] - m)
+
+            p_y = 0.0
+            for j in range(K):
+                p = math.exp(pdata[base + j * sk] - m) / s
+                probs.data[row + j] = p
+                if j == labels[n]:
+                    p_y = p
+
+            total += -math.log(max(p_y, self.eps))
 
         self.probs = probs
-        return -math.log(max(p_y, self.eps))
+        return total / N
 
     def backward(self):
         K = self.K
-        dp = Tensor.zeros((K,))
+        dp = Tensor.zeros(self.probs.shape)
+
+        batched = len(self.probs.shape) == 2
+        labels = self.y_true if batched else [self.y_true]
+        N = len(labels)
+        inv = 1.0 / N
 
-        for j in range(K):
-            v = self.probs.item((j,))
-            if j == self.y_true:
-                v -= 1.0
-            dp[(j,)] = v
+        for n in range(N):
+            row = n * K
+            for j in range(K):
+                v = self.probs.data[row + j]
+                if j == labels[n]:
+                    v -= 1.0
+                dp.data[row + j] = v * inv
         return dp
 
     def __str__(self):
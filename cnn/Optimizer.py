@@ -0,0 +1,87 @@
+from array import array
+
+from c_cnn.c_extension import cnn
+
+
+def parameters(layers):
+    """(layer, param, grad) for every trainable Tensor, W then b per layer in layer order"""
+    for layer in layers:
+        if hasattr(layer, "W") and hasattr(layer, "b"):
+            yield layer, layer.W, layer.dW
+            yield layer, layer.b, layer.db
+
+
+class Optimizer:
+    """
+    Base for the optimizers CNN.step() can use instead of each layer's own step().
+
+    State lives in flat arrays of the parameters' dtype, one per parameter Tensor in
+    parameters() order, created on the first step. Each parameter is updated by a single C call over its
+    contiguous data. lr=None uses each layer's own lr, as layer.step() does.
+    """
+
+    # per-parameter state buffers the subclass keeps, e.g. ("m", "v")
+    STATE = ()
+
+    def __init__(self, lr=None):
+        self.lr = lr
+        self.t = 0  # steps taken
+        self.state = []  # per parameter: {name: array of the parameter's dtype}
+
+    def _states(self, params):
+        if len(self.state) != len(params):
+            self.state = [{name: array(p.dtype, [0.0]) * p.volume() for name in self.STATE} for _, p, _ in params]
+        return self.state
+
+    def astype(self, dtype):
+        """convert the state buffers along with the parameters (see CNN.astype)"""
+        self.state = [{name: array(dtype, buf) for name, buf in state.items()} for state in self.state]
+
+    def step(self, layers):
+        params = list(parameters(layers))
+        self.t += 1
+        for (layer, p, g), state in zip(params, self._states(params)):
+            self.update(p, g, state, self.lr if self.lr is not None else layer.lr)
+
+    def update(self, p, g, state, lr):
+        raise NotImplementedError
+
+
+class SGD(Optimizer):
+    """p -= lr * g, or with momentum: v = momentum * v + g; p -= lr * v"""
+
+    def __init__(self, lr=None, momentum=0.0):
+        super().__init__(lr)
+        self.momentum = momentum
+        self.STATE = ("v",) if momentum else ()
+
+    def update(self, p, g, state, lr):
+        if self.momentum:
+            cnn.sgd_update(p.data, p.offset, g.data, g.offset, p.volume(), lr, state["v"], 0, self.momentum)
+        else:
+            cnn.sgd_update(p.data, p.offset, g.data, g.offset, p.volume(), lr)
+
+    def __str__(self):
+        return f"SGD({self.lr}, momentum={self.momentum})"
+
+
+class Momentum(SGD):
+    def __init__(self, lr=None, momentum=0.9):
+        super().__init__(lr, momentum)
+
+
+class Adam(Optimizer):
+    STATE = ("m", "v")
+
+    def __init__(self, lr=0.001, beta1=0.9, beta2=0.999, eps=1e-8):
+        super().__init__(lr)
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.eps = eps
+
+    def update(self, p, g, state, lr):
+        cnn.adam_update(p.data, p.offset, g.data, g.offset, state["m"], 0, state["v"], 0, p.volume(), lr,
+                        self.beta1, self.beta2, self.eps, self.t)
+
+    def __str__(self):
+        return f"Adam({self.lr}, beta1={self.beta1}, beta2={self.beta2}, eps={self.eps})"
\ No newline at end of file
@@ -0,0 +1,213 @@
+import multiprocessing as mp
+import os
+from random import Random
+
+from c_cnn.c_extension import cnn
+from cnn.CNN import CNN, _Inputs
+from cnn.Tensor import Tensor
+
+
+def _as_view(raw):
+    """flat memoryview over a multiprocessing RawArray('d' or 'f', ...) in its own dtype"""
+    view = memoryview(raw)
+    return view.cast('B').cast(view.format[-1])
+
+
+class _Replica:
+    """
+    One rank of the data-parallel group: a model copy plus views onto the shared buffers.
+
+    Every step each rank runs forward/backward on its shard of the global batch and writes
+    its gradients (weighted by shard size) into its own slot. The ranks then reduce disjoint
+    partitions of the flat gradient vector across all slots, always in slot order 0..W-1,
+    copy the reduced vector into dW/db and call step(). All ranks apply the same update,
+    so the replicas stay bit-identical without ever broadcasting parameters.
+    """
+
+    def __init__(self, rank, workers, model, x_raw, x_shape, y_train, slots, reduced, stats, barrier):
+        self.rank = rank
+        self.workers = workers
+        self.model = model
+
+        self.x_train = Tensor(_as_view(x_raw), x_shape)
+        self.y_train = y_train
+        self.inputs = _Inputs(self.x_train)
+
+        self.slots = _as_view(slots)
+        self.reduced = _as_view(reduced)
+        self.stats = _as_view(stats)
+        self.barrier = barrier
+
+        # flat layout of every gradient buffer: (tensor, offset into the flat vector)
+        self.grads = []
+        n = 0
+        for layer in model.layers:
+            if hasattr(layer, "W") and hasattr(layer, "b"):
+                for t in (layer.dW, layer.db):
+                    self.grads.append((t, n))
+                    n += t.volume()
+        self.n_params = n
+
+    def run_epoch(self, idxs, batch_size):
+        P, W, rank = self.n_params, self.workers, self.rank
+        slot = rank * P
+        part_lo, part_hi = P * rank // W, P * (rank + 1) // W
+
+        total_loss = 0.0
+        total_correct = 0
+
+        for start in range(0, len(idxs), batch_size):
+            batch = idxs[start: start + batch_size]
+            shard = batch[len(batch) * rank // W: len(batch) * (rank + 1) // W]
+
+            self.model.zero_grad()
+            if shard:
+                xb, yb = CNN._gather(self.x_train, self.y_train, shard, True, self.inputs)
+
+                logits = self.model.forward(xb, train=True)
+                loss = self.model.loss_fn.forward(logits, yb)
+                self.model.backward(self.model.loss_fn.backward())
+
+                for pred, y in zip(CNN._argmax_rows(logits), yb):
+                    if pred == y:
+                        total_correct += 1
+                total_loss += loss * len(shard)
+
+            # shard mean -> this shard's share of the global batch mean
+            weight = len(shard) / len(batch)
+            for t, off in self.grads:
+                cnn.axpby(weight, t.data, t.offset, 0.0, self.slots, slot + off, t.volume())
+
+            self.barrier.wait()
+
+            # reduce my partition over all slots, fixed order for determinism
+            if part_hi > part_lo:
+                for w in range(W):
+                    cnn.axpby(1.0, self.slots, w * P + part_lo, 1.0 if w else 0.0, self.reduced, part_lo,
+                              part_hi - part_lo)
+
+            self.barrier.wait()
+
+            for t, off in self.grads:
+                cnn.axpby(1.0, self.reduced, off, 0.0, t.data, t.offset, t.volume())
+            self.model.step()
+
+        self.stats[2 * rank] = total_loss
+        self.stats[2 * rank + 1] = total_correct
+        self.barrier.wait()
+
+
+def _worker(rank, workers, model, x_raw, x_shape, y_train, slots, reduced, stats, barrier, conn):
+    replica = _Replica(rank, workers, model, x_raw, x_shape, y_train, slots, reduced, stats, barrier)
+    try:
+        while True:
+            msg = conn.recv()
+            if msg is None:
+                break
+            idxs, batch_size = msg
+            replica.run_epoch(idxs, batch_size)
+    except BaseException:
+        barrier.abort()
+        raise
+
+
+class DataParallel:
+    """
+    Multi-process data-parallel training for a CNN.
+
+    Each of `workers` processes holds a replica of `model`; the calling process is rank 0
+    and trains `model` itself. The training set is copied once into shared memory.
+    Every step the global batch (batch_size samples of the shuffled idxs) is split into
+    one contiguous shard per rank, and gradients are summed through shared memory before
+    step(). Results depend only on random_seed, batch_size and workers.
+
+    Replicas are started with the default multiprocessing start method, so scripts using
+    this on spawn platforms (Windows/macOS) need an `if __name__ == "__main__":` guard.
+
+        with DataParallel(model, x_train, y_train, workers=8, batch_size=64) as dp:
+            for epoch in range(50):
+                loss, acc = dp.train_epoch()
+    """
+
+    def __init__(self, model, x_train, y_train, workers=None, batch_size=32, random_seed=None):
+        N, H, W = x_train.shape
+        if len(y_train) != N:
+            raise ValueError("x_train first dim must equal len(y_train)")
+        if batch_size < 1:
+            raise ValueError("batch_size must be >= 1")
+
+        self.model = model
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.n = N
+        self.rng = Random(model.random_seed if random_seed is None else random_seed)
+
+        ctx = mp.get_context()
+
+        # samples and gradients are shared in the model's dtype
+        dtype = model.dtype
+        x_raw = ctx.RawArray(dtype, N * H * W)
+        cnn.cast(x_train.data, x_train.offset, _as_view(x_raw), 0, N * H * W)
+        y_train = [int(y) for y in y_train]
+
+        n_params = 0
+        for layer in model.layers:
+            if hasattr(layer, "W") and hasattr(layer, "b"):
+                n_params += layer.dW.volume() + layer.db.volume()
+
+        slots = ctx.RawArray(dtype, self.workers * n_params)
+        reduced = ctx.RawArray(dtype, n_params)
+        stats = ctx.RawArray('d', 2 * self.workers)
+        barrier = ctx.Barrier(self.workers)
+
+        self._stats = _as_view(stats)
+        self._barrier = barrier
+        self._conns = []
+        self._procs = []
+        for rank in range(1, self.workers):
+            parent, child = ctx.Pipe()
+            p = ctx.Process(target=_worker, daemon=True,
+                            args=(rank, self.workers, model, x_raw, (N, H, W), y_train, slots, reduced, stats,
+                                  barrier, child))
+            p.start()
+            child.close()
+            self._conns.append(parent)
+            self._procs.append(p)
+
+        self._replica = _Replica(0, self.workers, model, x_raw, (N, H, W), y_train, slots, reduced, stats, barrier)
+
+    def train_epoch(self):
+        """One pass over the training set; returns (mean loss, accuracy) like CNN.train_epoch."""
+        idxs = list(range(self.n))
+        self.rng.shuffle(idxs)
+
+        for conn in self._conns:
+            conn.send((idxs, self.batch_size))
+
+        try:
+            self._replica.run_epoch(idxs, self.batch_size)
+        except BaseException:
+            self._barrier.abort()
+            raise
+
+        total_loss = sum(self._stats[2 * r] for r in range(self.workers))
+        total_correct = sum(self._stats[2 * r + 1] for r in range(self.workers))
+        return total_loss / max(1, self.n), total_correct / max(1, self.n)
+
+    def close(self):
+        for conn in self._conns:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for p in self._procs:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+        self._conns, self._procs = [], []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,278 @@
+import argparse
+import asyncio
+import gc
+import multiprocessing as mp
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+from array import array
+
+from c_cnn.c_extension import cnn as kernels
+from cnn.CNN import CNN
+from cnn.Server import Server
+
+MODEL_EXTS = (".mw", ".mwb")
+
+# POSIX shared memory as files: mapped by every worker, gone once unlinked and unmapped
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+def _source(path):
+    """the model file path stands for: itself, or the newest .mw / .mwb file in a directory"""
+    if not os.path.isdir(path):
+        return path
+    files = [os.path.join(path, f) for f in os.listdir(path) if f.endswith(MODEL_EXTS)]
+    if not files:
+        raise FileNotFoundError(f"{path}: no .mw / .mwb model files")
+    return max(files, key=lambda f: (os.stat(f).st_mtime_ns, f))
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return path, st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def _attach(segment, server_args):
+    """the model in a segment, parameters mapped read-only, with the plan the Server runs already compiled"""
+    model = CNN.from_mwb(segment, writable=False)
+    input_shape = server_args["input_shape"]
+    n_in = 1
+    for s in input_shape:
+        n_in *= s
+    model.predict_batch(array(model.dtype, [0.0]) * n_in, server_args["k"], server_args["max_batch"], input_shape)
+    return model
+
+
+class Prefork:
+    """
+    Pre-fork serving: one model in shared memory, `workers` processes serving it.
+
+    The parent loads the model file once and writes it as a .mwb image into a shared memory
+    segment, then forks workers that share one listening socket; the kernel spreads incoming
+    connections over them. Each worker maps the segment read-only (CNN.from_mwb(writable=False))
+    and runs a cnn.Server on it, so the parameters are in memory once however many workers run.
+
+    The parent polls the model path: when the file changes, or a newer .mw / .mwb file appears
+    in it if it is a directory, the new model is loaded into a fresh segment and every worker
+    swaps to it between two batches, without dropping connections. A file that fails to load
+    (e.g. still being written) is skipped until it changes again; write the file beside its
+    final name and rename it into place to avoid that. Workers that die are restarted.
+
+        python -m cnn.Prefork models/ --workers 4 --port 8000
+
+    Unix only (fork).
+    """
+
+    def __init__(self, path, workers=None, host="127.0.0.1", port=8000, poll_s=1.0, max_batch=32, max_wait_ms=2.0,
+                 k=5, input_shape=(1, 32, 32)):
+        self.path = path
+        self.workers = workers or os.cpu_count() or 1
+        self.host = host
+        self.port = port
+        self.poll_s = poll_s
+        self.server_args = {"max_batch": max_batch, "max_wait_ms": max_wait_ms, "k": k,
+                            "input_shape": tuple(input_shape)}
+
+        self.sock = None
+        self.segment = None  # shared memory file of the model being served
+        self.stamp = None  # _stamp() of the model file it was loaded from
+        self.failed = None  # _stamp() of the last file that failed to load
+        self.reloads = 0
+        self._procs = []  # [(process, control connection)]
+        self._stopping = False
+
+    # ---------------------------------------------------------------------
+    # Shared model
+    # ---------------------------------------------------------------------
+
+    def _publish(self, source):
+        """load source into a new segment; returns its path"""
+        model = CNN.from_mwb(source) if source.endswith(".mwb") else CNN.from_mw(source)
+        fd, segment = tempfile.mkstemp(prefix="cnn-model-", suffix=".mwb", dir=SHM_DIR)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                CNN._write_mwb(model, f)
+        except BaseException:
+            os.unlink(segment)
+            raise
+        return segment
+
+    def poll(self):
+        """swap the workers to the model file if it changed; returns True on a swap"""
+        try:
+            stamp = _stamp(_source(self.path))
+        except OSError:
+            return False
+        if stamp == self.stamp or stamp == self.failed:
+            return False
+
+        try:
+            segment = self._publish(stamp[0])
+        except Exception as e:
+            self.failed = stamp
+            print(f"cnn.Prefork: not reloading {stamp[0]}: {e}", file=sys.stderr)
+            return False
+
+        for proc, conn in self._procs:
+            try:
+                conn.send(segment)
+            except OSError:
+                pass  # died, restarted on the new segment by _reap
+        for proc, conn in self._procs:
+            try:
+                reply = conn.recv() if conn.poll(30.0) else TimeoutError("no reply")
+            except (OSError, EOFError):
+                continue
+            if isinstance(reply, Exception):
+                print(f"cnn.Prefork: worker {proc.pid} kept the old model: {reply!r}", file=sys.stderr)
+
+        # workers that attached keep their mapping, the name goes away now
+        old, self.segment, self.stamp = self.segment, segment, stamp
+        os.unlink(old)
+        self.reloads += 1
+        print(f"cnn.Prefork: serving {stamp[0]}", file=sys.stderr)
+        return True
+
+    # ---------------------------------------------------------------------
+    # Workers
+    # ---------------------------------------------------------------------
+
+    def _spawn(self):
+        parent, child = mp.get_context("fork").Pipe()
+        proc = mp.get_context("fork").Process(target=_worker, daemon=True,
+                                              args=(self.sock, child, self.segment, self.server_args, os.getpid()))
+        proc.start()
+        child.close()
+        return proc, parent
+
+    def _reap(self):
+        for i, (proc, conn) in enumerate(self._procs):
+            if not proc.is_alive() and not self._stopping:
+                print(f"cnn.Prefork: worker {proc.pid} exited ({proc.exitcode}), restarting", file=sys.stderr)
+                conn.close()
+                self._procs[i] = self._spawn()
+
+    def start(self):
+        """load the model, listen and fork the workers; returns the bound (host, port)"""
+        source = _source(self.path)
+        self.stamp = _stamp(source)
+        self.segment = self._publish(source)
+
+        self.sock = socket.create_server((self.host, self.port), backlog=1024)
+        self.sock.setblocking(False)
+        self._procs = [self._spawn() for _ in range(self.workers)]
+        return self.sock.getsockname()[:2]
+
+    def run(self):
+        """start(), then poll for new models until SIGINT / SIGTERM"""
+        def stop(signum, frame):
+            self._stopping = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        host, port = self.start()
+        print(f"cnn.Prefork: {self.workers} workers serving {self.stamp[0]} on http://{host}:{port}", file=sys.stderr)
+        try:
+            while not self._stopping:
+                time.sleep(self.poll_s)
+                self._reap()
+                self.poll()
+        finally:
+            self.close()
+
+    def close(self):
+        self._stopping = True
+        for proc, conn in self._procs:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+        for proc, conn in self._procs:
+            proc.join(5.0)
+            if proc.is_alive():
+                proc.terminate()
+                proc.join()
+            conn.close()
+        self._procs = []
+
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        if self.segment is not None:
+            os.unlink(self.segment)
+            self.segment = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _worker(sock, conn, segment, server_args, parent_pid):
+    # the parent handles ^C / SIGTERM and stops the workers through conn
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    asyncio.run(_serve(sock, conn, segment, server_args, parent_pid))
+
+
+async def _serve(sock, conn, segment, server_args, parent_pid):
+    loop = asyncio.get_running_loop()
+    server = Server(_attach(segment, server_args), **server_args)
+    await server.start(sock=sock)
+    stopped = loop.create_future()
+
+    def control():
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            msg = None
+        if msg is None:
+            if not stopped.done():
+                stopped.set_result(None)
+            return
+
+        try:
+            server.swap(_attach(msg, server_args))
+            gc.collect()  # unmap the old model now rather than at some later collection
+            conn.send(msg)
+        except Exception as e:
+            conn.send(e)
+
+    async def orphaned():
+        # a killed parent never sends None, and siblings forked later hold copies of conn's other end
+        while os.getppid() == parent_pid:
+            await asyncio.sleep(1.0)
+        if not stopped.done():
+            stopped.set_result(None)
+
+    loop.add_reader(conn.fileno(), control)
+    watchdog = loop.create_task(orphaned())
+    try:
+        await stopped
+    finally:
+        watchdog.cancel()
+        loop.remove_reader(conn.fileno())
+        await server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="pre-fork inference server, see cnn.Prefork.Prefork")
+    parser.add_argument("path", help=".mw / .mwb model file, or a directory to serve the newest one of")
+    parser.add_argument("--workers", type=int, default=None, help="default: one per CPU")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--poll", type=float, default=1.0, help="seconds between checks for a new model")
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=2.0)
+    parser.add_argument("--k", type=int, default=5, help="top classes returned per image")
+    parser.add_argument("--threads", type=int, default=1, help="cnn.set_num_threads in each worker")
+    args = parser.parse_args()
+
+    kernels.set_num_threads(args.threads)
+    Prefork(args.path, args.workers, args.host, args.port, args.poll, args.max_batch, args.max_wait_ms, args.k).run()
@@ -0,0 +1,398 @@
+import json
+import os
+import sys
+import time
+from array import array
+from random import Random
+
+import c_cnn.Dense
+from c_cnn.c_extension import cnn as kernels
+from cnn.CNN import CNN, MWB_HEAD, _mwb_align
+from cnn.Flatten import Flatten
+from cnn.Inference import CONVOLVE, DENSE, POOLING, RELU, _volume
+from cnn.Tensor import Tensor
+
+# .mwq: int8 model file, laid out like .mwb (see cnn.CNN) with its own magic. The JSON header
+# holds the input scale and one entry per op; W is int8, mult and bias float64.
+MWQ_MAGIC = b"AKSHRMWQ"
+MWQ_VERSION = 1
+
+Q8_MAX = 127
+U8_MAX = 255
+
+
+def _scale(max_abs, unsigned=False):
+    """scale for values in [-max_abs, max_abs] as int8, or in [0, max_abs] as uint8"""
+    return max_abs / (U8_MAX if unsigned else Q8_MAX) if max_abs > 0.0 else 1.0
+
+
+def _activations(n, unsigned):
+    return array('B' if unsigned else 'b', bytes(n))
+
+
+def _quantize_rows(w, rows):
+    """int8 rows of a contiguous float buffer, each with its own scale -> (int8 array, scales)"""
+    cols = len(w) // rows
+    q = array('b', bytes(len(w)))
+    scales = []
+    for r in range(rows):
+        row = w[r * cols: (r + 1) * cols]
+        scale = _scale(max(map(abs, row)))
+        kernels.quantize_q8(row, 0, q, r * cols, cols, scale)
+        scales.append(scale)
+    return q, scales
+
+
+class QConv:
+    """int8 Convolve [+ ReLU] [+ Pooling]: per output channel weight scales, int32 accumulate"""
+
+    def __init__(self, cin, cout, kh, kw, W, mult, bias, relu=False, pool=("none", 1, 1, 1), out_scale=None,
+                 x_unsigned=False):
+        self.cin, self.cout, self.kh, self.kw = cin, cout, kh, kw
+        self.x_unsigned = x_unsigned  # input is uint8 (non-negative) rather than int8
+        self.W = W  # array('b') (Cout, Cin, Kh, Kw)
+        self.mult = mult  # array('d') (Cout,): x_scale * w_scale[c]
+        self.bias = bias  # array('d') (Cout,)
+        self.relu = relu
+        self.pool = tuple(pool)  # (mode, ph, pw, stride)
+        self.out_scale = out_scale  # None: float64 output, uint8 after ReLU, int8 otherwise
+
+    def out_shape(self, shape):
+        _, H, W = shape
+        H, W = H - self.kh + 1, W - self.kw + 1
+        mode, ph, pw, s = self.pool
+        if mode != "none":
+            H, W = (H - ph) // s + 1, (W - pw) // s + 1
+        return self.cout, H, W
+
+    def forward(self, x, n, shape, y):
+        _, H, W = shape
+        kernels.conv_q8_forward(x, n, self.cin, H, W, self.x_unsigned, self.W, self.cout, self.kh, self.kw,
+                                self.mult, self.bias, self.relu, *self.pool, y, self.out_scale or 0.0)
+
+
+class QDense:
+    """int8 Dense [+ ReLU]: W stored transposed (Dout, Din) with one scale per output"""
+
+    def __init__(self, din, dout, W, mult, bias, relu=False, out_scale=None, x_unsigned=False):
+        self.din, self.dout = din, dout
+        self.x_unsigned = x_unsigned
+        self.W = W  # array('b') (Dout, Din)
+        self.mult = mult
+        self.bias = bias
+        self.relu = relu
+        self.out_scale = out_scale
+
+    def out_shape(self, shape):
+        return self.dout,
+
+    def forward(self, x, n, shape, y):
+        kernels.dense_q8_forward(x, n, self.din, self.x_unsigned, self.W, self.dout, self.mult, self.bias,
+                                 self.relu, y, self.out_scale or 0.0)
+
+
+class QuantizedCNN:
+    """
+    Post-training int8 version of a CNN for inference.
+
+    Weights are int8 with one symmetric scale per output channel. Activations have one scale
+    per layer boundary, taken from the largest magnitude seen on calibration inputs, and are
+    uint8 where they can't be negative (non-negative inputs, ReLU outputs), int8 elsewhere.
+    Convolve [+ ReLU] [+ Pooling] and Dense [+ ReLU] each run as one C call that accumulates
+    in int32 and requantizes its output; the last op writes float64 logits. Flatten is free.
+
+        qmodel = QuantizedCNN.from_cnn(model, x_calibration)
+        probs = qmodel.predict(x)
+        print(compare(model, qmodel, x_test, y_test))
+    """
+
+    def __init__(self, ops, input_scale, softmax=False):
+        self.ops = ops  # QConv / QDense / Flatten
+        self.input_scale = input_scale  # the input is quantized to the first op's x_unsigned type
+        self.softmax = softmax  # the last Dense had softmax=True
+
+    @staticmethod
+    def _groups(model):
+        """the model's layers grouped into ops: [(kind, [layers])]"""
+        layers = CNN._unfused(model.layers)
+        groups = []
+        i = 0
+        while i < len(layers):
+            layer = layers[i]
+            if isinstance(layer, CONVOLVE):
+                j = i + 1
+                if j < len(layers) and isinstance(layers[j], RELU):
+                    j += 1
+                if j < len(layers) and isinstance(layers[j], POOLING):
+                    j += 1
+                groups.append(("conv", layers[i:j]))
+            elif isinstance(layer, DENSE):
+                j = i + 1
+                if j < len(layers) and isinstance(layers[j], RELU) and not layer.softmax:
+                    j += 1
+                groups.append(("dense", layers[i:j]))
+            elif isinstance(layer, Flatten):
+                j = i + 1
+                groups.append(("flatten", [layer]))
+            else:
+                raise ValueError(f"QuantizedCNN cannot quantize layer {layer}")
+            i = j
+
+        for k, (kind, group) in enumerate(groups):
+            if kind == "dense" and group[0].softmax and k != len(groups) - 1:
+                raise ValueError("QuantizedCNN: only the last Dense may apply softmax")
+        return groups
+
+    @staticmethod
+    def calibrate(model, x, samples=256, batch_size=32, random_seed=1):
+        """
+        Smallest and largest input value and largest |value| after every op, over up to
+        `samples` inputs of x (an (N, H, W) Tensor or a cnn.Data dataset), run through the
+        float model -> (in_min, in_max, [out_max per op])
+        """
+        groups = QuantizedCNN._groups(model)
+        idxs = list(range(CNN._count(x)))
+        Random(random_seed).shuffle(idxs)
+        idxs = idxs[:samples]
+        labels = [0] * CNN._count(x)
+
+        in_min = in_max = 0.0
+        out_max = [0.0] * len(groups)
+        for start in range(0, len(idxs), batch_size):
+            xb, _ = CNN._gather(x, labels, idxs[start: start + batch_size], True)
+            xb = xb.astype(model.dtype)
+            batch = xb.data[xb.offset: xb.offset + xb.volume()]
+            in_min = min(in_min, min(batch))
+            in_max = max(in_max, max(map(abs, batch)))
+            for k, (kind, group) in enumerate(groups):
+                for layer in group:
+                    xb = layer.forward(xb, train=False)
+                if kind != "flatten":
+                    out_max[k] = max(out_max[k], max(map(abs, xb.data[xb.offset: xb.offset + xb.volume()])))
+        return in_min, in_max, out_max
+
+    @staticmethod
+    def from_cnn(model, x, samples=256, batch_size=32, random_seed=1):
+        """quantize a trained model, calibrating activation scales on samples of x (see calibrate)"""
+        groups = QuantizedCNN._groups(model)
+        in_min, in_max, out_max = QuantizedCNN.calibrate(model, x, samples, batch_size, random_seed)
+
+        x_unsigned = in_min >= 0.0
+        x_scale = input_scale = _scale(in_max, x_unsigned)
+        last = max(k for k, (kind, _) in enumerate(groups) if kind != "flatten")
+        ops = []
+        for k, (kind, group) in enumerate(groups):
+            if kind == "flatten":
+                ops.append(group[0])
+                continue
+
+            layer = group[0]
+            relu = any(isinstance(l, RELU) for l in group)
+            out_scale = None if k == last else _scale(out_max[k], relu)
+            W = layer.W.data[layer.W.offset: layer.W.offset + layer.W.volume()]
+            bias = array('d', layer.b.data[layer.b.offset: layer.b.offset + layer.b.volume()])
+
+            if kind == "conv":
+                q, scales = _quantize_rows(W, layer.cout)
+                mult = array('d', [x_scale * s for s in scales])
+                pool = group[-1]
+                pool = (pool.mode, pool.ph, pool.pw, pool.stride) if isinstance(pool, POOLING) else ("none", 1, 1, 1)
+                ops.append(QConv(layer.cin, layer.cout, layer.kh, layer.kw, q, mult, bias, relu, pool, out_scale,
+                                 x_unsigned))
+            else:
+                # (Din, Dout) -> (Dout, Din): each output is one contiguous dot product
+                Wt = array(W.typecode if isinstance(W, array) else W.format,
+                           [W[i * layer.dout + o] for o in range(layer.dout) for i in range(layer.din)])
+                q, scales = _quantize_rows(Wt, layer.dout)
+                mult = array('d', [x_scale * s for s in scales])
+                ops.append(QDense(layer.din, layer.dout, q, mult, bias, relu, out_scale, x_unsigned))
+
+            x_scale, x_unsigned = out_scale, relu
+
+        return QuantizedCNN(ops, input_scale, groups[last][1][0].softmax if groups[last][0] == "dense" else False)
+
+    def forward(self, x):
+        """
+        x: Tensor (Cin, H, W) or (N, Cin, H, W), float64 or float32
+        returns: float64 logits Tensor (D,) or (N, D)
+        """
+        batched = len(x.shape) == 4
+        n = x.shape[0] if batched else 1
+        shape = tuple(x.shape[batched:])
+
+        first = next(op for op in self.ops if not isinstance(op, Flatten))
+        src = _activations(x.volume(), first.x_unsigned)
+        kernels.quantize_q8(x.data, x.offset, src, 0, x.volume(), self.input_scale, first.x_unsigned)
+
+        for op in self.ops:
+            if isinstance(op, Flatten):
+                shape = (_volume(shape),)
+                continue
+
+            out_shape = op.out_shape(shape)
+            if op.out_scale is None:
+                dst = array('d', bytes(8 * n * _volume(out_shape)))
+            else:
+                dst = _activations(n * _volume(out_shape), op.relu)
+            op.forward(src, n, shape, dst)
+            src, shape = dst, out_shape
+
+        y = Tensor(src, (n, *shape) if batched else shape)
+        if self.softmax:
+            y = c_cnn.Dense.Dense.softmax(y)
+        return y
+
+    def predict(self, x):
+        """softmax probabilities as a list, like CNN.predict"""
+        return list(c_cnn.Dense.Dense.softmax(self.forward(x)).data)
+
+    def nbytes(self):
+        """size of the parameters"""
+        n = 0
+        for op in self.ops:
+            if not isinstance(op, Flatten):
+                n += len(op.W) + 8 * (len(op.mult) + len(op.bias))
+        return n
+
+    def save(self, filename):
+        """write the model as a .mwq file (written beside filename, then renamed into place)"""
+        entries = []
+        blobs = []
+        offset = 0
+        for op in self.ops:
+            if isinstance(op, Flatten):
+                entries.append({"kind": "flatten"})
+                continue
+
+            if isinstance(op, QConv):
+                entry = {"kind": "conv", "cin": op.cin, "cout": op.cout, "kh": op.kh, "kw": op.kw,
+                         "pool": list(op.pool)}
+            else:
+                entry = {"kind": "dense", "din": op.din, "dout": op.dout}
+            entry.update({"relu": op.relu, "out_scale": op.out_scale, "x_unsigned": op.x_unsigned, "params": {}})
+
+            for name in ("W", "mult", "bias"):
+                blob = getattr(op, name)
+                if sys.byteorder != "little":
+                    blob = array(blob.typecode, blob)
+                    blob.byteswap()
+                entry["params"][name] = {"dtype": blob.typecode, "length": len(blob), "offset": offset}
+                blobs.append((offset, blob))
+                offset = _mwb_align(offset + len(blob) * blob.itemsize)
+            entries.append(entry)
+
+        header = json.dumps({"input_scale": self.input_scale, "softmax": self.softmax,
+                             "ops": entries}).encode("utf-8")
+        base = _mwb_align(MWB_HEAD.size + len(header))
+
+        tmp = filename + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(MWB_HEAD.pack(MWQ_MAGIC, MWQ_VERSION, len(header)))
+            f.write(header)
+            for off, blob in blobs:
+                f.write(b"\0" * (base + off - f.tell()))
+                blob.tofile(f)
+        os.replace(tmp, filename)
+
+    @staticmethod
+    def load(filename):
+        with open(filename, "rb") as f:
+            raw = f.read()
+
+        if len(raw) < MWB_HEAD.size:
+            raise ValueError(f"{filename}: not a .mwq model file")
+        magic, version, header_len = MWB_HEAD.unpack_from(raw, 0)
+        if magic != MWQ_MAGIC:
+            raise ValueError(f"{filename}: not a .mwq model file")
+        if version != MWQ_VERSION:
+            raise ValueError(f"{filename}: unsupported .mwq version {version}")
+
+        header = json.loads(raw[MWB_HEAD.size: MWB_HEAD.size + header_len].decode("utf-8"))
+        base = _mwb_align(MWB_HEAD.size + header_len)
+
+        ops = []
+        for entry in header["ops"]:
+            if entry["kind"] == "flatten":
+                ops.append(Flatten())
+                continue
+
+            params = {}
+            for name, p in entry["params"].items():
+                blob = array(p["dtype"])
+                start = base + p["offset"]
+                end = start + p["length"] * blob.itemsize
+                if end > len(raw):
+                    raise ValueError("truncated .mwq file")
+                blob.frombytes(raw[start:end])
+                if sys.byteorder != "little":
+                    blob.byteswap()
+                params[name] = blob
+
+            if entry["kind"] == "conv":
+                ops.append(QConv(entry["cin"], entry["cout"], entry["kh"], entry["kw"], params["W"], params["mult"],
+                                 params["bias"], entry["relu"], entry["pool"], entry["out_scale"], entry["x_unsigned"]))
+            else:
+                ops.append(QDense(entry["din"], entry["dout"], params["W"], params["mult"], params["bias"],
+                                  entry["relu"], entry["out_scale"], entry["x_unsigned"]))
+
+        return QuantizedCNN(ops, header["input_scale"], header["softmax"])
+
+
+def compare(model, qmodel, x, y=None, batch_size=32):
+    """
+    Accuracy of the float model and its int8 version on x (an (N, H, W) Tensor with labels y,
+    or a cnn.Data dataset), with top-1 agreement, parameter sizes and time per sample.
+    """
+    if y is None:
+        y = x.labels
+    N = CNN._count(x)
+
+    float_preds, q8_preds = [], []
+    float_s = q8_s = 0.0
+    for start in range(0, N, batch_size):
+        xb, _ = CNN._gather(x, y, range(start, min(N, start + batch_size)), True)
+
+        t = time.perf_counter()
+        float_preds += CNN._argmax_rows(model.forward(xb, train=False))
+        float_s += time.perf_counter() - t
+
+        t = time.perf_counter()
+        q8_preds += CNN._argmax_rows(qmodel.forward(xb))
+        q8_s += time.perf_counter() - t
+
+    labels = [y[i] for i in range(N)]
+    float_acc = CNN._accuracy(float_preds, labels)
+    q8_acc = CNN._accuracy(q8_preds, labels)
+    float_bytes = sum(t.volume() * t.data.itemsize
+                      for layer in CNN._unfused(model.layers) if hasattr(layer, "W") for t in (layer.W, layer.b))
+
+    return {
+        "samples": N,
+        "float_accuracy": float_acc,
+        "int8_accuracy": q8_acc,
+        "accuracy_delta": q8_acc - float_acc,
+        "top1_agreement": sum(a == b for a, b in zip(float_preds, q8_preds)) / max(1, N),
+        "float_bytes": float_bytes,
+        "int8_bytes": qmodel.nbytes(),
+        "float_ms_per_sample": 1e3 * float_s / max(1, N),
+        "int8_ms_per_sample": 1e3 * q8_s / max(1, N),
+    }
+
+
+if __name__ == "__main__":
+    # python -m cnn.Quantize <model .mw/.mwb> <calibration data> <eval data> [<out.mwq>]
+    # data: a .shard file or a png folder (see cnn.Data); prints the accuracy report as JSON
+    if len(sys.argv) not in (4, 5):
+        sys.exit("usage: python -m cnn.Quantize <model> <calibration data> <eval data> [<out.mwq>]")
+
+    from cnn.Data import ImageFolder, Shard
+
+    def _dataset(path):
+        return Shard(path) if path.endswith(".shard") else ImageFolder(path)
+
+    model_path = sys.argv[1]
+    model = CNN.from_mwb(model_path) if model_path.endswith(".mwb") else CNN.from_mw(model_path)
+    qmodel = QuantizedCNN.from_cnn(model, _dataset(sys.argv[2]))
+    if len(sys.argv) == 5:
+        qmodel.save(sys.argv[4])
+    print(json.dumps(compare(model, qmodel, _dataset(sys.argv[3])), indent=2))
\ No newline at end of file
@@ -0,0 +1,74 @@
+import os
+import threading
+
+from cnn.CNN import CNN
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded models.
+
+    Each model file is loaded once and the same CNN is handed to every caller, keyed by path
+    (and use_c). The file's mtime and size are checked on every get(): if it changed, the old
+    model is evicted and the file is loaded again; loading one file does not hold up get()
+    for the others. Cached models are shared, so callers must only run inference on them
+    (predict / predict_batch / forward(train=False)), which leaves layers untouched;
+    predict_batch keeps its buffers per thread. .mwb files are mapped read-only, so training
+    a cached model raises instead of drifting from the file.
+
+        from cnn.Registry import registry
+        model = registry.get("models/3conv.mwb")
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}  # (abspath, use_c) -> ((mtime_ns, size), CNN)
+        self._loading = {}  # (abspath, use_c) -> Lock held while that file loads
+
+    @staticmethod
+    def _load(path, use_c):
+        if path.endswith(".mwb"):
+            return CNN.from_mwb(path, use_c, writable=False)
+        return CNN.from_mw(path, use_c)
+
+    def get(self, path, use_c=True):
+        key = (os.path.abspath(path), use_c)
+        st = os.stat(path)
+        stamp = (st.st_mtime_ns, st.st_size)
+
+        with self._lock:
+            hit = self._models.get(key)
+            if hit is not None and hit[0] == stamp:
+                return hit[1]
+            loading = self._loading.setdefault(key, threading.Lock())
+
+        # the file's own lock makes concurrent requests for it load it once, while the
+        # registry lock stays free for the other models
+        with loading:
+            with self._lock:
+                hit = self._models.get(key)
+                if hit is not None and hit[0] == stamp:
+                    return hit[1]
+
+            model = ModelRegistry._load(path, use_c)
+            with self._lock:
+                self._models[key] = (stamp, model)
+            return model
+
+    def evict(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            for key in [k for k in self._models if k[0] == path]:
+                del self._models[key]
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._models)
+
+
+# shared by everything in the process (e.g. all Streamlit sessions)
+registry = ModelRegistry()
\ No newline at end of file
@@ -0,0 +1,366 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from array import array
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from c_cnn.c_extension import cnn as kernels
+
+MAX_BODY = 1 << 20
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class _Request:
+    __slots__ = ("pixels", "kind", "future", "t0")
+
+    def __init__(self, pixels, kind, future):
+        self.pixels = pixels  # bytes-like, see Server.predict
+        self.kind = kind  # 'B' uint8 0..255, 'f' float32, 'd' float64
+        self.future = future
+        self.t0 = time.perf_counter()
+
+
+class Server:
+    """
+    Local inference server that groups concurrent requests into micro-batches.
+
+    Requests are queued, and a batch is cut once max_batch images are waiting or the oldest
+    has waited max_wait_ms. Each batch is copied into one reused input buffer and run through
+    model.predict_batch in a single worker thread (the kernels release the GIL, so the event
+    loop keeps accepting requests meanwhile), then every caller gets its own row back.
+
+    HTTP/1.1 over TCP or a Unix socket, keep-alive:
+        POST /predict   body: H*W raw pixels as uint8 (0..255), float32 or float64 (native
+                        order, told apart by length), or JSON {"pixels": [H*W floats in 0..1]}
+                        -> {"top": [k class indices, most probable first], "probs": [D floats]}
+        GET /stats      request latency percentiles (ms) and the batch size histogram
+        GET /health
+
+        python -m cnn.Server models/2conv.mwb --port 8000 [--max-batch 32] [--max-wait-ms 2]
+
+    or from Python, within a running event loop:
+        server = Server(model)
+        await server.start(port=8000)  # or start_unix(path); port=0 picks a free port
+        probs, top = await server.predict(pixels)
+    """
+
+    def __init__(self, model, max_batch=32, max_wait_ms=2.0, k=5, input_shape=(1, 32, 32), window=10000):
+        if max_batch < 1:
+            raise ValueError("max_batch must be >= 1")
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1e3
+        self.k = k
+        self.input_shape = tuple(input_shape)
+        self.n_in = 1
+        for s in self.input_shape:
+            self.n_in *= s
+
+        self._state = None  # (model, batch input buffer), replaced as a whole by swap()
+        self.swap(model)
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="cnn-server")
+        self._pending = []
+        self._wakeup = None
+        self._batcher = None
+        self._servers = []
+        self._conns = {}  # handler task -> writer of every open connection, ended by close()
+        self._busy = set()  # handler tasks between reading a whole request and sending its reply
+        self._closing = False
+
+        self.latencies = deque(maxlen=window)  # seconds, the last `window` requests
+        self.batch_sizes = Counter()
+        self.requests = 0
+        self.errors = 0
+
+    @property
+    def model(self):
+        return self._state[0]
+
+    def swap(self, model):
+        """
+        serve model from the next batch on; the batch in flight finishes on the old one, so
+        no request is dropped or sees a mix of the two
+        """
+        buf = array(model.dtype, [0.0]) * (self.max_batch * self.n_in)
+        self._state = (model, buf)
+
+    async def start(self, host="127.0.0.1", port=8000, sock=None):
+        """
+        listen on host:port, or on the already listening sock (e.g. one shared by pre-forked
+        workers); returns the asyncio server (its sockets give the port when port=0)
+        """
+        self._start_batcher()
+        if sock is not None:
+            server = await asyncio.start_server(self._handle, sock=sock)
+        else:
+            server = await asyncio.start_server(self._handle, host, port)
+        self._servers.append(server)
+        return server
+
+    async def start_unix(self, path):
+        self._start_batcher()
+        server = await asyncio.start_unix_server(self._handle, path)
+        self._servers.append(server)
+        return server
+
+    async def serve_forever(self):
+        await asyncio.gather(*(s.serve_forever() for s in self._servers))
+
+    async def close(self):
+        """stop listening, end open connections (a request in flight still gets its reply) and the batcher"""
+        for s in self._servers:
+            s.close()
+            await s.wait_closed()
+        self._servers.clear()
+        # idle keep-alive handlers see EOF, busy ones close after their reply; left to the
+        # loop's shutdown they would be cancelled
+        self._closing = True
+        for task, writer in self._conns.items():
+            if task not in self._busy:
+                writer.close()
+        await asyncio.gather(*self._conns, return_exceptions=True)
+        self._closing = False
+        if self._batcher is not None:
+            self._batcher.cancel()
+            self._batcher = None
+        self._executor.shutdown(wait=True)
+
+    def _start_batcher(self):
+        if self._batcher is None:
+            self._wakeup = asyncio.Event()
+            self._batcher = asyncio.get_running_loop().create_task(self._batch_loop())
+
+    # ---------------------------------------------------------------------
+    # Batching
+    # ---------------------------------------------------------------------
+
+    async def predict(self, pixels, kind=None):
+        """
+        (softmax probabilities list, top-k class indices list) of one image. pixels: H*W values
+        as a list of floats or a buffer; kind 'B' (uint8, scaled by 1/255 like cnn.Data), 'f'
+        or 'd' says how a buffer is read, by default from its length in bytes
+        """
+        if isinstance(pixels, (list, tuple)):
+            if len(pixels) != self.n_in:
+                raise ValueError(f"expected {self.n_in} pixels, got {len(pixels)}")
+            pixels, kind = memoryview(array('d', pixels)).cast('B'), 'd'
+        else:
+            pixels = memoryview(pixels).cast('B')
+            if kind is None:
+                kind = {self.n_in: 'B', 4 * self.n_in: 'f', 8 * self.n_in: 'd'}.get(len(pixels))
+            if kind is None or len(pixels) != self.n_in * array(kind).itemsize:
+                raise ValueError(f"expected {self.n_in} pixels as uint8, float32 or float64")
+
+        self._start_batcher()
+        req = _Request(pixels, kind, asyncio.get_running_loop().create_future())
+        self._pending.append(req)
+        self._wakeup.set()
+        return await req.future
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        pending = self._pending
+        while True:
+            while not pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+
+            deadline = loop.time() - (time.perf_counter() - pending[0].t0) + self.max_wait
+            while len(pending) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+
+            batch = pending[:self.max_batch]
+            del pending[:self.max_batch]
+            self.batch_sizes[len(batch)] += 1
+
+            try:
+                batch, failed, probs, top = await loop.run_in_executor(self._executor, self._run, batch)
+            except Exception as e:
+                failed, batch = [(req, e) for req in batch], []
+
+            # a request the model could not take fails alone, the rest of the batch still runs
+            self.errors += len(failed)
+            for req, e in failed:
+                if not req.future.done():
+                    req.future.set_exception(e)
+            if not batch:
+                continue
+
+            D = probs.shape[1]
+            rows = top.tolist()
+            now = time.perf_counter()
+            for i, req in enumerate(batch):
+                if not req.future.done():  # the caller may have gone away
+                    req.future.set_result((probs.data[i * D: (i + 1) * D].tolist(), rows[i]))
+                self.latencies.append(now - req.t0)
+            self.requests += len(batch)
+
+    def _run(self, batch):
+        """
+        worker thread: copy the batch into the input buffer and run the model; returns
+        (requests run, [(request, exception)] of those that could not be copied, probs, top)
+        """
+        n_in = self.n_in
+        model, buf = self._state
+        run, failed = [], []
+        for req in batch:
+            i = len(run)
+            try:
+                if req.kind == 'B':
+                    kernels.u8_to_real(req.pixels, 0, buf, i * n_in, n_in, 1.0 / 255.0)
+                else:
+                    kernels.cast(req.pixels.cast(req.kind), 0, buf, i * n_in, n_in)
+            except Exception as e:
+                failed.append((req, e))
+            else:
+                run.append(req)
+
+        if not run:
+            return run, failed, None, None
+        probs, top = model.predict_batch(memoryview(buf)[:len(run) * n_in], self.k, self.max_batch,
+                                         self.input_shape)
+        return run, failed, probs, top
+
+    def stats(self):
+        lat = sorted(self.latencies)
+
+        def pct(p):
+            return 1e3 * lat[min(len(lat) - 1, int(p / 100 * len(lat)))] if lat else None
+
+        batches = sum(self.batch_sizes.values())
+        return {
+            "pid": os.getpid(),
+            "requests": self.requests,
+            "errors": self.errors,
+            "batches": batches,
+            "mean_batch": sum(s * c for s, c in self.batch_sizes.items()) / max(1, batches),
+            "latency_ms": {"p50": pct(50), "p90": pct(90), "p99": pct(99), "max": 1e3 * lat[-1] if lat else None,
+                           "samples": len(lat)},
+            "batch_sizes": {str(s): self.batch_sizes[s] for s in sorted(self.batch_sizes)},
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1e3,
+        }
+
+    # ---------------------------------------------------------------------
+    # HTTP
+    # ---------------------------------------------------------------------
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._conns[task] = writer
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                parts = line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = h.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                if len(parts) != 3:
+                    status, payload = 400, {"error": "malformed request line"}
+                    headers["connection"] = "close"
+                else:
+                    try:
+                        length = int(headers.get("content-length") or 0)
+                    except ValueError:
+                        length = -1
+                    if length < 0:
+                        status, payload = 400, {"error": "malformed content-length"}
+                        headers["connection"] = "close"
+                    elif length > MAX_BODY:
+                        status, payload = 413, {"error": f"body over {MAX_BODY} bytes"}
+                        headers["connection"] = "close"
+                    else:
+                        body = await reader.readexactly(length)
+                        self._busy.add(task)
+                        status, payload = await self._route(parts[0], parts[1], headers, body)
+
+                data = json.dumps(payload).encode()
+                close = self._closing or headers.get("connection", "").lower() == "close"
+                writer.write(f"HTTP/1.1 {status} {_REASONS[status]}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\nConnection: {'close' if close else 'keep-alive'}"
+                             f"\r\n\r\n".encode() + data)
+                await writer.drain()
+                self._busy.discard(task)
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            del self._conns[task]
+            self._busy.discard(task)
+            writer.close()
+
+    async def _route(self, method, target, headers, body):
+        path = target.split("?", 1)[0]
+        if path == "/predict":
+            if method != "POST":
+                return 405, {"error": "use POST"}
+            try:
+                if headers.get("content-type", "").startswith("application/json"):
+                    probs, top = await self.predict(json.loads(body)["pixels"])
+                else:
+                    probs, top = await self.predict(body)
+            except (ValueError, KeyError, TypeError) as e:
+                return 400, {"error": str(e)}
+            except Exception as e:
+                return 500, {"error": str(e)}
+            return 200, {"top": top, "probs": probs}
+
+        if path == "/stats":
+            return 200, self.stats()
+        if path == "/health":
+            return 200, {"ok": True}
+        return 404, {"error": f"no route {path}"}
+
+
+async def _serve(args):
+    from cnn.Registry import registry
+
+    server = Server(registry.get(args.model), args.max_batch, args.max_wait_ms, args.k)
+    if args.unix:
+        await server.start_unix(args.unix)
+        print(f"serving {args.model} on {args.unix}")
+    else:
+        s = await server.start(args.host, args.port)
+        print(f"serving {args.model} on http://{args.host}:{s.sockets[0].getsockname()[1]}")
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="micro-batching inference server, see cnn.Server.Server")
+    parser.add_argument("model", help=".mw / .mwb model file")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--unix", help="listen on this Unix socket path instead of TCP")
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=2.0)
+    parser.add_argument("--k", type=int, default=5, help="top classes returned per image")
+    parser.add_argument("--threads", type=int, default=1, help="cnn.set_num_threads")
+    args = parser.parse_args()
+
+    kernels.set_num_threads(args.threads)
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
@@ -1,22 +1,59 @@
+import sys
 from array import array
 
 
+# element types: 'd' float64 (default), 'f' float32
+DTYPES = ('d', 'f')
+
+# struct format prefixes that mean native byte order, and the __array_interface__ type strings
+_NATIVE = "@=" + ('<' if sys.byteorder == "little" else '>')
+_TYPESTR = {'d': _NATIVE[-1] + "f8", 'f': _NATIVE[-1] + "f4"}
+
+# dtype -> array of zeros, grown to the largest Tensor.zero() so far
+_ZEROS = {}
+
+
 class Tensor:
-    def __init__(self, data, shape, offset=0):
-        self.data = Tensor._unpack(data)
+    __slots__ = ("data", "shape", "offset", "strides")
+
+    def __init__(self, data, shape, offset=0, dtype=None):
+        if dtype is not None and dtype not in DTYPES:
+            raise ValueError(f"dtype must be one of {DTYPES}")
+        self.data = Tensor._unpack(data, dtype)
         self.shape = tuple(shape)
         self.offset = int(offset)
         self.strides = Tensor._compute_strides(self.shape)
 
-    @staticmethod
-    def _unpack(collection):
-        if isinstance(collection, array) and collection.typecode == 'd':
-            return collection
+    @property
+    def dtype(self):
+        return self.data.typecode if isinstance(self.data, array) else self.data.format
 
+    @staticmethod
+    def _unpack(collection, dtype=None):
+        if isinstance(collection, array) and collection.typecode in DTYPES:
+            if dtype is None or collection.typecode == dtype:
+                return collection
+
+        # views onto shared/mapped memory are used in place, never copied
+        if isinstance(collection, memoryview) and collection.format in DTYPES and collection.ndim == 1:
+            if dtype is None or collection.format == dtype:
+                return collection
+
+        # any other buffer (numpy array, mmap, bytes, ...)
+        if not isinstance(collection, (list, tuple)):
+            flat = Tensor._flat_view(collection, dtype)
+            if flat is not None:
+                if flat.format in DTYPES and (dtype is None or flat.format == dtype):
+                    return flat
+                return array(dtype or 'd', flat)
+            if hasattr(collection, "tolist"):  # strided buffers, numpy arrays of other shapes
+                collection = collection.tolist()
+
+        dtype = dtype or 'd'
         if all([type(c) != list for c in collection]):
-            return array('d', map(float, collection))
+            return array(dtype, map(float, collection))
 
-        out = array('d')
+        out = array(dtype)
         stack = [collection]
         while stack:
             cur = stack.pop()
@@ -27,6 +64,41 @@ class Tensor:
                 out.append(float(cur))
         return out
 
+    @staticmethod
+    def _flat_view(obj, dtype=None):
+        """
+        flat memoryview of the elements of a C-contiguous, native-order buffer, no copy;
+        bytes / bytearray are raw float64 (or dtype) values. None if obj is not such a buffer
+        """
+        try:
+            view = memoryview(obj)
+        except TypeError:
+            return None
+
+        if isinstance(obj, (bytes, bytearray)):
+            fmt = dtype or 'd'
+            if len(view) % array(fmt).itemsize:
+                raise ValueError(f"{len(view)} bytes is not a whole number of {fmt!r} values")
+        else:
+            fmt = view.format.lstrip(_NATIVE)
+        if not view.c_contiguous or view.ndim == 0:
+            return None
+
+        try:
+            return view.cast('B').cast(fmt)
+        except (TypeError, ValueError):  # formats memoryview can't cast, e.g. structs
+            return None
+
+    @staticmethod
+    def from_buffer(obj, shape=None, offset=0, dtype=None):
+        """
+        Tensor over a C-contiguous float64 / float32 buffer (numpy array, memoryview, mmap, bytes, ...)
+        without copying; shape defaults to the buffer's own. Other element types are copied into dtype
+        """
+        if shape is None:
+            shape = memoryview(obj).shape
+        return Tensor(obj, shape, offset, dtype)
+
     @staticmethod
     def _compute_strides(shape):
         strides = [1] * len(shape)
@@ -35,19 +107,49 @@ class Tensor:
         return tuple(strides)
 
     @staticmethod
-    def zeros(shape):
+    def zeros(shape, dtype='d'):
         n = 1
         for s in shape:
             n *= s
-        return Tensor(array('d', [0.0]) * n, shape)
+        return Tensor(array(dtype, [0.0]) * n, shape)
+
+    def astype(self, dtype):
+        """contiguous copy with element type dtype, or self if it already has it"""
+        if dtype == self.dtype:
+            return self
+        return Tensor(array(dtype, self.data[self.offset: self.offset + self.volume()]), self.shape)
 
     def args(self):
         return memoryview(self.data), self.offset, *self.shape, *self.strides
 
+    def buffer(self):
+        """
+        the elements as a memoryview of shape self.shape, no copy. A Tensor is not a buffer
+        itself: use t.buffer() where memoryview(t) would be, numpy.asarray(t) also gives a view
+        """
+        n = self.volume()
+        view = memoryview(self.data)[self.offset: self.offset + n]
+        return view.cast('B').cast(self.dtype, self.shape) if n else view
+
+    @property
+    def __array_interface__(self):
+        """numpy.asarray(t) is a view of the tensor's elements, not a copy"""
+        n = self.volume()
+        return {"version": 3, "shape": self.shape, "typestr": _TYPESTR[self.dtype],
+                "data": memoryview(self.data)[self.offset: self.offset + n]}
+
     def zero(self):
         n = self.volume()
         o = self.offset
-        self.data[o:o + n] = array('d', [0.0]) * n
+        memoryview(self.data)[o:o + n] = Tensor._zeros(self.dtype, n)
+
+    @staticmethod
+    def _zeros(dtype, n):
+        """memoryview of n zeros, sliced from one cached buffer per dtype so zero() doesn't allocate"""
+        buf = _ZEROS.get(dtype)
+        if buf is None or len(buf) < n:
+            buf = _ZEROS[dtype] = array(dtype, [0.0]) * n
+        return memoryview(buf)[:n]
 
     def volume(self):
         n = 1
@@ -100,5 +202,40 @@ class Tensor:
             raise ValueError("volume mismatch")
         return Tensor(self.data, new_shape, offset=self.offset)
 
+    def __getstate__(self):
+        state = {name: getattr(self, name) for name in Tensor.__slots__}
+        # views onto mapped/shared memory can't be pickled, send a copy instead
+        if not isinstance(self.data, array):
+            state["data"] = array(self.dtype, self.data)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def __str__(self):
-        return f"Tensor({self.data},{self.shape},{self.offset})"
\ No newline at end of file
+        data = self.data if isinstance(self.data, array) else array(self.dtype, self.data)
+        return f"Tensor({data},{self.shape},{self.offset})"
+
+
+class View(Tensor):
+    """
+    Tensor over a window of a buffer that is moved in place: view.at(offset) points it at other
+    elements, so a loop over the samples of a dataset copies nothing and makes no object per
+    sample. data is used as given (a float64 / float32 array or flat memoryview), and the
+    strides are only recomputed when at() changes the shape.
+    """
+    __slots__ = ()
+
+    def __init__(self, data, shape, offset=0):
+        self.data = data
+        self.shape = tuple(shape)
+        self.offset = offset
+        self.strides = Tensor._compute_strides(self.shape)
+
+    def at(self, offset, shape=None):
+        if shape is not None and shape != self.shape:
+            self.shape = shape
+            self.strides = Tensor._compute_strides(shape)
+        self.offset = offset
+        return self
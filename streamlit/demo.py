@@ -10,7 +10,7 @@ import streamlit as st
 from streamlit_drawable_canvas import st_canvas
 
 from cnn.Tensor import Tensor
-from cnn.CNN import CNN
+from cnn.Registry import registry
 
 MODEL_OPTIONS = ["2conv (Simpler)", "3conv (Stronger)"]
 
@@ -101,23 +101,36 @@ else:
             st.markdown("Draw something!")
         characters()
 
+
+@st.cache_data
+def load_labels(path):
+    labels = pd.read_csv(path)
+    consonants = sorted(labels['Label'].tolist())
+    symbols = {k: v for k, v in zip(labels['Label'], labels['Devanagari Label'])}
+    return consonants, symbols
+
+
+# loaded once per process and shared by every session, reloaded if the file changes
 if model_choice == MODEL_OPTIONS[0]:
-    model = CNN.from_mw("models/2conv.mw")
+    model = registry.get("models/2conv.mwb")
 else:
-    model = CNN.from_mw("models/3conv.mw")
+    model = registry.get("models/3conv.mwb")
+
+# the plan's buffers are per-session, the weights it reads are the shared model's
+if st.session_state.get("plan") is None or st.session_state.plan.model is not model:
+    st.session_state.plan = model.compile((1, IMAGE_SIZE, IMAGE_SIZE))
+plan = st.session_state.plan
 
-labels = pd.read_csv("streamlit/labels.csv")
-consonants = sorted(labels['Label'].tolist())
-symbols = {k: v for k, v in zip(labels['Label'], labels['Devanagari Label'])}
+consonants, symbols = load_labels("streamlit/labels.csv")
 
 with c2:
     if input_img is not None:
         if type(input_img) is np.ndarray and show_image:
             st.image(input_img, width=input_img.shape[0] * 4)
-        x = Tensor(input_img.tolist(), (1, IMAGE_SIZE, IMAGE_SIZE))
+        x = Tensor(input_img, (1, IMAGE_SIZE, IMAGE_SIZE))  # a view of the float64 canvas, no copy
 
         if sum(x.data) != 0:
-            probs = model.predict(x)
+            probs = plan.predict(x)
             preds = {k: round(v * 100, 2) for k, v in zip(consonants, probs)}
             preds = {k: v for k, v in sorted(preds.items(), key=lambda item: item[1], reverse=True)}
 